@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import math
+import time
+import weakref
+
+
+class AdmissionRejected(Exception):
+    """Requisição recusada pelo controle de admissão (vira HTTP 429)"""
+    def __init__(self, motivo: str, retry_after: int):
+        super().__init__(motivo)
+        self.motivo = motivo
+        self.retry_after = retry_after
+
+
+class AdmissionSlot:
+    """Vaga ocupada por uma requisição admitida; liberar é idempotente"""
+    def __init__(self, controller: "AdmissionController", espera: float):
+        self.controller = controller
+        self.espera = espera
+        self.inicio = time.monotonic()
+        self._liberada = False
+
+    def release(self):
+        if self._liberada:
+            return
+        self._liberada = True
+        self.controller._libera(time.monotonic() - self.inicio)
+
+    def bind(self, generator):
+        """
+        Mantém a vaga durante o stream e a libera ao final. Se o gerador nunca
+        for iniciado (cliente desconectou antes), a vaga é liberada na coleta.
+        """
+        async def _com_vaga():
+            try:
+                async for item in generator:
+                    yield item
+            finally:
+                self.release()
+
+        wrapper = _com_vaga()
+        weakref.finalize(wrapper, self.release)
+        return wrapper
+
+
+class AdmissionController:
+    """
+    Controle de admissão por endpoint: limite de execuções simultâneas,
+    fila de espera limitada (FIFO) e tempo máximo de espera na fila
+    """
+    def __init__(self, nome: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.nome = nome
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaforo = asyncio.Semaphore(max_concurrent)
+        self._aguardando = 0
+        self._ativos = 0
+        self._duracao_media = 1.0  # média móvel do tempo com a vaga (s)
+        self._stats = {
+            'admitidas': 0,
+            'rejeitadas_fila_cheia': 0,
+            'rejeitadas_timeout': 0,
+            'espera_total_s': 0.0,
+            'espera_max_s': 0.0
+        }
+
+    def retry_after(self) -> int:
+        """Estimativa (s) de quando haverá vaga, para o header Retry-After"""
+        estimativa = self._duracao_media * (self._aguardando + 1) / self.max_concurrent
+        return max(1, math.ceil(estimativa))
+
+    async def acquire(self) -> AdmissionSlot:
+        inicio = time.monotonic()
+        if not self._semaforo.locked():
+            # Vaga livre e ninguém na fila: adquire sem suspender
+            await self._semaforo.acquire()
+        else:
+            if self._aguardando >= self.max_queue:
+                self._stats['rejeitadas_fila_cheia'] += 1
+                raise AdmissionRejected("fila cheia", self.retry_after())
+
+            self._aguardando += 1
+            try:
+                await asyncio.wait_for(self._semaforo.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._stats['rejeitadas_timeout'] += 1
+                raise AdmissionRejected("tempo de espera na fila esgotado", self.retry_after())
+            finally:
+                self._aguardando -= 1
+
+        espera = time.monotonic() - inicio
+        self._ativos += 1
+        self._stats['admitidas'] += 1
+        self._stats['espera_total_s'] += espera
+        self._stats['espera_max_s'] = max(self._stats['espera_max_s'], espera)
+        return AdmissionSlot(self, espera)
+
+    def _libera(self, duracao: float):
+        self._ativos -= 1
+        self._duracao_media = 0.8 * self._duracao_media + 0.2 * duracao
+        self._semaforo.release()
+
+    def stats(self) -> dict:
+        admitidas = self._stats['admitidas']
+        return {
+            'endpoint': self.nome,
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'ativos': self._ativos,
+            'aguardando': self._aguardando,
+            **self._stats,
+            'espera_media_s': self._stats['espera_total_s'] / admitidas if admitidas else 0.0,
+            'duracao_media_s': self._duracao_media
+        }
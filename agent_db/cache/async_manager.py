@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+from typing import Optional
+
+import asyncpg
+
+from config_db import config
+import metrics
+
+from agent_db.cache.compression import colunas_resposta, descomprime
+from agent_db.cache.l1 import CANAL_INVALIDACAO, L1Cache, nova_origem
+from agent_db.cache.normalizer import QueryNormalizer, normalizador
+from agent_db.cache.stats import CacheStats, resume, soma
+
+
+class AsyncCacheManager:
+    """
+    Leitura assíncrona do cache (asyncpg, pool próprio) para ser usada direto
+    no event loop: um cache hit custa uma ida ao banco sem ocupar thread do
+    executor nem travar os outros streams. As gravações ficam no
+    CacheManager.set, que roda no executor junto com o agente.
+    """
+    def __init__(self, pool: Optional["asyncpg.Pool"] = None, l1: Optional[L1Cache] = None,
+                 origem: Optional[str] = None, stats: Optional[CacheStats] = None,
+                 comprimidas: bool = False, normalizer: Optional[QueryNormalizer] = None):
+        self.pool = pool
+        self.l1 = l1
+        self.origem = origem or nova_origem()
+        self.stats = stats
+        # Colunas da migração 003 presentes
+        self.comprimidas = comprimidas
+        self.normalizer = normalizer or normalizador
+
+    def compartilha(self, cache_manager):
+        """Usa o L1, a origem das notificações, os contadores, as colunas e o normalizador do CacheManager síncrono"""
+        self.l1 = cache_manager.l1
+        self.origem = cache_manager.origem
+        self.stats = cache_manager.stats
+        self.comprimidas = cache_manager.comprimidas
+        self.normalizer = cache_manager.normalizer
+
+    async def abre(self) -> "AsyncCacheManager":
+        """Cria o pool de conexões assíncronas (se não foi injetado)"""
+        if self.pool is None:
+            self.pool = await asyncpg.create_pool(
+                host=config.POSTGRES_HOST,
+                port=int(config.POSTGRES_PORT) if config.POSTGRES_PORT else None,
+                user=config.POSTGRES_USER,
+                password=config.POSTGRES_PASSWORD,
+                database=config.POSTGRES_DB,
+                min_size=config.CACHE_POOL_MIN,
+                max_size=config.CACHE_POOL_MAX,
+                timeout=config.CACHE_POOL_TIMEOUT,
+            )
+            print('✅ Cache Manager assíncrono inicializado com sucesso')
+        return self
+
+    def get_query_cache(self, query: str) -> str:
+        return self.normalizer.chave(query)
+
+    async def aget(self, query_hash: str):
+        """Recupera uma resposta do cache se existir e não expirou (L1 antes do banco)"""
+        return (await self.aget_com_graca(query_hash))[0]
+
+    async def aget_com_graca(self, query_hash: str, graca: float = 0.0):
+        """(resposta, expirada): como CacheManager.get_com_graca"""
+        if self.l1 is not None:
+            resposta = self.l1.get(query_hash)
+            metrics.CACHE_L1_CONSULTAS.inc(resultado="hit" if resposta is not None else "miss")
+            if resposta is not None:
+                if self.stats is not None:
+                    self.stats.consulta(True)
+                return resposta, False
+
+        result = await self.pool.fetchrow(
+            f"""
+            SELECT {colunas_resposta(self.comprimidas)}, cach_expi_at, cach_expi_at <= NOW() FROM cache_agente
+            WHERE cach_hash = $1 AND cach_expi_at > NOW() - $2 * INTERVAL '1 second'
+            """,
+            query_hash, float(graca),
+            timeout=config.CACHE_POOL_TIMEOUT
+        )
+        if self.stats is not None:
+            self.stats.consulta(result is not None)
+        if not result:
+            return None, False
+        resposta = descomprime(result[1], result[2], result[0])
+        if result[4]:
+            return resposta, True
+        if self.l1 is not None and resposta:
+            self.l1.set(query_hash, resposta, result[3].timestamp())
+        return resposta, False
+
+    async def astats(self) -> dict:
+        """Retorna estatísticas do cache (tabelas de estatística incremental, sem COUNT(*) na cache_agente)"""
+        try:
+            async with self.pool.acquire(timeout=config.CACHE_POOL_TIMEOUT) as conexao:
+                contadores = {linha[0]: int(linha[1]) for linha in await conexao.fetch(
+                    "SELECT cest_nome, cest_valo FROM cache_estatistica")}
+                histograma = {linha[0]: (int(linha[1]), int(linha[2])) for linha in await conexao.fetch(
+                    "SELECT ceho_hora, ceho_qtd, ceho_byte FROM cache_expiracao_hora")}
+            if self.stats is not None:
+                contadores, histograma = soma(contadores, histograma, *self.stats.pendentes())
+            return resume(contadores, histograma)
+        except Exception as e:
+            print(f"❌ Erro ao obter estatísticas do cache: {e}")
+            return {'total_entries': 0, 'active_entries': 0, 'expired_entries': 0}
+
+    def pool_stats(self) -> dict:
+        """Ocupação do pool de conexões assíncronas"""
+        if self.pool is None:
+            return {}
+        return {
+            "abertas": self.pool.get_size(),
+            "ociosas": self.pool.get_idle_size(),
+            "em_uso": self.pool.get_size() - self.pool.get_idle_size(),
+            "min_size": self.pool.get_min_size(),
+            "max_size": self.pool.get_max_size(),
+        }
+
+    async def aclose(self):
+        if self.pool is not None:
+            await self.pool.close()
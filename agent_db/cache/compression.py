@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import zlib
+from typing import Optional, Tuple
+
+# Marcador gravado em cach_form: algoritmo e versão do formato (NULL = texto puro em cach_resp)
+FORMATO_ZLIB = "zlib:1"
+FORMATO_ZSTD = "zstd:1"
+
+
+def _zstd():
+    import zstandard
+
+    return zstandard
+
+
+class Compressor:
+    """
+    Comprime as respostas longas antes de gravar em cach_resp_comp (bytea).
+    Respostas menores que `minimo` bytes, ou que não diminuem, continuam em
+    texto puro: o ganho não paga a descompressão no hit.
+    """
+    def __init__(self, algoritmo: str = "zlib", nivel: Optional[int] = None, minimo: int = 512):
+        if algoritmo == "zstd":
+            try:
+                self._zstd = _zstd().ZstdCompressor(level=nivel if nivel is not None else 3)
+            except ImportError:
+                print("⚠️ Cache: zstandard não instalado, usando zlib na compressão")
+                algoritmo = "zlib"
+        elif algoritmo != "zlib":
+            raise ValueError(f"Algoritmo de compressão desconhecido: {algoritmo}")
+        self.algoritmo = algoritmo
+        self.nivel = nivel if nivel is not None else (3 if algoritmo == "zstd" else 6)
+        self.minimo = minimo
+
+    @classmethod
+    def from_config(cls) -> Optional["Compressor"]:
+        """Compressor conforme CACHE_COMPRESSION* (None quando desligada)"""
+        from config_db import config
+
+        if config.CACHE_COMPRESSION in ("", "off", "false", "0"):
+            return None
+        return cls(config.CACHE_COMPRESSION, nivel=config.CACHE_COMPRESSION_LEVEL,
+                   minimo=config.CACHE_COMPRESSION_MIN_BYTES)
+
+    @property
+    def formato(self) -> str:
+        return FORMATO_ZSTD if self.algoritmo == "zstd" else FORMATO_ZLIB
+
+    def comprime(self, texto: Optional[str]) -> Tuple[Optional[str], Optional[bytes]]:
+        """(cach_form, cach_resp_comp), ou (None, None) se a resposta fica em texto puro"""
+        if not texto:
+            return None, None
+        bruto = texto.encode("utf-8")
+        if len(bruto) < self.minimo:
+            return None, None
+        if self.algoritmo == "zstd":
+            dados = self._zstd.compress(bruto)
+        else:
+            dados = zlib.compress(bruto, self.nivel)
+        if len(dados) >= len(bruto):
+            return None, None
+        return self.formato, dados
+
+
+def descomprime(formato: Optional[str], dados, texto: Optional[str] = None) -> Optional[str]:
+    """Resposta em texto a partir das colunas gravadas (cach_form, cach_resp_comp, cach_resp)"""
+    if not formato:
+        return texto
+    if formato == FORMATO_ZLIB:
+        return zlib.decompress(dados).decode("utf-8")
+    if formato == FORMATO_ZSTD:
+        return _zstd().ZstdDecompressor().decompress(bytes(dados)).decode("utf-8")
+    raise ValueError(f"Formato de resposta desconhecido em cach_form: {formato}")
+
+
+def colunas_resposta(comprimidas: bool) -> str:
+    """Colunas lidas no SELECT: cach_resp, cach_form, cach_resp_comp (sem a migração 003, só o texto)"""
+    return "cach_resp, cach_form, cach_resp_comp" if comprimidas else "cach_resp, NULL, NULL"
+
+
+def tamanho_resposta(comprimidas: bool) -> str:
+    """Expressão SQL dos bytes gravados da resposta (comprimida ou não)"""
+    if comprimidas:
+        return "COALESCE(octet_length(cach_resp_comp), octet_length(cach_resp))"
+    return "octet_length(cach_resp)"
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+import re
+import threading
+import time
+from typing import Iterable, List, Optional, Set
+
+# Chave do pg_try_advisory_xact_lock da verificação: um worker compara os contadores por vez
+LOCK_DEPENDENCIAS = 7301003
+
+_COMENTARIOS = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_LITERAIS = re.compile(r"'(?:[^']|'')*'")
+# FROM que não é origem de dados: EXTRACT(year FROM ...), SUBSTRING(x FROM 1), IS DISTINCT FROM
+_FUNCOES_FROM = re.compile(r"\b(?:EXTRACT|SUBSTRING|TRIM|OVERLAY|POSITION)\s*\([^()]*\)|\bDISTINCT\s+FROM\b",
+                           re.IGNORECASE)
+_CTES = re.compile(r"(?:\bWITH\s+(?:RECURSIVE\s+)?|,\s*)([\w\"]+)\s*(?:\([^)]*\)\s*)?AS\s*\(", re.IGNORECASE)
+# FROM/JOIN seguidos de uma lista "tabela [AS] alias, tabela [AS] alias"
+_ORIGENS = re.compile(
+    r"\b(?:FROM|JOIN)\s+((?:[\w\".]+(?:\s+(?:AS\s+)?(?!(?:WHERE|ON|JOIN|GROUP|ORDER|LIMIT|INNER|LEFT|RIGHT|"
+    r"FULL|CROSS|NATURAL|UNION|HAVING|USING|OFFSET|WINDOW|EXCEPT|INTERSECT)\b)\w+)?\s*,\s*)*[\w\".]+)",
+    re.IGNORECASE
+)
+_NOME = re.compile(r"^[\w\".]+")
+_IDENTIFICADORES = re.compile(r"[A-Za-z_]\w*")
+_PALAVRAS_SQL = frozenset("""
+    select from where join inner left right full cross natural on using and or not in is null as distinct
+    group by order having limit offset union all except intersect case when then else end with recursive
+    asc desc between like ilike exists any some true false interval count sum avg min max coalesce cast
+""".split())
+
+
+def tabelas_do_sql(sql: str) -> Set[str]:
+    """
+    Tabelas lidas por uma consulta (FROM/JOIN, sem schema, em minúsculas).
+    Nomes de CTEs e subconsultas não contam; funções em FROM podem aparecer
+    como falso positivo, o que só causa uma invalidação a mais.
+    """
+    sql = _FUNCOES_FROM.sub(" 0 ", _LITERAIS.sub("''", _COMENTARIOS.sub(" ", sql or "")))
+    ctes = {nome.strip('"').lower() for nome in _CTES.findall(sql)}
+    tabelas = set()
+    for lista in _ORIGENS.findall(sql):
+        for item in lista.split(","):
+            nome = _NOME.match(item.strip())
+            if not nome:
+                continue
+            tabela = nome.group(0).split(".")[-1].strip('"').lower()
+            if tabela and tabela not in ctes and not tabela.isdigit():
+                tabelas.add(tabela)
+    return tabelas
+
+
+def tabelas_das_consultas(consultas: Iterable[str]) -> List[str]:
+    tabelas = set()
+    for consulta in consultas:
+        tabelas |= tabelas_do_sql(consulta)
+    return sorted(tabelas)
+
+
+def colunas_das_consultas(consultas: Iterable[str]) -> List[str]:
+    """Identificadores citados nas consultas fora das palavras-chave (colunas, aliases e funções como CURRENT_DATE)"""
+    colunas = set()
+    for consulta in consultas:
+        sql = _LITERAIS.sub("''", _COMENTARIOS.sub(" ", consulta or ""))
+        colunas |= {nome.lower() for nome in _IDENTIFICADORES.findall(sql)}
+    return sorted(colunas - _PALAVRAS_SQL)
+
+
+class ChangeDetector:
+    """
+    Invalida as respostas cujas tabelas mudaram: a cada `intervalo` segundos
+    compara os contadores de escrita de pg_stat_user_tables (inserts, updates
+    e deletes) das tabelas em cache_dependencia com a última leitura gravada
+    em cache_tabela_versao e expira só as entradas dependentes das alteradas
+    """
+    def __init__(self, cache_manager, intervalo: float = 30.0):
+        self.cache_manager = cache_manager
+        self.intervalo = intervalo
+        self._parar = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {
+            "verificacoes": 0,
+            "alteradas_ultima": [],
+            "invalidadas_total": 0,
+            "ultima_verificacao": None,
+            "puladas": 0,
+            "erros": 0,
+            "ultimo_erro": None,
+        }
+
+    @classmethod
+    def from_config(cls, cache_manager) -> "ChangeDetector":
+        from config_db import config
+
+        return cls(cache_manager, intervalo=config.CACHE_DEPENDENCY_INTERVAL)
+
+    def inicia(self) -> "ChangeDetector":
+        if self.intervalo > 0 and self.cache_manager.dependencias:
+            self._thread = threading.Thread(target=self._roda, name="cache_dependencias", daemon=True)
+            self._thread.start()
+        return self
+
+    def _roda(self):
+        while not self._parar.is_set():
+            self.executa()
+            self._parar.wait(self.intervalo)
+
+    def executa(self) -> int:
+        """Uma verificação: retorna quantas entradas foram invalidadas (-1 se outro worker verificava)"""
+        def _verifica(connection):
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (LOCK_DEPENDENCIAS,))
+                if not cursor.fetchone()[0]:
+                    connection.rollback()
+                    return None, []
+                cursor.execute("SELECT DISTINCT cdep_tabe FROM cache_dependencia")
+                tabelas = [linha[0] for linha in cursor.fetchall()]
+                if not tabelas:
+                    connection.commit()
+                    return [], []
+                marcadores = ", ".join(["%s"] * len(tabelas))
+                cursor.execute(
+                    f"""
+                    SELECT relname, SUM(n_tup_ins + n_tup_upd + n_tup_del) FROM pg_stat_user_tables
+                    WHERE relname IN ({marcadores})
+                    GROUP BY relname
+                    """,
+                    tabelas
+                )
+                atuais = {tabela: int(mudancas) for tabela, mudancas in cursor.fetchall()}
+                cursor.execute("SELECT ctve_tabe, ctve_muda FROM cache_tabela_versao")
+                gravadas = {tabela: int(mudancas) for tabela, mudancas in cursor.fetchall()}
+                # Tabela vista pela primeira vez: só registra a referência
+                alteradas = sorted(t for t, m in atuais.items() if t in gravadas and gravadas[t] != m)
+                expiradas = self.cache_manager.expira_dependentes(cursor, alteradas) if alteradas else []
+                for tabela, mudancas in atuais.items():
+                    if gravadas.get(tabela) != mudancas:
+                        cursor.execute(
+                            """
+                            INSERT INTO cache_tabela_versao (ctve_tabe, ctve_muda) VALUES (%s, %s)
+                            ON CONFLICT (ctve_tabe) DO UPDATE SET ctve_muda = EXCLUDED.ctve_muda, ctve_veri_at = NOW()
+                            """,
+                            (tabela, mudancas)
+                        )
+                connection.commit()
+                return expiradas, alteradas
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                cursor.close()
+
+        try:
+            expiradas, alteradas = self.cache_manager._executa(_verifica)
+        except Exception as e:
+            with self._lock:
+                self._stats["erros"] += 1
+                self._stats["ultimo_erro"] = str(e)
+            print(f"❌ Erro ao verificar alterações nas tabelas do cache: {e}")
+            return 0
+        with self._lock:
+            self._stats["verificacoes"] += 1
+            self._stats["ultima_verificacao"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+            if expiradas is None:
+                # Outro worker está verificando
+                self._stats["puladas"] += 1
+                return -1
+        # Após o commit: L1 e estatísticas deste processo (os outros recebem o NOTIFY)
+        self.cache_manager.registra_expiradas(expiradas)
+        invalidadas = len(expiradas)
+        with self._lock:
+            self._stats["alteradas_ultima"] = alteradas
+            self._stats["invalidadas_total"] += invalidadas
+        if invalidadas:
+            print(f"🔄 Cache: {invalidadas} respostas invalidadas por alterações em {', '.join(alteradas)}")
+        return invalidadas
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"intervalo": self.intervalo, "ativo": self._thread is not None, **self._stats}
+
+    def close(self):
+        self._parar.set()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+import select
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+# Canal do LISTEN/NOTIFY usado para invalidar o L1 dos outros workers
+CANAL_INVALIDACAO = "cache_agente_invalida"
+
+
+class L1Cache:
+    """
+    Cache em memória na frente da tabela cache_agente: LRU limitado por número
+    de entradas e por bytes, respeitando a expiração (cach_expi_at) de cada item
+    """
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 32 * 1024 * 1024, max_age: float = 300.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._itens: "OrderedDict[str, tuple]" = OrderedDict()  # hash -> (resposta, expira_em, bytes)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidacoes = 0
+
+    def get(self, query_hash: str) -> Optional[str]:
+        with self._lock:
+            item = self._itens.get(query_hash)
+            if item is None:
+                self.misses += 1
+                return None
+            resposta, expira_em, _ = item
+            if expira_em <= time.time():
+                self._remove(query_hash)
+                self.misses += 1
+                return None
+            self._itens.move_to_end(query_hash)
+            self.hits += 1
+            return resposta
+
+    def set(self, query_hash: str, resposta: str, expira_em: float):
+        """Guarda a resposta até expira_em (epoch), limitado a max_age segundos"""
+        expira_em = min(expira_em, time.time() + self.max_age)
+        tamanho = len(resposta.encode("utf-8")) if isinstance(resposta, str) else len(str(resposta))
+        if tamanho > self.max_bytes or expira_em <= time.time():
+            return
+        with self._lock:
+            if query_hash in self._itens:
+                self._remove(query_hash)
+            self._itens[query_hash] = (resposta, expira_em, tamanho)
+            self._bytes += tamanho
+            while len(self._itens) > self.max_entries or self._bytes > self.max_bytes:
+                antigo = next(iter(self._itens))
+                self._remove(antigo)
+                self.evictions += 1
+
+    def _remove(self, query_hash: str):
+        _, _, tamanho = self._itens.pop(query_hash)
+        self._bytes -= tamanho
+
+    def invalida(self, query_hash: str):
+        with self._lock:
+            if query_hash in self._itens:
+                self._remove(query_hash)
+                self.invalidacoes += 1
+
+    def limpa(self):
+        with self._lock:
+            self.invalidacoes += len(self._itens)
+            self._itens.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entradas": len(self._itens),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidacoes": self.invalidacoes,
+            }
+
+
+class InvalidationListener:
+    """
+    Thread com uma conexão dedicada em LISTEN no canal de invalidação. Cada
+    NOTIFY traz "<origem>:<hash>"; mensagens do próprio processo são ignoradas.
+    Ao reconectar, o L1 inteiro é descartado (notificações podem ter se perdido).
+    """
+    def __init__(self, connect: Callable[[], Any], l1: L1Cache, origem: str,
+                 canal: str = CANAL_INVALIDACAO, intervalo: float = 5.0):
+        self.connect = connect
+        self.l1 = l1
+        self.origem = origem
+        self.canal = canal
+        self.intervalo = intervalo
+        self.conectado = False
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._roda, name="cache_l1_listen", daemon=True)
+
+    def inicia(self) -> "InvalidationListener":
+        self._thread.start()
+        return self
+
+    def _roda(self):
+        espera = 1.0
+        while not self._parar.is_set():
+            conexao = None
+            try:
+                conexao = self.connect()
+                conexao.autocommit = True
+                cursor = conexao.cursor()
+                cursor.execute(f"LISTEN {self.canal}")
+                cursor.close()
+                if espera > 1.0:
+                    # Reconectado: o que mudou enquanto estava fora não foi notificado
+                    self.l1.limpa()
+                    print("🔌 Cache L1: LISTEN reconectado, L1 descartado")
+                self.conectado = True
+                espera = 1.0
+                while not self._parar.is_set():
+                    if select.select([conexao], [], [], self.intervalo) == ([], [], []):
+                        continue
+                    conexao.poll()
+                    while conexao.notifies:
+                        self._processa(conexao.notifies.pop(0).payload)
+            except Exception as e:
+                if self._parar.is_set():
+                    break
+                self.conectado = False
+                self.l1.limpa()
+                print(f"⚠️ Cache L1: LISTEN falhou ({e}), tentando novamente em {espera:.0f}s")
+                self._parar.wait(espera)
+                espera = min(espera * 2, 60.0)
+            finally:
+                if conexao is not None:
+                    try:
+                        conexao.close()
+                    except Exception:
+                        pass
+        self.conectado = False
+
+    def _processa(self, payload: str):
+        origem, _, query_hash = payload.partition(":")
+        if origem == self.origem:
+            return
+        if query_hash == "*":
+            self.l1.limpa()
+        else:
+            self.l1.invalida(query_hash)
+
+    def close(self):
+        self._parar.set()
+
+
+def nova_origem() -> str:
+    """Identificador deste processo nas mensagens de invalidação"""
+    return uuid.uuid4().hex[:12]
@@ -6,136 +6,470 @@ import sys
 if sys.platform.startswith('win'):
     os.environ['PYTHONIOENCODING'] = 'utf-8'
 
-import hashlib
 import json
 from datetime import datetime, timedelta
 import psycopg2
 from config_db import config
+import metrics
 import time
 
+from agent_db.cache import migrations
+from agent_db.cache.compression import Compressor, colunas_resposta, descomprime, tamanho_resposta
+from agent_db.cache.l1 import CANAL_INVALIDACAO, InvalidationListener, L1Cache, nova_origem
+from agent_db.cache.normalizer import QueryNormalizer, normalizador
+from agent_db.cache.pool import ERROS_CONEXAO, ConnectionPool
+from agent_db.cache.stats import CacheStats
+from agent_db.cache.ttl import PESO_REFRESH, TTLPolicy, assinatura
+
+# Chave do pg_try_advisory_xact_lock da varredura: um worker remove expirados por vez
+LOCK_VARREDURA = 7301002
+
+# Acima disso, uma invalidação em massa descarta o L1 inteiro dos outros workers
+MAX_NOTIFICACOES = 100
+
 
 class CacheManager:
-    def __init__(self):
-        # Conectar ao banco PostgreSQL
+    def __init__(self, connection=None, connect=None, pool: ConnectionPool = None,
+                 l1: L1Cache = None, escuta_invalidacao: bool = None,
+                 normalizer: QueryNormalizer = None):
+        # Pool de conexões ao PostgreSQL: cada get/set faz o checkout de uma conexão
+        # própria (psycopg2 não permite uso concorrente da mesma conexão)
         try:
-            self.connection = psycopg2.connect(
-                host=config.POSTGRES_HOST,
-                port=config.POSTGRES_PORT,
-                user=config.POSTGRES_USER,
-                password=config.POSTGRES_PASSWORD,
-                database=config.POSTGRES_DB
-            )
+            if pool is None:
+                if connection is not None:
+                    # Conexão injetada (benchmarks): pool de uma conexão só
+                    pool = ConnectionPool(lambda: connection, min_size=1, max_size=1,
+                                          timeout=config.CACHE_POOL_TIMEOUT)
+                else:
+                    pool = ConnectionPool(
+                        connect or self._connect,
+                        min_size=config.CACHE_POOL_MIN,
+                        max_size=config.CACHE_POOL_MAX,
+                        timeout=config.CACHE_POOL_TIMEOUT,
+                        check_idle=config.CACHE_POOL_CHECK_IDLE
+                    )
+            self.pool = pool
+            # Perguntas equivalentes (caixa, acentos, pontuação...) compartilham a mesma chave
+            self.normalizer = normalizer or normalizador
+            metrics.CACHE_POOL_CONEXOES.set_function(lambda: self.pool.info()["em_uso"], estado="em_uso")
+            metrics.CACHE_POOL_CONEXOES.set_function(lambda: self.pool.info()["ociosas"], estado="ociosas")
             self._init_db()
+
+            # L1 em memória na frente da tabela; os outros workers avisam por NOTIFY o que mudou
+            self.l1 = l1 if l1 is not None else L1Cache(
+                max_entries=config.CACHE_L1_MAX_ENTRIES,
+                max_bytes=config.CACHE_L1_MAX_BYTES,
+                max_age=config.CACHE_L1_MAX_AGE
+            )
+            self.origem = nova_origem()
+            self.listener = None
+            if escuta_invalidacao is None:
+                escuta_invalidacao = connection is None and config.CACHE_L1_INVALIDATION == 'notify'
+            if escuta_invalidacao and self.l1.max_entries > 0:
+                self.listener = InvalidationListener(connect or self._connect, self.l1, self.origem).inicia()
+            metrics.CACHE_L1_ITENS.set_function(lambda: self.l1.stats()["entradas"])
+            metrics.CACHE_L1_BYTES.set_function(lambda: self.l1.stats()["bytes"])
+            # Contadores e histograma de expiração mantidos a cada escrita: get_stats sem COUNT(*)
+            self.stats = CacheStats.from_config(self._executa)
+            novas = self._aplica_esquema()
+            # Respostas longas comprimidas em cach_resp_comp (só com as colunas da migração 003)
+            self.comprimidas = "003_resposta_comprimida" in self.esquema
+            self.compressor = Compressor.from_config() if self.comprimidas else None
+            self.stats.tamanho_sql = tamanho_resposta(self.comprimidas)
+            # Tabelas lidas por cada resposta, para invalidar quando os dados mudam (migração 004)
+            self.dependencias = "004_dependencias" in self.esquema
+            # TTL pela volatilidade dos dados lidos e pelo histórico de mudança da resposta (migração 005)
+            self.ttl = TTLPolicy.from_config()
+            self.volatilidade = "005_volatilidade" in self.esquema
+            if "002_estatisticas" in novas:
+                self.stats.recalcula()
+            self._verifica_chaves()
+            self.stats.inicia()
             print('✅ Cache Manager inicializado com sucesso')
         except Exception as e:
             print(f"❌ Erro ao conectar ao PostgreSQL: {e}")
             raise
+
+    @staticmethod
+    def _connect():
+        return psycopg2.connect(
+            host=config.POSTGRES_HOST,
+            port=config.POSTGRES_PORT,
+            user=config.POSTGRES_USER,
+            password=config.POSTGRES_PASSWORD,
+            database=config.POSTGRES_DB
+        )
     
     def _init_db(self):
         """Verifica se a tabela de cache existe (usa estrutura existente)"""
-        cursor = self.connection.cursor()
-        
-        # Verifica se a tabela existe
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_name = 'cache_agente'
-            )
-        """)
-        table_exists = cursor.fetchone()[0]
+        with self.pool.conexao() as connection:
+            cursor = connection.cursor()
+            
+            # Verifica se a tabela existe
+            cursor.execute("""
+                SELECT EXISTS (
+                    SELECT FROM information_schema.tables 
+                    WHERE table_name = 'cache_agente'
+                )
+            """)
+            table_exists = cursor.fetchone()[0]
+            cursor.close()
         
         if table_exists:
             print("✅ Tabela cache_agente encontrada (usando estrutura existente)")
         else:
             print("⚠️ Tabela cache_agente não encontrada")
-        
-        cursor.close()
         print("✅ Cache table initialized successfully")
 
 
 
+    def _aplica_esquema(self) -> list:
+        """Migrações de esquema gerenciadas (ex.: índice em cach_expi_at); retorna as recém-aplicadas"""
+        self.esquema = set()
+        try:
+            with self.pool.conexao() as connection:
+                novas = migrations.aplica_esquema(connection)
+                self.esquema = migrations.migracoes_aplicadas(connection)
+                return novas
+        except ERROS_CONEXAO:
+            raise
+        except Exception as e:
+            # Sem permissão de DDL, por exemplo: o cache funciona, só mais lento
+            print(f"⚠️ Cache: migrações de esquema não aplicadas: {e}")
+            return []
+
+    def _verifica_chaves(self):
+        """Migra as chaves gravadas se o normalizador mudou desde a última execução"""
+        with self.pool.conexao() as connection:
+            gravada = migrations.versao_gravada(connection)
+            if gravada == self.normalizer.versao:
+                return
+            if config.CACHE_KEY_MIGRATE != 'auto':
+                print(f"⚠️ Cache: chaves na versão {gravada}, normalizador na {self.normalizer.versao} "
+                      f"(rode python -m agent_db.cache.migrations migra)")
+                return
+            try:
+                resultado = migrations.migra_chaves(connection, self.normalizer)
+            except Exception as e:
+                # Chaves antigas só viram miss; a próxima inicialização tenta de novo
+                print(f"⚠️ Cache: migração de chaves não aplicada: {e}")
+                return
+            if resultado and resultado.get("linhas", 0) + resultado.get("mescladas", 0):
+                # Os outros workers descartam o L1 inteiro (as chaves antigas deixaram de existir)
+                cursor = connection.cursor()
+                try:
+                    self.notifica(cursor, "*")
+                    connection.commit()
+                finally:
+                    cursor.close()
+        if resultado and resultado.get("mescladas", 0):
+            # Linhas mescladas saíram da tabela sem passar pelos contadores
+            self.stats.recalcula()
+
     def get_query_cache(self, query: str) -> str:
-        return hashlib.sha256(query.encode()).hexdigest()
+        return self.normalizer.chave(query)
     
-    def get(self, query_hash: str):
-        """Recupera uma resposta do cache se existir e não expirou"""
-        cursor = self.connection.cursor()
+    def _executa(self, operacao):
+        """
+        Roda operacao(connection) com uma conexão do pool; se a conexão cair no
+        meio, ela é descartada e a operação é repetida uma vez em outra conexão
+        """
         try:
+            with self.pool.conexao() as connection:
+                return operacao(connection)
+        except ERROS_CONEXAO as e:
+            print(f"🔌 Cache: conexão perdida ({e.__class__.__name__}), tentando novamente")
+            with self.pool.conexao() as connection:
+                return operacao(connection)
+    
+    def get(self, query_hash: str):
+        """Recupera uma resposta do cache se existir e não expirou (L1 antes do banco)"""
+        return self.get_com_graca(query_hash)[0]
+    
+    def get_com_graca(self, query_hash: str, graca: float = 0.0):
+        """
+        (resposta, expirada): aceita também uma entrada expirada há menos de
+        `graca` segundos, sinalizada para ser servida enquanto é refeita
+        """
+        resposta = self.l1.get(query_hash)
+        metrics.CACHE_L1_CONSULTAS.inc(resultado="hit" if resposta is not None else "miss")
+        if resposta is not None:
+            self.stats.consulta(True)
+            return resposta, False
+
+        def _get(connection):
+            cursor = connection.cursor()
+            try:
+                cursor.execute(
+                    f"""
+                    SELECT {colunas_resposta(self.comprimidas)}, cach_expi_at, cach_expi_at <= NOW()
+                    FROM cache_agente 
+                    WHERE cach_hash = %s AND cach_expi_at > NOW() - %s * INTERVAL '1 second'
+                    """, 
+                    (query_hash, graca)
+                )
+                result = cursor.fetchone()
+                # Encerra a transação: a conexão volta ao pool sem transação aberta (e NOW() não congela)
+                connection.commit()
+                return result
+            finally:
+                cursor.close()
+        result = self._executa(_get)
+        self.stats.consulta(bool(result))
+        if not result:
+            return None, False
+        resposta = descomprime(result[1], result[2], result[0])
+        if result[4]:
+            return resposta, True
+        self.guarda_l1(query_hash, resposta, result[3])
+        return resposta, False
+    
+    def guarda_l1(self, query_hash: str, resposta: str, expira_em: datetime):
+        """Coloca no L1 uma resposta lida do banco, até a expiração gravada"""
+        if resposta:
+            self.l1.set(query_hash, resposta, expira_em.timestamp())
+    
+    def grava_dependencias(self, cursor, query_hash: str, tabelas: list):
+        """Substitui as tabelas das quais a resposta depende (mesma transação do upsert)"""
+        cursor.execute("DELETE FROM cache_dependencia WHERE cdep_hash = %s", (query_hash,))
+        for tabela in tabelas:
             cursor.execute(
-                """
-                SELECT cach_resp FROM cache_agente 
-                WHERE cach_hash = %s AND cach_expi_at > NOW()
-                """, 
-                (query_hash,)
+                "INSERT INTO cache_dependencia (cdep_hash, cdep_tabe) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                (query_hash, tabela)
             )
-            result = cursor.fetchone()
-            return result[0] if result else None
-        finally:
-            cursor.close()
     
-    def cleanup_expired(self):
-        """Remove entradas expiradas do cache"""
-        cursor = self.connection.cursor()
-        try:
+    def notifica(self, cursor, query_hash: str):
+        """NOTIFY na mesma transação da escrita: os outros workers só invalidam após o commit"""
+        cursor.execute("SELECT pg_notify(%s, %s)", (CANAL_INVALIDACAO, f"{self.origem}:{query_hash}"))
+    
+    def remove_expirados(self, lote: int) -> int:
+        """
+        Remove até `lote` entradas expiradas em uma transação curta (usa o índice
+        em cach_expi_at), preservando as que ainda estão na janela de
+        CACHE_STALE_GRACE. Retorna -1 se outro worker está varrendo no momento.
+        """
+        def _remove(connection):
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (LOCK_VARREDURA,))
+                if not cursor.fetchone()[0]:
+                    connection.rollback()
+                    return -1
+                cursor.execute(
+                    f"""
+                    DELETE FROM cache_agente WHERE cach_hash IN (
+                        SELECT cach_hash FROM cache_agente
+                        WHERE cach_expi_at < NOW() - %s * INTERVAL '1 second'
+                        ORDER BY cach_expi_at
+                        LIMIT %s
+                    )
+                    RETURNING cach_expi_at, {tamanho_resposta(self.comprimidas)}
+                    """,
+                    (config.CACHE_STALE_GRACE, lote)
+                )
+                linhas = cursor.fetchall()
+                if self.volatilidade:
+                    # Histórico de perguntas que não voltaram a ser gravadas dentro de dois TTLs máximos
+                    cursor.execute(
+                        """
+                        DELETE FROM cache_volatilidade WHERE cvol_hash IN (
+                            SELECT cvol_hash FROM cache_volatilidade
+                            WHERE cvol_upda_at < NOW() - %s * INTERVAL '1 second'
+                            LIMIT %s
+                        )
+                        """,
+                        (2 * self.ttl.maximo, lote)
+                    )
+                connection.commit()
+                self.stats.remocao(linhas)
+                return len(linhas)
+            finally:
+                cursor.close()
+        return self._executa(_remove)
+    
+    def expira_dependentes(self, cursor, tabelas: list) -> list:
+        """
+        Expira agora as entradas ativas que leram alguma das `tabelas`, na
+        transação do chamador (com NOTIFY para os outros workers). Retorna
+        (cach_hash, expiração anterior, bytes) para registra_expiradas após o commit.
+        """
+        marcadores = ", ".join(["%s"] * len(tabelas))
+        cursor.execute(
+            f"""
+            SELECT cach_hash, cach_expi_at, {tamanho_resposta(self.comprimidas)} FROM cache_agente
+            WHERE cach_expi_at > NOW() AND cach_hash IN (
+                SELECT cdep_hash FROM cache_dependencia WHERE cdep_tabe IN ({marcadores})
+            )
+            FOR UPDATE
+            """,
+            tabelas
+        )
+        linhas = cursor.fetchall()
+        hashes = [linha[0] for linha in linhas]
+        for inicio in range(0, len(hashes), 500):
+            lote = hashes[inicio:inicio + 500]
             cursor.execute(
-                "DELETE FROM cache_agente WHERE cach_expi_at < NOW()"
+                f"UPDATE cache_agente SET cach_expi_at = NOW() WHERE cach_hash IN ({', '.join(['%s'] * len(lote))})",
+                lote
             )
-            deleted_count = cursor.rowcount
-            self.connection.commit()
-            if deleted_count > 0:
-                print(f"🧹 Cache: {deleted_count} entradas expiradas removidas")
+        if len(hashes) > MAX_NOTIFICACOES:
+            self.notifica(cursor, "*")
+        else:
+            for query_hash in hashes:
+                self.notifica(cursor, query_hash)
+        return linhas
+    
+    def registra_expiradas(self, linhas: list):
+        """L1 e estatísticas deste processo depois de expira_dependentes confirmado"""
+        for query_hash, _, _ in linhas:
+            self.l1.invalida(query_hash)
+        self.stats.reexpira([(antiga, tamanho) for _, antiga, tamanho in linhas], datetime.now())
+    
+    def cleanup_expired(self, lote: int = 1000):
+        """Remove todas as entradas expiradas, em lotes"""
+        total = 0
+        try:
+            while True:
+                removidas = self.remove_expirados(lote)
+                if removidas <= 0:
+                    break
+                total += removidas
+                if removidas < lote:
+                    break
+            if total > 0:
+                print(f"🧹 Cache: {total} entradas expiradas removidas")
         except Exception as e:
             print(f"❌ Erro ao limpar cache: {e}")
-        finally:
-            cursor.close()
+        return total
     
     def get_stats(self):
-        """Retorna estatísticas do cache"""
-        cursor = self.connection.cursor()
+        """
+        Retorna estatísticas do cache a partir dos contadores incrementais (sem
+        varrer a cache_agente); ativas/expiradas com precisão de uma hora
+        """
         try:
-            cursor.execute("""
-                SELECT 
-                    COUNT(*) as total_entries,
-                    COUNT(*) FILTER (WHERE cach_expi_at > NOW()) as active_entries,
-                    COUNT(*) FILTER (WHERE cach_expi_at <= NOW()) as expired_entries
-                FROM cache_agente
-            """)
-            result = cursor.fetchone()
-            return {
-                'total_entries': result[0],
-                'active_entries': result[1], 
-                'expired_entries': result[2]
-            }
+            return self.stats.snapshot()
         except Exception as e:
             print(f"❌ Erro ao obter estatísticas do cache: {e}")
             return {'total_entries': 0, 'active_entries': 0, 'expired_entries': 0}
-        finally:
-            cursor.close()
     
-    def set(self, query_hash: str, query_text: str, response: str):
-        """Salva uma resposta no cache com expiração"""
-        expiry_date = datetime.now() + timedelta(days=config.CACHE_TTL_DAYS)
+    def textos_ativos(self) -> list:
+        """(cach_hash, cach_text) das entradas não expiradas, para o índice semântico"""
+        def _textos(connection):
+            cursor = connection.cursor()
+            try:
+                cursor.execute(
+                    "SELECT cach_hash, cach_text FROM cache_agente "
+                    "WHERE cach_expi_at > NOW() AND cach_text IS NOT NULL"
+                )
+                linhas = cursor.fetchall()
+                connection.commit()
+                return linhas
+            finally:
+                cursor.close()
+        return self._executa(_textos)
+    
+    def pool_stats(self) -> dict:
+        """Ocupação do pool de conexões"""
+        return self.pool.info()
+    
+    def l1_stats(self) -> dict:
+        """Ocupação e acertos do L1 em memória"""
+        return {**self.l1.stats(), "invalidacao": bool(self.listener and self.listener.conectado)}
+    
+    def escolhe_ttl(self, cursor, query_hash: str, response: str, tabelas: list = None,
+                    colunas: list = None) -> tuple:
+        """
+        (classe, TTL em segundos) da resposta, na transação do set: atualiza a
+        taxa de mudança da pergunta (a assinatura difere da gravada?) e aplica a política
+        """
+        if not (self.ttl.adaptativo and self.volatilidade):
+            return self.ttl.escolhe(tabelas, colunas)
+        cursor.execute(
+            """
+            INSERT INTO cache_volatilidade (cvol_hash, cvol_assi) VALUES (%s, %s)
+            ON CONFLICT (cvol_hash) DO UPDATE SET
+                cvol_taxa = cache_volatilidade.cvol_taxa * (1 - %s)
+                    + CASE WHEN cache_volatilidade.cvol_assi <> EXCLUDED.cvol_assi THEN %s ELSE 0 END,
+                cvol_muda = cache_volatilidade.cvol_muda
+                    + CASE WHEN cache_volatilidade.cvol_assi <> EXCLUDED.cvol_assi THEN 1 ELSE 0 END,
+                cvol_refr = cache_volatilidade.cvol_refr + 1,
+                cvol_assi = EXCLUDED.cvol_assi,
+                cvol_upda_at = NOW()
+            RETURNING cvol_taxa
+            """,
+            (query_hash, assinatura(response), PESO_REFRESH, PESO_REFRESH)
+        )
+        return self.ttl.escolhe(tabelas, colunas, float(cursor.fetchone()[0]))
+    
+    def set(self, query_hash: str, query_text: str, response: str, tabelas: list = None, colunas: list = None):
+        """
+        Salva uma resposta no cache com expiração escolhida pela política de TTL
+        (e as tabelas e colunas lidas para gerá-la, se conhecidas)
+        """
+        formato, comprimida = self.compressor.comprime(response) if self.compressor else (None, None)
         
-        cursor = self.connection.cursor()
-        try:
-            cursor.execute(
-                """
-                INSERT INTO cache_agente (cach_hash, cach_text, cach_resp, cach_expi_at)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (cach_hash) 
-                DO UPDATE SET 
-                    cach_resp = EXCLUDED.cach_resp,
-                    cach_expi_at = EXCLUDED.cach_expi_at,
-                    cach_upda_at = NOW()
-                """,
-                (query_hash, query_text, response, expiry_date)
-            )
-            self.connection.commit()
-        finally:
-            cursor.close()
+        def _set(connection):
+            cursor = connection.cursor()
+            try:
+                # Versão substituída (se havia), para descontar do histograma de expiração
+                cursor.execute(
+                    f"SELECT cach_expi_at, {tamanho_resposta(self.comprimidas)} FROM cache_agente WHERE cach_hash = %s",
+                    (query_hash,)
+                )
+                anterior = cursor.fetchone()
+                classe, ttl = self.escolhe_ttl(cursor, query_hash, response, tabelas, colunas)
+                expiry_date = datetime.now() + timedelta(seconds=ttl)
+                if self.comprimidas:
+                    cursor.execute(
+                        """
+                        INSERT INTO cache_agente (cach_hash, cach_text, cach_resp, cach_resp_comp, cach_form, cach_expi_at)
+                        VALUES (%s, %s, %s, %s, %s, %s)
+                        ON CONFLICT (cach_hash) 
+                        DO UPDATE SET 
+                            cach_resp = EXCLUDED.cach_resp,
+                            cach_resp_comp = EXCLUDED.cach_resp_comp,
+                            cach_form = EXCLUDED.cach_form,
+                            cach_expi_at = EXCLUDED.cach_expi_at,
+                            cach_upda_at = NOW()
+                        """,
+                        (query_hash, query_text, None if formato else response,
+                         comprimida, formato, expiry_date)
+                    )
+                else:
+                    cursor.execute(
+                        """
+                        INSERT INTO cache_agente (cach_hash, cach_text, cach_resp, cach_expi_at)
+                        VALUES (%s, %s, %s, %s)
+                        ON CONFLICT (cach_hash) 
+                        DO UPDATE SET 
+                            cach_resp = EXCLUDED.cach_resp,
+                            cach_expi_at = EXCLUDED.cach_expi_at,
+                            cach_upda_at = NOW()
+                        """,
+                        (query_hash, query_text, response, expiry_date)
+                    )
+                if self.dependencias and tabelas is not None:
+                    self.grava_dependencias(cursor, query_hash, tabelas)
+                self.notifica(cursor, query_hash)
+                connection.commit()
+                return anterior, expiry_date, classe, ttl
+            finally:
+                cursor.close()
+        anterior, expiry_date, classe, ttl = self._executa(_set)
+        metrics.CACHE_TTL.observe(ttl, classe=classe)
+        tamanho = len(comprimida) if formato else len(response.encode("utf-8"))
+        self.stats.gravacao(expiry_date, tamanho, anterior)
+        # Write-through: o banco primeiro, depois o L1 deste processo
+        self.guarda_l1(query_hash, response, expiry_date)
+    
+    def close(self):
+        """Fecha as conexões do pool e o LISTEN de invalidação"""
+        if self.listener:
+            self.listener.close()
+        self.stats.close()
+        self.pool.close()
     
     def __del__(self):
-        if hasattr(self, 'connection'):
-            self.connection.close()
-
-
+        if hasattr(self, 'pool'):
+            self.pool.close()
@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+"""
+Migrações da cache_agente: esquema (índices e colunas gerenciados) e versão
+das chaves entre versões do normalizador.
+
+    python -m agent_db.cache.migrations esquema     # aplica as migrações de esquema pendentes
+    python -m agent_db.cache.migrations relatorio   # taxa de acerto: chave antiga x nova
+    python -m agent_db.cache.migrations migra       # regrava cach_hash com a versão atual
+    python -m agent_db.cache.migrations estatisticas  # refaz as estatísticas com uma varredura completa
+    python -m agent_db.cache.migrations comprime    # comprime as respostas já gravadas (CACHE_COMPRESSION)
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from agent_db.cache.compression import Compressor
+from agent_db.cache.normalizer import QueryNormalizer, normalizador
+
+# Versão das chaves antes do normalizador: sha256 do texto cru
+VERSAO_CRUA = "0"
+
+# Perguntas que a versão do algoritmo (antes do '+') juntava com outras diferentes: a resposta
+# gravada pode ser da outra pergunta, então essas linhas são descartadas em vez de migradas
+SUSPEITAS = {
+    # A versão 1 trocava operadores, sinal de negativo e % por espaço ("saldo > 0" = "saldo < 0")
+    "1": re.compile(r"[<>=!%≥≤≠]|(?<![a-z0-9.,-])-(?=[0-9])", re.IGNORECASE),
+}
+
+TABELA_MIGRACAO = """
+CREATE TABLE IF NOT EXISTS cache_migracao (
+    cami_vers text NOT NULL,
+    cami_ante text,
+    cami_linh integer NOT NULL DEFAULT 0,
+    cami_mesc integer NOT NULL DEFAULT 0,
+    cami_apli_at timestamp DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# Chave fixa do pg_advisory_lock: só um worker migra por vez
+LOCK_MIGRACAO = 7301001
+
+TABELA_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS cache_esquema (
+    cesq_nome text PRIMARY KEY,
+    cesq_apli_at timestamp DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# (nome, comandos, em_transacao): aplicadas em ordem, uma única vez por banco.
+# CREATE INDEX CONCURRENTLY não trava as escritas, mas não pode rodar em transação.
+MIGRACOES_ESQUEMA = [
+    ("001_indice_expiracao", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS cache_agente_cach_expi_at_idx ON cache_agente (cach_expi_at)",
+    ], False),
+    # Estatísticas incrementais: contadores e entradas/bytes por hora de expiração
+    ("002_estatisticas", [
+        """
+        CREATE TABLE IF NOT EXISTS cache_estatistica (
+            cest_nome text PRIMARY KEY,
+            cest_valo bigint NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS cache_expiracao_hora (
+            ceho_hora timestamp PRIMARY KEY,
+            ceho_qtd bigint NOT NULL DEFAULT 0,
+            ceho_byte bigint NOT NULL DEFAULT 0
+        )
+        """,
+    ], True),
+    # Respostas comprimidas: cach_form marca o formato (NULL = texto puro em cach_resp)
+    ("003_resposta_comprimida", [
+        "ALTER TABLE cache_agente ADD COLUMN IF NOT EXISTS cach_resp_comp bytea",
+        "ALTER TABLE cache_agente ADD COLUMN IF NOT EXISTS cach_form text",
+    ], True),
+    # Tabelas lidas pelo SQL de cada resposta e contadores de escrita vistos por último em pg_stat_user_tables
+    ("004_dependencias", [
+        """
+        CREATE TABLE IF NOT EXISTS cache_dependencia (
+            cdep_hash text NOT NULL REFERENCES cache_agente (cach_hash) ON DELETE CASCADE ON UPDATE CASCADE,
+            cdep_tabe text NOT NULL,
+            PRIMARY KEY (cdep_hash, cdep_tabe)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS cache_dependencia_cdep_tabe_idx ON cache_dependencia (cdep_tabe)",
+        """
+        CREATE TABLE IF NOT EXISTS cache_tabela_versao (
+            ctve_tabe text PRIMARY KEY,
+            ctve_muda bigint NOT NULL,
+            ctve_veri_at timestamp DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ], True),
+    # Histórico de mudança da resposta por pergunta (TTL adaptativo); sobrevive à remoção da entrada
+    ("005_volatilidade", [
+        """
+        CREATE TABLE IF NOT EXISTS cache_volatilidade (
+            cvol_hash text PRIMARY KEY,
+            cvol_assi text NOT NULL,
+            cvol_taxa double precision NOT NULL DEFAULT 0.5,
+            cvol_refr integer NOT NULL DEFAULT 0,
+            cvol_muda integer NOT NULL DEFAULT 0,
+            cvol_upda_at timestamp DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS cache_volatilidade_cvol_upda_at_idx ON cache_volatilidade (cvol_upda_at)",
+    ], True),
+]
+
+
+def chave_crua(texto: str) -> str:
+    return hashlib.sha256(texto.encode()).hexdigest()
+
+
+def versao_gravada(connection) -> str:
+    """Versão das chaves em uso na tabela (a da última migração aplicada)"""
+    cursor = connection.cursor()
+    try:
+        cursor.execute(TABELA_MIGRACAO)
+        cursor.execute("SELECT cami_vers FROM cache_migracao ORDER BY cami_apli_at DESC LIMIT 1")
+        linha = cursor.fetchone()
+        connection.commit()
+        return linha[0] if linha else VERSAO_CRUA
+    finally:
+        cursor.close()
+
+
+def migracoes_aplicadas(connection) -> set:
+    """Nomes das migrações de esquema já registradas em cache_esquema"""
+    cursor = connection.cursor()
+    try:
+        cursor.execute(TABELA_ESQUEMA)
+        cursor.execute("SELECT cesq_nome FROM cache_esquema")
+        aplicadas = {linha[0] for linha in cursor.fetchall()}
+        connection.commit()
+        return aplicadas
+    finally:
+        cursor.close()
+
+
+def aplica_esquema(connection, migracoes=MIGRACOES_ESQUEMA) -> List[str]:
+    """Aplica as migrações de esquema ainda não registradas em cache_esquema"""
+    aplicadas = migracoes_aplicadas(connection)
+    novas = []
+    for nome, comandos, em_transacao in migracoes:
+        if nome in aplicadas:
+            continue
+        autocommit = getattr(connection, "autocommit", False)
+        if not em_transacao:
+            connection.autocommit = True
+        cursor = connection.cursor()
+        try:
+            for comando in comandos:
+                cursor.execute(comando)
+            # IF NOT EXISTS nos comandos: outro worker pode ter aplicado ao mesmo tempo
+            cursor.execute(
+                "INSERT INTO cache_esquema (cesq_nome) VALUES (%s) ON CONFLICT (cesq_nome) DO NOTHING", (nome,))
+            if em_transacao:
+                connection.commit()
+        except Exception:
+            if em_transacao:
+                connection.rollback()
+            raise
+        finally:
+            cursor.close()
+            connection.autocommit = autocommit
+        print(f"🗂️ Cache: migração de esquema {nome} aplicada")
+        novas.append(nome)
+    return novas
+
+
+def _linhas(connection) -> List[tuple]:
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT cach_hash, cach_text, cach_upda_at FROM cache_agente WHERE cach_text IS NOT NULL")
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def migra_chaves(connection, normalizer: QueryNormalizer = normalizador, lote: int = 500) -> Optional[dict]:
+    """
+    Recalcula cach_hash de todas as linhas com o normalizador atual. Linhas
+    cujas perguntas passam a ter a mesma chave são mescladas, mantendo a
+    resposta mais recente; as que a versão anterior confundia com outras
+    perguntas (SUSPEITAS) são descartadas. Retorna None se outro worker já
+    está migrando.
+    """
+    cursor = connection.cursor()
+    bloqueado = False
+    try:
+        cursor.execute(TABELA_MIGRACAO)
+        # Lock de sessão: continua com o worker entre os commits de cada lote (o transacional sairia
+        # no commit e outro worker planejaria uma segunda migração sobre a tabela pela metade)
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (LOCK_MIGRACAO,))
+        bloqueado = bool(cursor.fetchone()[0])
+        if not bloqueado:
+            connection.rollback()
+            return None
+        # Relida com o lock: outro worker pode ter acabado de migrar
+        cursor.execute("SELECT cami_vers FROM cache_migracao ORDER BY cami_apli_at DESC LIMIT 1")
+        linha = cursor.fetchone()
+        anterior = linha[0] if linha else VERSAO_CRUA
+        if anterior == normalizer.versao:
+            connection.commit()
+            return {"versao": anterior, "linhas": 0, "mescladas": 0}
+
+        suspeitas = SUSPEITAS.get(anterior.split("+")[0])
+        grupos: Dict[str, list] = defaultdict(list)
+        remover, mover = [], []
+        for hash_atual, texto, atualizado in _linhas(connection):
+            if suspeitas and suspeitas.search(texto):
+                remover.append(hash_atual)
+                continue
+            grupos[normalizer.chave(texto)].append((atualizado or datetime.min, hash_atual))
+
+        # Por chave nova: mantém a linha mais recente e descarta as demais
+        for chave, linhas in grupos.items():
+            linhas.sort()
+            remover.extend(h for _, h in linhas[:-1])
+            if linhas[-1][1] != chave:
+                mover.append((linhas[-1][1], chave))
+        alteradas = len(mover)
+
+        def _lote(feitos: int):
+            if feitos % lote == 0:
+                # Transações curtas; o lock de sessão segura os outros workers até o fim
+                connection.commit()
+
+        ocupadas = {h for linhas in grupos.values() for _, h in linhas} - set(remover)
+        feitos = 0
+        for hash_atual in remover:
+            cursor.execute("DELETE FROM cache_agente WHERE cach_hash = %s", (hash_atual,))
+            feitos += 1
+            _lote(feitos)
+
+        # Uma chave nova pode ser a chave antiga de outra linha ainda não movida: adia até liberar
+        while mover:
+            adiadas = []
+            for de, para in mover:
+                if para in ocupadas:
+                    adiadas.append((de, para))
+                    continue
+                cursor.execute("UPDATE cache_agente SET cach_hash = %s WHERE cach_hash = %s", (para, de))
+                ocupadas.discard(de)
+                ocupadas.add(para)
+                feitos += 1
+                _lote(feitos)
+            if len(adiadas) == len(mover):
+                # Ciclo entre chaves (raro): essas entradas são descartadas e refeitas sob demanda
+                for de, _ in adiadas:
+                    cursor.execute("DELETE FROM cache_agente WHERE cach_hash = %s", (de,))
+                    remover.append(de)
+                break
+            mover = adiadas
+
+        mescladas = len(remover)
+        cursor.execute(
+            "INSERT INTO cache_migracao (cami_vers, cami_ante, cami_linh, cami_mesc) VALUES (%s, %s, %s, %s)",
+            (normalizer.versao, anterior, alteradas, mescladas)
+        )
+        connection.commit()
+        print(f"🔑 Cache: chaves migradas de {anterior} para {normalizer.versao} "
+              f"({alteradas} regravadas, {mescladas} mescladas)")
+        return {"versao": normalizer.versao, "anterior": anterior, "linhas": alteradas, "mescladas": mescladas}
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        try:
+            if bloqueado:
+                # A conexão volta ao pool: o lock de sessão não sai sozinho
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (LOCK_MIGRACAO,))
+                connection.commit()
+        finally:
+            cursor.close()
+
+
+def comprime_respostas(connection, compressor: Compressor, lote: int = 500) -> dict:
+    """
+    Regrava em cach_resp_comp as respostas ainda em texto puro, em lotes de
+    `lote` linhas (uma transação curta por lote, paginando por cach_hash).
+    Uma linha reescrita por um set no meio do caminho não é tocada.
+    """
+    ultima, linhas, antes, depois = "", 0, 0, 0
+    cursor = connection.cursor()
+    try:
+        while True:
+            cursor.execute(
+                """
+                SELECT cach_hash, cach_resp FROM cache_agente
+                WHERE cach_form IS NULL AND cach_resp IS NOT NULL AND cach_hash > %s
+                ORDER BY cach_hash
+                LIMIT %s
+                """,
+                (ultima, lote)
+            )
+            pagina = cursor.fetchall()
+            if not pagina:
+                connection.commit()
+                break
+            for cach_hash, resposta in pagina:
+                formato, dados = compressor.comprime(resposta)
+                if formato is None:
+                    continue
+                cursor.execute(
+                    """
+                    UPDATE cache_agente SET cach_resp_comp = %s, cach_form = %s, cach_resp = NULL
+                    WHERE cach_hash = %s AND cach_form IS NULL AND cach_resp = %s
+                    """,
+                    (dados, formato, cach_hash, resposta)
+                )
+                if cursor.rowcount:
+                    linhas += 1
+                    antes += len(resposta.encode("utf-8"))
+                    depois += len(dados)
+            connection.commit()
+            ultima = pagina[-1][0]
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    print(f"🗜️ Cache: {linhas} respostas comprimidas ({antes} -> {depois} bytes)")
+    return {"formato": compressor.formato, "linhas": linhas, "bytes_antes": antes, "bytes_depois": depois}
+
+
+def relatorio(textos: List[str], chave_antiga: Callable[[str], str] = chave_crua,
+              normalizer: QueryNormalizer = normalizador, exemplos: int = 5) -> dict:
+    """
+    Compara a chave antiga e a nova sobre as perguntas históricas: se fossem
+    feitas de novo na ordem, quantas encontrariam uma entrada já em cache
+    """
+    antigas, novas = set(), defaultdict(list)
+    acertos_antigos = acertos_novos = 0
+    for texto in textos:
+        antiga, nova = chave_antiga(texto), normalizer.chave(texto)
+        acertos_antigos += antiga in antigas
+        acertos_novos += nova in novas
+        antigas.add(antiga)
+        novas[nova].append(texto)
+
+    total = len(textos)
+    grupos = sorted((t for t in novas.values() if len(set(t)) > 1), key=len, reverse=True)
+    return {
+        "versao": normalizer.versao,
+        "perguntas": total,
+        "chaves_antigas": len(antigas),
+        "chaves_novas": len(novas),
+        "taxa_acerto_antiga": round(acertos_antigos / total, 4) if total else 0.0,
+        "taxa_acerto_nova": round(acertos_novos / total, 4) if total else 0.0,
+        "exemplos": [sorted(set(g))[:5] for g in grupos[:exemplos]],
+    }
+
+
+def relatorio_banco(connection, normalizer: QueryNormalizer = normalizador) -> dict:
+    """Relatório sobre os cach_text gravados, na ordem de criação"""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT cach_text FROM cache_agente WHERE cach_text IS NOT NULL ORDER BY cach_crea_at")
+        textos = [linha[0] for linha in cursor.fetchall()]
+        connection.commit()
+    finally:
+        cursor.close()
+    return relatorio(textos, normalizer=normalizer)
+
+
+def main(argv=None):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    from agent_db.cache.manager import CacheManager
+
+    parser = argparse.ArgumentParser(description="Chaves da cache_agente: relatório e migração")
+    parser.add_argument("comando", choices=["esquema", "relatorio", "migra", "estatisticas", "comprime"])
+    parser.add_argument("--lote", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    if args.comando in ("estatisticas", "comprime"):
+        cache = CacheManager(escuta_invalidacao=False)
+        try:
+            if args.comando == "comprime":
+                if cache.compressor is None:
+                    print("⚠️ Compressão desligada ou colunas ausentes (CACHE_COMPRESSION / migração 003)")
+                    return
+                with cache.pool.conexao() as connection:
+                    print(json.dumps(comprime_respostas(connection, cache.compressor, args.lote), ensure_ascii=False))
+            # Os bytes por hora de expiração mudam com a compressão
+            cache.stats.recalcula()
+            print(json.dumps(cache.get_stats(), ensure_ascii=False, indent=2))
+        finally:
+            cache.close()
+        return
+
+    connection = CacheManager._connect()
+    try:
+        print(f"🔑 Versão gravada: {versao_gravada(connection)} | atual: {normalizador.versao}")
+        if args.comando == "esquema":
+            print(f"🗂️ Migrações aplicadas: {aplica_esquema(connection) or 'nenhuma pendente'}")
+        elif args.comando == "relatorio":
+            print(json.dumps(relatorio_banco(connection), ensure_ascii=False, indent=2))
+        else:
+            resultado = migra_chaves(connection)
+            print(json.dumps(resultado, ensure_ascii=False) if resultado else "⚠️ Migração em andamento em outro worker")
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
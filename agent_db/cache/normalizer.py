@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import re
+import unicodedata
+from typing import Dict, Iterable, Optional
+
+# Incrementar sempre que a canonicalização mudar (as chaves gravadas precisam ser migradas)
+NORMALIZER_VERSION = 2
+
+# Palavras que não mudam o sentido da pergunta ao banco (já sem acento)
+STOPWORDS_PT = frozenset("""
+    o a os as um uma uns umas de do da dos das no na nos nas ao aos pelo pela pelos pelas
+    por para pra e me eu nos voce voces favor poderia pode podes gostaria queria saber
+    informe informar diga dizer mostre mostrar
+""".split())
+
+# Abreviações comuns no ERP -> forma por extenso
+SINONIMOS_PADRAO = {
+    "qtd": "quantidade", "qtde": "quantidade", "quant": "quantidade",
+    "nro": "numero", "num": "numero", "nr": "numero",
+    "vlr": "valor", "val": "valor",
+    "prod": "produto", "prods": "produtos",
+    "cli": "cliente", "clis": "clientes",
+    "forn": "fornecedor", "forns": "fornecedores",
+    "tit": "titulo", "tits": "titulos",
+    "cp": "contas pagar", "cr": "contas receber",
+}
+
+# Tokens da pergunta: palavras e números (ponto/vírgula só dentro de números, 1.000 e 2,5),
+# o sinal de menos de um número negativo e os operadores de comparação e o %, que mudam o sentido
+_TOKENS = re.compile(
+    r"(?:(?<![a-z0-9.,-])-(?=[0-9]))?[a-z0-9]+(?:(?<=[0-9])[.,](?=[0-9])[a-z0-9]+)*"
+    r"|>=|<=|!=|<>|==|[<>=%≥≤≠]"
+)
+# Grafias equivalentes de um mesmo operador
+_OPERADORES = {"<>": "!=", "==": "=", "≥": ">=", "≤": "<=", "≠": "!="}
+
+# Perguntas que precisam de chaves diferentes (python -m agent_db.cache.normalizer confere)
+PARES_DISTINTOS = (
+    ("produtos com saldo > 0", "produtos com saldo < 0"),
+    ("vendas >= 1000", "vendas <= 1000"),
+    ("saldo -5", "saldo 5"),
+    ("margem 10%", "margem 10"),
+    ("clientes != SP", "clientes = SP"),
+    ("saldo maior que 0", "saldo > 0"),
+)
+# Variações que precisam cair na mesma chave
+PARES_EQUIVALENTES = (
+    ("Quantos produtos temos cadastrados?", "quantos  produtos temos cadastrados"),
+    ("Total de 1.000 títulos", "total de 1.000 titulos!"),
+    ("vendas >= 1000", "vendas ≥ 1000"),
+    ("clientes <> SP", "clientes != SP"),
+    ("margem de 10%", "margem de 10 %"),
+)
+
+
+class QueryNormalizer:
+    """
+    Canonicaliza a pergunta antes do hash da chave de cache: casefold, sem
+    acentos, pontuação e espaços normalizados e, opcionalmente, sem stopwords
+    e com sinônimos mapeados. "Quantos produtos temos cadastrados?" e
+    "quantos  produtos temos cadastrados" passam a ter a mesma chave;
+    operadores (>, <=, !=...), sinal de negativo e % continuam distinguindo
+    "saldo > 0" de "saldo < 0".
+    """
+    def __init__(self, stopwords: Optional[Iterable[str]] = None, sinonimos: Optional[Dict[str, str]] = None):
+        self.stopwords = frozenset(stopwords or ())
+        self.sinonimos = dict(sinonimos or {})
+
+    @classmethod
+    def from_config(cls) -> "QueryNormalizer":
+        from config_db import config
+
+        sinonimos = None
+        if config.CACHE_KEY_SYNONYMS == "padrao":
+            sinonimos = SINONIMOS_PADRAO
+        elif config.CACHE_KEY_SYNONYMS:
+            with open(config.CACHE_KEY_SYNONYMS, encoding="utf-8") as arquivo:
+                sinonimos = json.load(arquivo)
+        return cls(stopwords=STOPWORDS_PT if config.CACHE_KEY_STOPWORDS else None, sinonimos=sinonimos)
+
+    @property
+    def versao(self) -> str:
+        """Versão do algoritmo mais as opções ativas (mudar qualquer uma muda as chaves)"""
+        partes = [str(NORMALIZER_VERSION)]
+        if self.stopwords:
+            partes.append("stop:" + hashlib.sha256(" ".join(sorted(self.stopwords)).encode()).hexdigest()[:8])
+        if self.sinonimos:
+            texto = json.dumps(self.sinonimos, sort_keys=True, ensure_ascii=False)
+            partes.append("sin:" + hashlib.sha256(texto.encode()).hexdigest()[:8])
+        return "+".join(partes)
+
+    @staticmethod
+    def _sem_acento(texto: str) -> str:
+        decomposto = unicodedata.normalize("NFKD", texto)
+        return "".join(c for c in decomposto if not unicodedata.combining(c))
+
+    def normaliza(self, texto: str) -> str:
+        texto = self._sem_acento(texto.casefold())
+        # O resto da pontuação vira separador
+        tokens = []
+        for token in _TOKENS.findall(texto):
+            token = _OPERADORES.get(token, token)
+            for parte in self.sinonimos.get(token, token).split():
+                if parte not in self.stopwords:
+                    tokens.append(parte)
+        return " ".join(tokens)
+
+    def chave(self, texto: str) -> str:
+        return hashlib.sha256(self.normaliza(texto).encode()).hexdigest()
+
+
+def colisoes(normalizer: QueryNormalizer) -> list:
+    """Pares de PARES_DISTINTOS com a mesma chave e de PARES_EQUIVALENTES com chaves diferentes"""
+    erros = [("distintos", a, b) for a, b in PARES_DISTINTOS if normalizer.chave(a) == normalizer.chave(b)]
+    erros += [("equivalentes", a, b) for a, b in PARES_EQUIVALENTES if normalizer.chave(a) != normalizer.chave(b)]
+    return erros
+
+
+# Instância usada pelo CacheManager e pelo AsyncCacheManager
+normalizador = QueryNormalizer.from_config()
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Confere o normalizador configurado (stopwords e sinônimos do .env) e o padrão
+    falhas = colisoes(normalizador) + colisoes(QueryNormalizer())
+    for tipo, a, b in falhas:
+        print(f"❌ Pares {tipo}: {a!r} -> {normalizador.normaliza(a)!r} | {b!r} -> {normalizador.normaliza(b)!r}")
+    print("✅ Normalizador: chaves conferidas" if not falhas else f"❌ Normalizador: {len(falhas)} falha(s)")
+    sys.exit(1 if falhas else 0)
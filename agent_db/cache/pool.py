@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Tuple
+
+import psycopg2
+
+# Erros do driver que indicam conexão perdida (servidor reiniciado, rede, timeout)
+ERROS_CONEXAO = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class PoolEsgotado(TimeoutError):
+    """Nenhuma conexão livre dentro do tempo de espera"""
+
+
+class ConnectionPool:
+    """
+    Pool de conexões thread-safe (CacheManager e checkpointer SQL). Cada chamada faz o
+    checkout de uma conexão exclusiva e a devolve ao terminar:
+
+    - `min_size` conexões abertas na criação, no máximo `max_size` ao mesmo tempo
+    - conexões ociosas há mais de `check_idle` segundos passam por um `SELECT 1`
+      antes de serem entregues; as que falham são descartadas e recriadas
+    - conexões que geram erro de conexão durante o uso são descartadas
+    """
+    def __init__(self, connect: Callable[[], Any], min_size: int = 1, max_size: int = 5,
+                 timeout: float = 10.0, check_idle: float = 30.0, nome: str = "Cache"):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError("Pool inválido: exige 1 <= max_size e min_size <= max_size")
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self.nome = nome  # prefixo dos logs
+        self._cond = threading.Condition()
+        self._ociosas: Deque[Tuple[Any, float]] = deque()  # (conexão, momento da devolução)
+        self._abertas = 0
+        self._fechado = False
+        self.stats = {"criadas": 0, "descartadas": 0, "esperas": 0, "esgotado": 0}
+
+        for _ in range(min_size):
+            self._ociosas.append((self._cria(), time.monotonic()))
+
+    def _cria(self):
+        conexao = self.connect()
+        with self._cond:
+            self._abertas += 1
+            self.stats["criadas"] += 1
+        return conexao
+
+    def _descarta(self, conexao):
+        try:
+            conexao.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._abertas -= 1
+            self.stats["descartadas"] += 1
+            self._cond.notify()
+
+    @staticmethod
+    def _fechada(conexao) -> bool:
+        return bool(getattr(conexao, "closed", 0))
+
+    def _saudavel(self, conexao) -> bool:
+        if self._fechada(conexao):
+            return False
+        cursor = None
+        try:
+            cursor = conexao.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            conexao.rollback()
+            return True
+        except Exception:
+            return False
+        finally:
+            if cursor is not None:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+
+    def _obtem(self):
+        limite = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._fechado:
+                    raise RuntimeError("Pool de conexões fechado")
+                if self._ociosas:
+                    conexao, devolvida = self._ociosas.pop()
+                    break
+                if self._abertas < self.max_size:
+                    self._abertas += 1  # reserva a vaga antes de conectar fora do lock
+                    conexao, devolvida = None, None
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self.stats["esgotado"] += 1
+                    raise PoolEsgotado(f"Nenhuma conexão livre em {self.timeout}s (max_size={self.max_size})")
+                self.stats["esperas"] += 1
+                self._cond.wait(restante)
+
+        if conexao is None:
+            try:
+                conexao = self.connect()
+            except Exception:
+                with self._cond:
+                    self._abertas -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self.stats["criadas"] += 1
+            return conexao
+
+        # Ociosa há muito tempo (ou já fechada): confere antes de entregar
+        if self._fechada(conexao) or (time.monotonic() - devolvida > self.check_idle and not self._saudavel(conexao)):
+            print(f"🔌 {self.nome}: conexão inválida descartada, reconectando")
+            self._descarta(conexao)
+            return self._obtem()
+        return conexao
+
+    def _devolve(self, conexao):
+        with self._cond:
+            if not self._fechado:
+                self._ociosas.append((conexao, time.monotonic()))
+                self._cond.notify()
+                return
+        self._descarta(conexao)
+
+    @contextmanager
+    def conexao(self):
+        """Checkout de uma conexão exclusiva durante o bloco"""
+        conexao = self._obtem()
+        try:
+            yield conexao
+        except ERROS_CONEXAO:
+            self._descarta(conexao)
+            raise
+        except BaseException:
+            try:
+                conexao.rollback()
+                reaproveitavel = True
+            except Exception:
+                reaproveitavel = False
+            if reaproveitavel:
+                self._devolve(conexao)
+            else:
+                self._descarta(conexao)
+            raise
+        else:
+            if self._fechada(conexao):
+                self._descarta(conexao)
+            else:
+                self._devolve(conexao)
+
+    def info(self) -> dict:
+        with self._cond:
+            return {
+                "abertas": self._abertas,
+                "ociosas": len(self._ociosas),
+                "em_uso": self._abertas - len(self._ociosas),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                **self.stats,
+            }
+
+    def close(self):
+        with self._cond:
+            self._fechado = True
+            ociosas = [c for c, _ in self._ociosas]
+            self._ociosas.clear()
+            self._cond.notify_all()
+        for conexao in ociosas:
+            self._descarta(conexao)
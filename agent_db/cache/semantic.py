@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import re
+import threading
+import zlib
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from agent_db.cache.normalizer import STOPWORDS_PT, QueryNormalizer
+
+# Números do texto normalizado, com o sinal de negativo que o normalizador preserva
+_NUMEROS = re.compile(r"(?:(?<![a-z0-9.,-])-)?\d+(?:[.,]\d+)*")
+# Palavras que invertem ou deslocam o sentido sem mudar quase nada do vetor: precisam ser as mesmas
+_NEGACOES = frozenset("nao sem nunca nenhum nenhuma nem jamais exceto".split())
+_COMPARATIVOS = frozenset("""
+    > < >= <= = != % maior maiores menor menores acima abaixo superior inferior mais menos antes depois
+""".split())
+# Antônimos por prefixo: ativos/inativos, adimplentes/inadimplentes, bloqueados/desbloqueados
+_PREFIXOS_ANTONIMO = ("in", "im", "ir", "i", "des", "dis")
+_normalizer = QueryNormalizer()
+
+# Calibração do vetorizador + limiar antes de ligar a camada (python -m agent_db.cache.semantic)
+PARES_PARAFRASE = (
+    ("Quais clientes compraram em 2024?", "Quais os clientes que compraram em 2024"),
+    ("Quais produtos estão sem estoque?", "Quais os produtos que estão sem estoque"),
+    ("Qual o total de títulos a pagar?", "Qual é o valor total dos títulos a pagar"),
+    ("Qual o saldo do produto 123?", "Qual é o saldo atual do produto 123"),
+)
+PARES_OPOSTOS = (
+    ("Títulos a pagar vencidos do fornecedor ACME", "Títulos a pagar não vencidos do fornecedor ACME"),
+    ("Quais clientes compraram em 2024?", "Quais clientes não compraram em 2024?"),
+    ("Clientes ativos com compras em 2024", "Clientes inativos com compras em 2024"),
+    ("Clientes adimplentes", "Clientes inadimplentes"),
+    ("Fornecedores bloqueados", "Fornecedores desbloqueados"),
+    ("Produtos com saldo > 0", "Produtos com saldo < 0"),
+    ("Produtos com saldo maior que 0", "Produtos com saldo menor que 0"),
+    ("Produtos mais vendidos", "Produtos menos vendidos"),
+    ("Produtos com estoque", "Produtos sem estoque"),
+    ("Vendas >= 1000", "Vendas <= 1000"),
+    ("Saldo de -5 unidades", "Saldo de 5 unidades"),
+    ("Títulos a pagar", "Títulos a receber"),
+)
+
+
+def restricoes(texto: str) -> tuple:
+    """(números, negações e comparativos, palavras): o que um candidato precisa respeitar"""
+    normalizado = _normalizer.normaliza(texto)
+    palavras = normalizado.split()
+    return (tuple(sorted(_NUMEROS.findall(normalizado))),
+            tuple(sorted(p for p in palavras if p in _NEGACOES or p in _COMPARATIVOS)),
+            frozenset(palavras))
+
+
+def compativeis(a: tuple, b: tuple) -> bool:
+    """Mesmos números, negações e comparativos, e nenhuma palavra de um lado antônima por prefixo do outro"""
+    if a[0] != b[0] or a[1] != b[1]:
+        return False
+    so_a, so_b = a[2] - b[2], b[2] - a[2]
+    return not any(prefixo + palavra in outro
+                   for lado, outro in ((so_a, so_b), (so_b, so_a))
+                   for palavra in lado for prefixo in _PREFIXOS_ANTONIMO)
+
+
+class HashingVectorizer:
+    """
+    Vetorizador local, só CPU e sem treino: palavras e trigramas de caracteres
+    da pergunta normalizada espalhados em `dim` posições por hash (crc32),
+    com sinal alternado para reduzir colisões, e norma L2 unitária
+    """
+    def __init__(self, dim: int = 1024, peso_palavra: float = 2.0):
+        self.dim = dim
+        self.peso_palavra = peso_palavra
+        self._normalizer = QueryNormalizer(stopwords=STOPWORDS_PT)
+
+    def _features(self, texto: str):
+        palavras = self._normalizer.normaliza(texto).split()
+        for palavra in palavras:
+            yield "p:" + palavra, self.peso_palavra
+            marcada = f" {palavra} "
+            for i in range(len(marcada) - 2):
+                yield "c:" + marcada[i:i + 3], 1.0
+        for a, b in zip(palavras, palavras[1:]):
+            yield f"b:{a} {b}", 1.0
+
+    def vetoriza(self, texto: str) -> np.ndarray:
+        vetor = np.zeros(self.dim, dtype=np.float32)
+        for feature, peso in self._features(texto):
+            h = zlib.crc32(feature.encode())
+            vetor[h % self.dim] += peso if (h >> 31) & 1 else -peso
+        norma = np.linalg.norm(vetor)
+        return vetor / norma if norma else vetor
+
+
+class SentenceTransformerVectorizer:
+    """Embeddings de um modelo sentence-transformers local (CPU), quando instalado"""
+    def __init__(self, modelo: str):
+        from sentence_transformers import SentenceTransformer
+
+        self._modelo = SentenceTransformer(modelo, device="cpu")
+        self.dim = self._modelo.get_sentence_embedding_dimension()
+
+    def vetoriza(self, texto: str) -> np.ndarray:
+        return self._modelo.encode(texto, normalize_embeddings=True).astype(np.float32)
+
+
+class SemanticIndex:
+    """
+    Índice vetorial das perguntas em cache para achar paráfrases: matriz
+    NumPy (opcionalmente um arquivo memmap) com uma linha por cach_hash e
+    busca top-1 por similaridade de cosseno em uma única multiplicação.
+    Perguntas com números (datas, códigos, valores), negações ou comparativos
+    diferentes, ou com antônimos por prefixo (ativos/inativos), nunca casam.
+    """
+    def __init__(self, vectorizer=None, limiar: float = 0.9, capacidade: int = 1024,
+                 path: Optional[str] = None):
+        self.vectorizer = vectorizer or HashingVectorizer()
+        self.limiar = limiar
+        self.path = path
+        self._lock = threading.Lock()
+        self._hashes: List[Optional[str]] = []
+        self._restricoes: List[Optional[tuple]] = []
+        self._posicoes = {}  # cach_hash -> linha da matriz
+        self._livres: List[int] = []
+        self._arquivo: Optional[str] = None
+        if not (path and os.path.exists(path + ".json") and self._carrega_arquivo()):
+            self._matriz = self._nova_matriz(capacidade)
+
+    @property
+    def dim(self) -> int:
+        return self.vectorizer.dim
+
+    def _nova_matriz(self, capacidade: int) -> np.ndarray:
+        if not self.path:
+            return np.zeros((capacidade, self.dim), dtype=np.float32)
+        # Um arquivo por capacidade: ao crescer, o antigo continua válido até a troca
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._arquivo = f"{self.path}.{capacidade}.npy"
+        return np.lib.format.open_memmap(self._arquivo, mode="w+", dtype=np.float32, shape=(capacidade, self.dim))
+
+    def _carrega_arquivo(self) -> bool:
+        with open(self.path + ".json", encoding="utf-8") as arquivo:
+            meta = json.load(arquivo)
+        if (meta.get("dim") != self.dim or "restricoes" not in meta
+                or not os.path.exists(meta.get("arquivo", ""))):
+            print(f"⚠️ Índice semântico em {self.path} incompatível: reconstruindo")
+            return False
+        self._arquivo = meta["arquivo"]
+        self._matriz = np.load(self._arquivo, mmap_mode="r+")
+        self._hashes = meta["hashes"]
+        self._restricoes = [(tuple(r[0]), tuple(r[1]), frozenset(r[2])) if r else None
+                            for r in meta["restricoes"]]
+        self._posicoes = {h: i for i, h in enumerate(self._hashes) if h is not None}
+        self._livres = [i for i, h in enumerate(self._hashes) if h is None]
+        print(f"🧭 Índice semântico carregado de {self.path}: {len(self._posicoes)} perguntas")
+        return True
+
+    def __len__(self) -> int:
+        return len(self._posicoes)
+
+    def adiciona(self, query_hash: str, texto: str):
+        """Inclui (ou atualiza) a pergunta de uma entrada do cache"""
+        vetor = self.vectorizer.vetoriza(texto)
+        restricao = restricoes(texto)
+        with self._lock:
+            posicao = self._posicoes.get(query_hash)
+            if posicao is None:
+                if self._livres:
+                    posicao = self._livres.pop()
+                else:
+                    posicao = len(self._hashes)
+                    if posicao >= self._matriz.shape[0]:
+                        self._cresce()
+                    self._hashes.append(None)
+                    self._restricoes.append(None)
+                self._posicoes[query_hash] = posicao
+            self._matriz[posicao] = vetor
+            self._hashes[posicao] = query_hash
+            self._restricoes[posicao] = restricao
+
+    def adiciona_varios(self, itens: Iterable[Tuple[str, str]]):
+        for query_hash, texto in itens:
+            self.adiciona(query_hash, texto)
+
+    def _cresce(self):
+        atual, arquivo_atual = self._matriz, self._arquivo
+        nova = self._nova_matriz(atual.shape[0] * 2)
+        nova[:atual.shape[0]] = atual
+        self._matriz = nova
+        if arquivo_atual:
+            del atual
+            try:
+                os.remove(arquivo_atual)
+            except OSError:
+                pass  # Windows: ainda mapeado, fica para a próxima limpeza
+
+    def remove(self, query_hash: str):
+        with self._lock:
+            posicao = self._posicoes.pop(query_hash, None)
+            if posicao is not None:
+                self._matriz[posicao] = 0.0
+                self._hashes[posicao] = None
+                self._restricoes[posicao] = None
+                self._livres.append(posicao)
+
+    def busca(self, texto: str) -> Optional[Tuple[str, float]]:
+        """(cach_hash, similaridade) da pergunta mais parecida acima do limiar"""
+        vetor = self.vectorizer.vetoriza(texto)
+        restricao = restricoes(texto)
+        with self._lock:
+            n = len(self._hashes)
+            if not self._posicoes or not vetor.any():
+                return None
+            similaridades = self._matriz[:n] @ vetor
+            k = min(5, n)
+            melhores = np.argpartition(-similaridades, k - 1)[:k]
+            # Só candidatos com os mesmos números, negações e comparativos
+            for posicao in melhores[np.argsort(-similaridades[melhores])]:
+                similaridade = float(similaridades[posicao])
+                if similaridade < self.limiar:
+                    return None
+                if self._hashes[posicao] is not None and compativeis(self._restricoes[posicao], restricao):
+                    return self._hashes[posicao], similaridade
+        return None
+
+    def salva(self):
+        """Grava os metadados ao lado do memmap (sem path, nada a fazer)"""
+        if not self.path:
+            return
+        with self._lock:
+            self._matriz.flush()
+            with open(self.path + ".json", "w", encoding="utf-8") as arquivo:
+                restricoes_json = [[list(r[0]), list(r[1]), sorted(r[2])] if r else None for r in self._restricoes]
+                json.dump({"dim": self.dim, "arquivo": self._arquivo, "hashes": self._hashes,
+                           "restricoes": restricoes_json}, arquivo)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "perguntas": len(self._posicoes),
+                "capacidade": int(self._matriz.shape[0]),
+                "dim": self.dim,
+                "limiar": self.limiar,
+                "memmap": bool(self.path),
+            }
+
+
+def calibra(vectorizer, limiar: float) -> dict:
+    """
+    Roda PARES_PARAFRASE e PARES_OPOSTOS em um índice descartável: quantas
+    paráfrases casam e quais pares opostos casariam (qualquer um é resposta errada)
+    """
+    def _casa(a: str, b: str) -> bool:
+        indice = SemanticIndex(vectorizer, limiar=limiar, capacidade=1)
+        indice.adiciona(a, a)
+        return indice.busca(b) is not None
+
+    return {
+        "parafrases": sum(_casa(a, b) for a, b in PARES_PARAFRASE),
+        "total_parafrases": len(PARES_PARAFRASE),
+        "opostos": [(a, b) for a, b in PARES_OPOSTOS if _casa(a, b) or _casa(b, a)],
+    }
+
+
+def _vectorizer_config():
+    from config_db import config
+
+    if config.CACHE_SEMANTIC_MODEL == "hashing":
+        return HashingVectorizer(dim=config.CACHE_SEMANTIC_DIM)
+    return SentenceTransformerVectorizer(config.CACHE_SEMANTIC_MODEL)
+
+
+def cria_indice(textos: Callable[[], Iterable[Tuple[str, str]]]) -> Optional[SemanticIndex]:
+    """
+    Índice conforme CACHE_SEMANTIC*, já populado com as perguntas ativas do
+    cache; fica desligado se a calibração casar algum par oposto
+    """
+    from config_db import config
+
+    if not config.CACHE_SEMANTIC:
+        return None
+    vectorizer = _vectorizer_config()
+    calibracao = calibra(vectorizer, config.CACHE_SEMANTIC_THRESHOLD)
+    if calibracao["opostos"]:
+        print(f"⚠️ Índice semântico desligado: o limiar {config.CACHE_SEMANTIC_THRESHOLD} casa perguntas opostas "
+              f"{calibracao['opostos']}")
+        return None
+    print(f"🧭 Índice semântico: {calibracao['parafrases']}/{calibracao['total_parafrases']} paráfrases "
+          f"de calibração casam no limiar {config.CACHE_SEMANTIC_THRESHOLD}")
+    indice = SemanticIndex(vectorizer, limiar=config.CACHE_SEMANTIC_THRESHOLD, path=config.CACHE_SEMANTIC_PATH)
+    if not len(indice):
+        indice.adiciona_varios(textos())
+    print(f"🧭 Índice semântico: {len(indice)} perguntas (limiar {indice.limiar})")
+    return indice
+
+
+if __name__ == "__main__":
+    import sys
+
+    from config_db import config
+
+    resultado = calibra(_vectorizer_config(), config.CACHE_SEMANTIC_THRESHOLD)
+    print(json.dumps(resultado, ensure_ascii=False, indent=2))
+    sys.exit(1 if resultado["opostos"] else 0)
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+import metrics
+
+from agent_db.cache.compression import tamanho_resposta
+
+def hora_de(momento: datetime) -> datetime:
+    """Balde horário da expiração"""
+    return momento.replace(minute=0, second=0, microsecond=0)
+
+
+def resume(contadores: Dict[str, int], histograma: Dict[datetime, Tuple[int, int]],
+           agora: Optional[datetime] = None) -> dict:
+    """
+    Estatísticas a partir dos contadores e do histograma horário de expiração.
+    Um balde conta como expirado quando a hora inteira já passou (precisão de 1h).
+    """
+    agora = agora or datetime.now()
+    limite = hora_de(agora)
+    total = sum(qtd for qtd, _ in histograma.values())
+    expiradas = sum(qtd for hora, (qtd, _) in histograma.items() if hora < limite)
+    consultas = contadores.get("hits", 0) + contadores.get("misses", 0)
+    return {
+        'total_entries': total,
+        'active_entries': total - expiradas,
+        'expired_entries': expiradas,
+        'bytes': sum(b for _, b in histograma.values()),
+        'hits': contadores.get("hits", 0),
+        'misses': contadores.get("misses", 0),
+        'sets': contadores.get("sets", 0),
+        'hit_ratio': round(contadores.get("hits", 0) / consultas, 4) if consultas else 0.0,
+    }
+
+
+def soma(contadores: Dict[str, int], histograma: Dict[datetime, Tuple[int, int]],
+         locais: Dict[str, int], hist_local: Dict[datetime, Tuple[int, int]]):
+    """Leitura das tabelas mais os deltas ainda não gravados"""
+    contadores, histograma = dict(contadores), dict(histograma)
+    for nome, valor in locais.items():
+        contadores[nome] = contadores.get(nome, 0) + valor
+    for hora, (qtd, b) in hist_local.items():
+        atual = histograma.get(hora, (0, 0))
+        histograma[hora] = (atual[0] + qtd, atual[1] + b)
+    return contadores, histograma
+
+
+class CacheStats:
+    """
+    Estatísticas incrementais da cache_agente: cada worker acumula em memória
+    os hits/misses/sets e a variação do histograma horário de expiração
+    (entradas e bytes por hora de cach_expi_at) e soma tudo periodicamente nas
+    tabelas cache_estatistica e cache_expiracao_hora. get_stats lê essas
+    tabelas pequenas em vez de varrer a cache_agente.
+    """
+    def __init__(self, executa, intervalo: float = 10.0):
+        self._executa = executa  # executa(operacao(connection)) do CacheManager
+        self.tamanho_sql = tamanho_resposta(False)
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._contadores: Dict[str, int] = defaultdict(int)
+        self._histograma: Dict[datetime, list] = defaultdict(lambda: [0, 0])
+        self._ultimo: Optional[tuple] = None  # última leitura das tabelas
+        self._ultimo_em = 0.0
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config(cls, executa) -> "CacheStats":
+        from config_db import config
+
+        return cls(executa, intervalo=config.CACHE_STATS_FLUSH)
+
+    def inicia(self) -> "CacheStats":
+        if self.intervalo > 0:
+            self._thread = threading.Thread(target=self._roda, name="cache_stats", daemon=True)
+            self._thread.start()
+        return self
+
+    def _roda(self):
+        while not self._parar.wait(self.intervalo):
+            try:
+                self.flush()
+                self._atualiza_metricas(self.snapshot(maximo=0))
+            except Exception as e:
+                print(f"⚠️ Cache: falha ao gravar estatísticas: {e}")
+
+    # --- registro em memória (caminho quente: só locks locais) ---
+
+    def consulta(self, hit: bool):
+        with self._lock:
+            self._contadores["hits" if hit else "misses"] += 1
+
+    def gravacao(self, expira_em: datetime, tamanho: int, anterior: Optional[Tuple[datetime, int]] = None):
+        """Entrada gravada com `tamanho` bytes; `anterior` é (expiração, bytes) da versão substituída, se havia"""
+        with self._lock:
+            self._contadores["sets"] += 1
+            balde = self._histograma[hora_de(expira_em)]
+            balde[0] += 1
+            balde[1] += tamanho
+            if anterior is not None and anterior[0] is not None:
+                balde = self._histograma[hora_de(anterior[0])]
+                balde[0] -= 1
+                balde[1] -= anterior[1] or 0
+
+    def remocao(self, linhas: Iterable[Tuple[datetime, int]]):
+        """Entradas apagadas: (expiração, bytes) de cada uma"""
+        with self._lock:
+            for expira_em, tamanho_resposta in linhas:
+                if expira_em is None:
+                    continue
+                balde = self._histograma[hora_de(expira_em)]
+                balde[0] -= 1
+                balde[1] -= tamanho_resposta or 0
+
+    def reexpira(self, linhas: Iterable[Tuple[datetime, int]], expira_em: datetime):
+        """Entradas que tiveram a expiração antecipada para `expira_em`: (expiração antiga, bytes)"""
+        with self._lock:
+            for antiga, tamanho in linhas:
+                if antiga is not None:
+                    balde = self._histograma[hora_de(antiga)]
+                    balde[0] -= 1
+                    balde[1] -= tamanho or 0
+                balde = self._histograma[hora_de(expira_em)]
+                balde[0] += 1
+                balde[1] += tamanho or 0
+
+    # --- persistência ---
+
+    def flush(self):
+        """Soma os deltas deste worker nas tabelas de estatística"""
+        with self._lock:
+            contadores, self._contadores = self._contadores, defaultdict(int)
+            histograma, self._histograma = self._histograma, defaultdict(lambda: [0, 0])
+        if not any(contadores.values()) and not any(q or b for q, b in histograma.values()):
+            return
+
+        def _flush(connection):
+            cursor = connection.cursor()
+            try:
+                for nome, valor in contadores.items():
+                    if valor:
+                        cursor.execute(
+                            """
+                            INSERT INTO cache_estatistica (cest_nome, cest_valo) VALUES (%s, %s)
+                            ON CONFLICT (cest_nome) DO UPDATE SET cest_valo = cache_estatistica.cest_valo + EXCLUDED.cest_valo
+                            """,
+                            (nome, valor)
+                        )
+                for hora, (qtd, bytes_) in histograma.items():
+                    if qtd or bytes_:
+                        cursor.execute(
+                            """
+                            INSERT INTO cache_expiracao_hora (ceho_hora, ceho_qtd, ceho_byte) VALUES (%s, %s, %s)
+                            ON CONFLICT (ceho_hora) DO UPDATE SET
+                                ceho_qtd = cache_expiracao_hora.ceho_qtd + EXCLUDED.ceho_qtd,
+                                ceho_byte = cache_expiracao_hora.ceho_byte + EXCLUDED.ceho_byte
+                            """,
+                            (hora, qtd, bytes_)
+                        )
+                cursor.execute("DELETE FROM cache_expiracao_hora WHERE ceho_qtd <= 0")
+                connection.commit()
+            finally:
+                cursor.close()
+        try:
+            self._executa(_flush)
+            self._ultimo = None
+        except Exception:
+            # Devolve os deltas para a próxima tentativa
+            with self._lock:
+                for nome, valor in contadores.items():
+                    self._contadores[nome] += valor
+                for hora, (qtd, bytes_) in histograma.items():
+                    self._histograma[hora][0] += qtd
+                    self._histograma[hora][1] += bytes_
+            raise
+
+    def _le(self) -> Tuple[Dict[str, int], Dict[datetime, Tuple[int, int]]]:
+        def _leitura(connection):
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT cest_nome, cest_valo FROM cache_estatistica")
+                contadores = {nome: int(valor) for nome, valor in cursor.fetchall()}
+                cursor.execute("SELECT ceho_hora, ceho_qtd, ceho_byte FROM cache_expiracao_hora")
+                histograma = {hora: (int(qtd), int(b)) for hora, qtd, b in cursor.fetchall()}
+                connection.commit()
+                return contadores, histograma
+            finally:
+                cursor.close()
+        return self._executa(_leitura)
+
+    def pendentes(self) -> Tuple[Dict[str, int], Dict[datetime, Tuple[int, int]]]:
+        with self._lock:
+            return dict(self._contadores), {h: tuple(v) for h, v in self._histograma.items()}
+
+    def snapshot(self, maximo: Optional[float] = None) -> dict:
+        """
+        Estatísticas das tabelas mais os deltas ainda não gravados deste worker.
+        Reaproveita a última leitura por até `maximo` segundos (padrão: o intervalo de flush).
+        """
+        maximo = self.intervalo if maximo is None else maximo
+        if self._ultimo is None or time.monotonic() - self._ultimo_em > maximo:
+            contadores, histograma = self._le()
+            self._ultimo, self._ultimo_em = (contadores, histograma), time.monotonic()
+        return resume(*soma(*self._ultimo, *self.pendentes()))
+
+    def recalcula(self):
+        """Refaz o histograma com uma varredura completa (criação das tabelas ou correção de deriva)"""
+        def _recalcula(connection):
+            cursor = connection.cursor()
+            try:
+                cursor.execute("DELETE FROM cache_expiracao_hora")
+                cursor.execute(
+                    f"""
+                    SELECT cach_expi_at, {self.tamanho_sql} FROM cache_agente
+                    WHERE cach_expi_at IS NOT NULL
+                    """
+                )
+                histograma = defaultdict(lambda: [0, 0])
+                for expira_em, bytes_ in cursor.fetchall():
+                    balde = histograma[hora_de(expira_em)]
+                    balde[0] += 1
+                    balde[1] += bytes_ or 0
+                for hora, (qtd, bytes_) in histograma.items():
+                    cursor.execute(
+                        "INSERT INTO cache_expiracao_hora (ceho_hora, ceho_qtd, ceho_byte) VALUES (%s, %s, %s)",
+                        (hora, qtd, bytes_)
+                    )
+                connection.commit()
+            finally:
+                cursor.close()
+        # As escritas ainda não gravadas deste worker já estão na tabela varrida
+        with self._lock:
+            self._histograma = defaultdict(lambda: [0, 0])
+        self._executa(_recalcula)
+        self._ultimo = None
+        print("📊 Cache: estatísticas recalculadas a partir da tabela")
+
+    def _atualiza_metricas(self, stats: dict):
+        metrics.CACHE_ENTRADAS.set(stats['active_entries'], estado="ativas")
+        metrics.CACHE_ENTRADAS.set(stats['expired_entries'], estado="expiradas")
+        metrics.CACHE_BYTES.set(stats['bytes'])
+
+    def close(self):
+        self._parar.set()
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"⚠️ Cache: estatísticas pendentes não gravadas: {e}")
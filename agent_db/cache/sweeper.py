@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from typing import Optional
+
+import metrics
+
+
+class ExpirySweeper:
+    """
+    Remove as entradas expiradas da cache_agente em segundo plano: a cada
+    `intervalo` segundos apaga em lotes de `lote` linhas, com `pausa` entre
+    os lotes, para não segurar locks nem disputar o banco com as consultas
+    """
+    def __init__(self, cache_manager, intervalo: float = 300.0, lote: int = 500, pausa: float = 0.1):
+        self.cache_manager = cache_manager
+        self.intervalo = intervalo
+        self.lote = lote
+        self.pausa = pausa
+        self._parar = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {
+            "execucoes": 0,
+            "em_execucao": False,
+            "removidas_total": 0,
+            "removidas_ultima": 0,
+            "lotes_ultima": 0,
+            "duracao_ultima": 0.0,
+            "ultima_execucao": None,
+            "puladas": 0,
+            "erros": 0,
+            "ultimo_erro": None,
+        }
+
+    @classmethod
+    def from_config(cls, cache_manager) -> "ExpirySweeper":
+        from config_db import config
+
+        return cls(cache_manager, intervalo=config.CACHE_SWEEP_INTERVAL,
+                   lote=config.CACHE_SWEEP_BATCH, pausa=config.CACHE_SWEEP_PAUSE)
+
+    def inicia(self) -> "ExpirySweeper":
+        if self.intervalo > 0:
+            self._thread = threading.Thread(target=self._roda, name="cache_sweeper", daemon=True)
+            self._thread.start()
+        return self
+
+    def _roda(self):
+        while not self._parar.is_set():
+            self.executa()
+            self._parar.wait(self.intervalo)
+
+    def executa(self) -> int:
+        """Uma varredura completa: lotes até não sobrar expirado (ou parar)"""
+        inicio = time.monotonic()
+        removidas = lotes = 0
+        with self._lock:
+            self._stats["em_execucao"] = True
+        try:
+            while not self._parar.is_set():
+                apagadas = self.cache_manager.remove_expirados(self.lote)
+                if apagadas < 0:
+                    # Outro worker está varrendo
+                    with self._lock:
+                        self._stats["puladas"] += 1
+                    break
+                lotes += 1
+                removidas += apagadas
+                metrics.CACHE_EXPIRADAS_REMOVIDAS.inc(apagadas)
+                with self._lock:
+                    self._stats["removidas_total"] += apagadas
+                    self._stats["removidas_ultima"] = removidas
+                    self._stats["lotes_ultima"] = lotes
+                if apagadas < self.lote:
+                    break
+                self._parar.wait(self.pausa)
+        except Exception as e:
+            with self._lock:
+                self._stats["erros"] += 1
+                self._stats["ultimo_erro"] = str(e)
+            print(f"❌ Erro na varredura do cache: {e}")
+        finally:
+            with self._lock:
+                self._stats["em_execucao"] = False
+                self._stats["execucoes"] += 1
+                self._stats["duracao_ultima"] = round(time.monotonic() - inicio, 3)
+                self._stats["ultima_execucao"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        if removidas:
+            print(f"🧹 Cache: {removidas} entradas expiradas removidas em {lotes} lotes")
+        return removidas
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"intervalo": self.intervalo, "lote": self.lote, **self._stats}
+
+    def close(self):
+        self._parar.set()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import re
+from typing import Iterable, Optional, Tuple
+
+# Classes de volatilidade, da que muda mais para a que muda menos
+VOLATIL = "volatil"
+PADRAO = "padrao"
+ESTAVEL = "estavel"
+
+# (identificador de tabela/coluna/função no SQL, classe); vence a classe mais volátil encontrada
+REGRAS = (
+    # Vencimentos e saldos mudam ao longo do dia, e CURRENT_DATE/NOW() mudam sozinhos
+    (re.compile(r"^(titu_venc|sapr_sald|current_date|current_timestamp|now|localtimestamp)$"), VOLATIL),
+    (re.compile(r"^(titulospagar|titulosreceber|saldosprodutos|titu_\w+|sapr_\w+)$"), PADRAO),
+    # Cadastros
+    (re.compile(r"^(entidades|produtos|enti_\w+|prod_\w+)$"), ESTAVEL),
+)
+_ORDEM = (VOLATIL, PADRAO, ESTAVEL)
+
+# Peso de cada novo refresh na taxa de mudança (média móvel exponencial; 0.5 = sem histórico)
+PESO_REFRESH = 0.3
+TAXA_INICIAL = 0.5
+# Limites do ajuste pela taxa observada sobre o TTL da classe
+FATOR_MIN = 0.25
+FATOR_MAX = 4.0
+
+_NUMEROS = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def assinatura(resposta: str) -> str:
+    """
+    Resumo da resposta para detectar se um refresh mudou os dados: os números
+    citados (valores, quantidades, datas), ou o texto normalizado se não há
+    números; evita contar como mudança só a redação diferente do LLM
+    """
+    numeros = _NUMEROS.findall(resposta or "")
+    base = " ".join(numeros) if numeros else " ".join((resposta or "").lower().split())
+    return hashlib.md5(base.encode("utf-8")).hexdigest()
+
+
+class TTLPolicy:
+    """
+    Escolhe o TTL de cada resposta: a classe de volatilidade das tabelas e
+    colunas lidas define o TTL base e a taxa de mudança observada nos refreshes
+    da mesma pergunta o aumenta (resposta que se repete) ou reduz (resposta
+    que muda), sempre entre `minimo` e `maximo` segundos
+    """
+    def __init__(self, volatil: float = 3600.0, padrao: float = 7 * 86400.0, estavel: float = 30 * 86400.0,
+                 minimo: float = 300.0, maximo: float = 90 * 86400.0, adaptativo: bool = True):
+        self.bases = {VOLATIL: volatil, PADRAO: padrao, ESTAVEL: estavel}
+        self.minimo = minimo
+        self.maximo = maximo
+        self.adaptativo = adaptativo
+
+    @classmethod
+    def from_config(cls) -> "TTLPolicy":
+        from config_db import config
+
+        return cls(volatil=config.CACHE_TTL_VOLATILE_HOURS * 3600, padrao=config.CACHE_TTL_DAYS * 86400,
+                   estavel=config.CACHE_TTL_STABLE_DAYS * 86400, minimo=config.CACHE_TTL_MIN_SECONDS,
+                   maximo=config.CACHE_TTL_MAX_DAYS * 86400, adaptativo=config.CACHE_TTL_ADAPTIVE)
+
+    def classifica(self, tabelas: Optional[Iterable[str]], colunas: Optional[Iterable[str]]) -> str:
+        """Classe mais volátil entre os identificadores; sem SQL conhecido, a padrão"""
+        encontradas = set()
+        for identificador in [*(tabelas or ()), *(colunas or ())]:
+            for padrao, classe in REGRAS:
+                if padrao.match(identificador):
+                    encontradas.add(classe)
+                    break
+        for classe in _ORDEM:
+            if classe in encontradas:
+                return classe
+        return PADRAO
+
+    def escolhe(self, tabelas: Optional[Iterable[str]] = None, colunas: Optional[Iterable[str]] = None,
+                taxa: Optional[float] = None) -> Tuple[str, float]:
+        """(classe, TTL em segundos) para a resposta"""
+        if not self.adaptativo:
+            return PADRAO, self.bases[PADRAO]
+        classe = self.classifica(tabelas, colunas)
+        ttl = self.bases[classe]
+        if taxa is not None:
+            # Chance de a resposta se manter contra a de mudar no próximo refresh
+            taxa = min(max(taxa, 0.01), 0.99)
+            ttl *= min(max((1 - taxa) / taxa, FATOR_MIN), FATOR_MAX)
+        return classe, min(max(ttl, self.minimo), self.maximo)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import ast
+import time
+from typing import Any, Callable, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+import metrics
+
+# Nome da ferramenta do toolkit SQL que executa as consultas
+SQL_QUERY_TOOL = "sql_db_query"
+
+
+class StreamingCallbackHandler(BaseCallbackHandler):
+    """
+    Encaminha tokens do LLM e passos intermediários do agente SQL
+    (SQL gerado, linhas retornadas) para um callback de eventos
+    """
+    def __init__(self, on_event: Callable[[Dict[str, Any]], None], max_preview: int = 500):
+        self.on_event = on_event
+        self.max_preview = max_preview
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if token:
+            self.on_event({"type": "token", "content": token})
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> None:
+        name = (serialized or {}).get("name") or kwargs.get("name")
+        if name == SQL_QUERY_TOOL:
+            inputs = kwargs.get("inputs") or {}
+            self.on_event({"type": "sql", "content": inputs.get("query", input_str)})
+        else:
+            self.on_event({"type": "step", "tool": name, "content": input_str[:self.max_preview]})
+
+    def on_tool_end(self, output: Any, **kwargs: Any) -> None:
+        if kwargs.get("name") != SQL_QUERY_TOOL:
+            return
+        texto = str(getattr(output, "content", output))
+        self.on_event({
+            "type": "rows",
+            "content": texto[:self.max_preview],
+            "linhas": self._conta_linhas(texto)
+        })
+
+    def on_tool_error(self, error: BaseException, **kwargs: Any) -> None:
+        if kwargs.get("name") == SQL_QUERY_TOOL:
+            self.on_event({"type": "step", "tool": SQL_QUERY_TOOL, "content": f"Erro: {error}"})
+
+    @staticmethod
+    def _conta_linhas(texto: str) -> Optional[int]:
+        """Conta as linhas do resultado do SQLDatabase.run (repr de lista de tuplas)"""
+        if not texto.strip():
+            return 0
+        try:
+            linhas = ast.literal_eval(texto)
+            return len(linhas) if isinstance(linhas, list) else None
+        except (ValueError, SyntaxError):
+            # Tipos como Decimal/datetime não são literais: conta pelas tuplas
+            if texto.lstrip().startswith("[("):
+                return texto.count("), (") + 1
+            return None
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Alimenta as métricas do agente SQL: chamadas e latência do LLM por modelo,
+    tempo de execução das consultas SQL e número de passos do agente
+    """
+    def __init__(self):
+        self.iteracoes = 0
+        self._inicio: Dict[UUID, tuple] = {}
+
+    def _modelo(self, serialized: Dict[str, Any], kwargs: Dict[str, Any]) -> str:
+        params = kwargs.get("invocation_params") or {}
+        return params.get("model") or params.get("model_name") or (serialized or {}).get("name") or "desconhecido"
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs: Any) -> None:
+        self._inicio[run_id] = (self._modelo(serialized, kwargs), time.perf_counter())
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs: Any) -> None:
+        self._inicio[run_id] = (self._modelo(serialized, kwargs), time.perf_counter())
+
+    def _fim_llm(self, run_id: UUID, status: str):
+        inicio = self._inicio.pop(run_id, None)
+        if inicio is None:
+            return
+        modelo, t0 = inicio
+        metrics.LLM_CHAMADAS.inc(modelo=modelo, status=status)
+        metrics.LLM_LATENCIA.observe(time.perf_counter() - t0, modelo=modelo)
+
+    def on_llm_end(self, response, *, run_id, **kwargs: Any) -> None:
+        self._fim_llm(run_id, "ok")
+
+    def on_llm_error(self, error: BaseException, *, run_id, **kwargs: Any) -> None:
+        self._fim_llm(run_id, "erro")
+
+    def on_agent_action(self, action, **kwargs: Any) -> None:
+        self.iteracoes += 1
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs: Any) -> None:
+        if ((serialized or {}).get("name") or kwargs.get("name")) == SQL_QUERY_TOOL:
+            self._inicio[run_id] = (SQL_QUERY_TOOL, time.perf_counter())
+
+    def _fim_sql(self, run_id: UUID, status: str):
+        inicio = self._inicio.pop(run_id, None)
+        if inicio is not None:
+            metrics.SQL_EXECUCAO.observe(time.perf_counter() - inicio[1], status=status)
+
+    def on_tool_end(self, output: Any, *, run_id, **kwargs: Any) -> None:
+        # A ferramenta do toolkit devolve o erro do banco como texto
+        texto = str(getattr(output, "content", output))
+        self._fim_sql(run_id, "erro" if texto.startswith("Error:") else "ok")
+
+    def on_tool_error(self, error: BaseException, *, run_id, **kwargs: Any) -> None:
+        self._fim_sql(run_id, "erro")
+
+
+class ConsultasCallbackHandler(BaseCallbackHandler):
+    """
+    Guarda o SQL das consultas executadas com sucesso pela ferramenta do
+    toolkit, para registrar de quais tabelas a resposta em cache depende
+    """
+    def __init__(self):
+        self.consultas: List[str] = []
+        self._pendentes: Dict[UUID, str] = {}
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs: Any) -> None:
+        if ((serialized or {}).get("name") or kwargs.get("name")) == SQL_QUERY_TOOL:
+            inputs = kwargs.get("inputs") or {}
+            self._pendentes[run_id] = inputs.get("query", input_str)
+
+    def on_tool_end(self, output: Any, *, run_id, **kwargs: Any) -> None:
+        consulta = self._pendentes.pop(run_id, None)
+        if consulta is not None and not str(getattr(output, "content", output)).startswith("Error:"):
+            self.consultas.append(consulta)
+
+    def on_tool_error(self, error: BaseException, *, run_id, **kwargs: Any) -> None:
+        self._pendentes.pop(run_id, None)
@@ -6,29 +6,70 @@ import sys
 if sys.platform.startswith('win'):
     os.environ['PYTHONIOENCODING'] = 'utf-8'
 
+import asyncio
+import contextvars
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from typing import Annotated, TypedDict
+from langchain_core.runnables import RunnableConfig
+from typing import Annotated, AsyncIterator, TypedDict
+from .cache.async_manager import AsyncCacheManager
+from .cache.dependencies import ChangeDetector, colunas_das_consultas, tabelas_das_consultas
 from .cache.manager import CacheManager
+from .cache.semantic import cria_indice
+from .cache.sweeper import ExpirySweeper
+from .callbacks import ConsultasCallbackHandler, StreamingCallbackHandler
+from .singleflight import Broadcast, SingleFlight
+from .tracing import TracingCallbackHandler, request_id_var, tracer
 from .tools import AgentTools
 from config_db import config
+import metrics
 
 class AgentState(TypedDict):
     messages: Annotated[list, add_messages]
     pergunta: str
     resposta: str
     cache_hit: bool
+    cache_expirado: bool
+    consultas: list
+    erro: bool
 
 class AgentDB:
-    def __init__(self):
-        self.cache_manager = CacheManager()
-        # Limpar cache expirado na inicialização
-        self.cache_manager.cleanup_expired()
+    def __init__(self, cache_manager: CacheManager = None, agent_tools: AgentTools = None,
+                 async_cache: AsyncCacheManager = None):
+        self.cache_manager = cache_manager or CacheManager()
+        # Consulta ao cache direto no event loop (astream/arun), quando disponível
+        self.async_cache = async_cache
+        # Expirados são removidos em segundo plano, em lotes (não atrasa a inicialização)
+        self.varredura = ExpirySweeper.from_config(self.cache_manager).inicia()
+        # Respostas expiradas quando as tabelas que elas leram recebem escritas
+        self.dependencias = ChangeDetector.from_config(self.cache_manager).inicia()
+        # Camada semântica opcional: paráfrases de perguntas já respondidas
+        self.semantico = cria_indice(self.cache_manager.textos_ativos)
+        # Stale-while-revalidate: janela (s) em que uma resposta expirada ainda é servida
+        self.graca = config.CACHE_STALE_GRACE
         
         # Inicializar AgentTools
-        db_uri = config.get_database_url()
-        self.agent_tools = AgentTools(db_uri)
+        self.agent_tools = agent_tools or AgentTools(config.get_database_url())
         self.workflow = self._build_workflow()
+
+        # Executor dedicado para o workflow (psycopg2 + LLM são bloqueantes)
+        self.max_workers = config.AGENT_DB_MAX_WORKERS
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="agent_db"
+        )
+        self._fila_lock = threading.Lock()
+        self._na_fila = 0
+        self._em_execucao = 0
+
+        # Perguntas idênticas simultâneas compartilham uma única execução
+        self._voos = SingleFlight()
+        self._transmissoes = {}  # hash da pergunta -> Broadcast (acessado só no event loop)
+        self._coalescidas_async = 0
+        self._revalidando = set()  # hashes com atualização em segundo plano em andamento
         
         # Estatísticas do cache
         stats = self.cache_manager.get_stats()
@@ -39,9 +80,9 @@ class AgentDB:
         workflow = StateGraph(AgentState)
         
         # Adiciona os nós
-        workflow.add_node("checa_cache", self._checa_cache)
-        workflow.add_node("processa_pergunta", self._process_query)
-        workflow.add_node("salva_cache", self._salva_cache)
+        workflow.add_node("checa_cache", self._com_span("checa_cache", self._checa_cache))
+        workflow.add_node("processa_pergunta", self._com_span("processa_pergunta", self._process_query))
+        workflow.add_node("salva_cache", self._com_span("salva_cache", self._salva_cache))
         
         # Define as conexões
         workflow.add_edge(START, "checa_cache")
@@ -62,10 +103,38 @@ class AgentDB:
                 
         return workflow.compile()
 
-    def _checa_cache(self, state: AgentState) -> AgentState:
+    @staticmethod
+    def _com_span(nome: str, no):
+        """Envolve o nó do grafo em um span com a duração da etapa"""
+        recebe_config = "config" in inspect.signature(no).parameters
+
+        def _no(state: AgentState, config: RunnableConfig) -> AgentState:
+            with tracer.span(nome):
+                return no(state, config) if recebe_config else no(state)
+
+        return _no
+
+    def _checa_cache(self, state: AgentState, config: RunnableConfig) -> AgentState:
         pergunta = state["pergunta"]
+        if config.get("configurable", {}).get("cache_consultado"):
+            # Já consultado de forma assíncrona em astream: foi miss
+            state["cache_hit"] = False
+            return state
         query_hash = self.cache_manager.get_query_cache(pergunta)
-        cache = self.cache_manager.get(query_hash)
+        with tracer.span("cache.get") as span, metrics.CACHE_LATENCIA.time(operacao="get"):
+            cache, expirada = self.cache_manager.get_com_graca(query_hash, self.graca)
+            span.set(hit=bool(cache), expirada=expirada)
+        state["cache_expirado"] = bool(cache) and expirada
+        if cache:
+            metrics.CACHE_CONSULTAS.inc(resultado="hit_expirado" if expirada else "hit")
+            if expirada:
+                self._revalida(pergunta, query_hash)
+        else:
+            similar = self._candidato_semantico(pergunta)
+            if similar:
+                cache = self.cache_manager.get(similar)
+                self._confirma_semantico(similar, cache)
+            metrics.CACHE_CONSULTAS.inc(resultado="hit_semantico" if cache else "miss")
         
         if cache:
             state["resposta"] = cache
@@ -75,13 +144,73 @@ class AgentDB:
             
         return state
     
+    def _revalida(self, pergunta: str, query_hash: str):
+        """
+        Refaz em segundo plano (processa_pergunta + salva_cache) uma resposta
+        servida expirada; uma única atualização por pergunta de cada vez
+        """
+        with self._fila_lock:
+            if query_hash in self._revalidando:
+                return
+            self._revalidando.add(query_hash)
+        atual = tracer.span_atual()
+        origem = atual.trace_id if atual else request_id_var.get()
+
+        def _refaz():
+            try:
+                with tracer.span("cache.revalida", origem_request_id=origem):
+                    self._invoke(pergunta, cache_consultado=True)
+                metrics.CACHE_REVALIDACOES.inc(resultado="ok")
+            except Exception as e:
+                metrics.CACHE_REVALIDACOES.inc(resultado="erro")
+                print(f"❌ Erro ao revalidar o cache: {e}")
+            finally:
+                with self._fila_lock:
+                    self._revalidando.discard(query_hash)
+
+        try:
+            # Contexto vazio: a revalidação abre o próprio trace em vez de virar filha
+            # de uma requisição que já terminou (e cujos spans já foram exportados)
+            self._submit(_refaz, contexto=contextvars.Context())
+        except RuntimeError:
+            # Executor encerrado (desligando): a entrada expira normalmente
+            with self._fila_lock:
+                self._revalidando.discard(query_hash)
+
+    def _candidato_semantico(self, pergunta: str):
+        """cach_hash de uma paráfrase já respondida (acima do limiar), se houver"""
+        if self.semantico is None:
+            return None
+        with tracer.span("cache.semantico") as span:
+            encontrado = self.semantico.busca(pergunta)
+            span.set(encontrado=encontrado is not None)
+            if encontrado is None:
+                return None
+            query_hash, similaridade = encontrado
+            span.set(similaridade=round(similaridade, 4))
+        return query_hash
+
+    def _confirma_semantico(self, query_hash: str, resposta):
+        """A entrada da paráfrase expirou ou foi removida: sai do índice"""
+        if not resposta:
+            self.semantico.remove(query_hash)
+
     def _route_query(self, state: AgentState) -> str:
         return "cache_hit" if state["cache_hit"] else "process"
     
-    def _process_query(self, state: AgentState) -> AgentState:
+    def _process_query(self, state: AgentState, config: RunnableConfig) -> AgentState:
         pergunta = state["pergunta"]
-        resposta = self.agent_tools.query_database(pergunta)
+        # Em modo streaming, encaminha tokens e passos do agente SQL
+        on_event = config.get("configurable", {}).get("on_event")
+        consultas = ConsultasCallbackHandler()
+        callbacks = [TracingCallbackHandler(tracer, tracer.span_atual()), consultas]
+        if on_event:
+            callbacks.append(StreamingCallbackHandler(on_event))
+        # erro: rate limit, falha na consulta ou resposta de recuperação (não vai para o cache)
+        resposta, erro = self.agent_tools.consulta(pergunta, callbacks=callbacks)
         state["resposta"] = resposta
+        state["erro"] = erro
+        state["consultas"] = consultas.consultas
         return state
     
     def _salva_cache(self, state: AgentState) -> AgentState:
@@ -93,25 +222,203 @@ class AgentDB:
             if not resposta or (isinstance(resposta, dict) and not resposta.get("dados")):
                 print("❌ Resposta vazia ou inválida. Cache não salvo.")
                 return state
+            if state.get("erro"):
+                print("⚠️ Resposta de erro (rate limit ou falha na consulta). Cache não salvo.")
+                return state
             
             query_hash = self.cache_manager.get_query_cache(pergunta)
-            self.cache_manager.set(query_hash, pergunta, resposta)
+            # Sem SQL executado (ex.: resposta do cache do AgentTools) as dependências ficam como estão
+            consultas = state.get("consultas") or []
+            tabelas = tabelas_das_consultas(consultas) or None
+            # Tabelas e colunas lidas também definem a classe de volatilidade (TTL) da resposta
+            colunas = colunas_das_consultas(consultas) or None
+            with tracer.span("cache.set"), metrics.CACHE_LATENCIA.time(operacao="set"):
+                self.cache_manager.set(query_hash, pergunta, resposta, tabelas=tabelas, colunas=colunas)
+            if self.semantico is not None:
+                self.semantico.adiciona(query_hash, pergunta)
             print("✅ Cache salvo com sucesso.")
         
         return state
 
     
-    def run(self, pergunta: str) -> str:
+    def _invoke(self, pergunta: str, on_event=None, cache_consultado: bool = False) -> AgentState:
         initial_state = {
             "messages": [],
             "pergunta": pergunta,
             "resposta": "",
-            "cache_hit": False
+            "cache_hit": False,
+            "cache_expirado": False,
+            "consultas": [],
+            "erro": False
         }
-        
-        final_state = self.workflow.invoke(initial_state)
+        configurable = {}
+        if on_event:
+            configurable["on_event"] = on_event
+        if cache_consultado:
+            configurable["cache_consultado"] = True
+        run_config = {"configurable": configurable} if configurable else None
+        with tracer.span("agent_db", pergunta=pergunta[:200]) as span:
+            final_state = self.workflow.invoke(initial_state, config=run_config)
+            span.set(cache_hit=final_state["cache_hit"])
+        return final_state
+
+    def _invoke_coalescido(self, pergunta: str, on_event=None, cache_consultado: bool = False) -> AgentState:
+        """Executa o workflow uma única vez por pergunta em andamento"""
+        query_hash = self.cache_manager.get_query_cache(pergunta)
+        return self._voos.do(query_hash, lambda: self._invoke(pergunta, on_event, cache_consultado))
+
+    def run(self, pergunta: str) -> str:
+        final_state = self._invoke_coalescido(pergunta)
         return final_state["resposta"]
 
+    async def arun(self, pergunta: str) -> str:
+        """Executa o workflow no executor dedicado sem bloquear o event loop"""
+        async for evento in self.astream(pergunta):
+            if evento["type"] == "final":
+                return evento["content"]
+
+    async def astream(self, pergunta: str) -> AsyncIterator[dict]:
+        """
+        Executa o workflow no executor e emite os eventos conforme acontecem:
+        tokens do LLM, SQL gerado, linhas retornadas e por fim a resposta completa.
+        Chamadas simultâneas com a mesma pergunta acompanham a mesma execução.
+        """
+        consultado = False
+        if self.async_cache is not None:
+            resposta, consultado, expirada = await self._aconsulta_cache(pergunta)
+            if resposta:
+                # Cache hit sem passar pelo executor
+                yield {"type": "final", "content": resposta, "cache_hit": True, "cache_expirado": expirada}
+                return
+
+        transmissao = self._transmissao(pergunta, consultado)
+        fila = transmissao.assina()
+        try:
+            while True:
+                evento = await fila.get()
+                if evento is Broadcast.FIM:
+                    break
+                if isinstance(evento, BaseException):
+                    raise evento
+                yield evento
+        finally:
+            transmissao.cancela(fila)
+
+    async def _aconsulta_cache(self, pergunta: str):
+        """Consulta o cache pelo driver assíncrono; retorna (resposta, consultado, expirada)"""
+        query_hash = self.async_cache.get_query_cache(pergunta)
+        try:
+            with tracer.span("cache.aget") as span, metrics.CACHE_LATENCIA.time(operacao="aget"):
+                resposta, expirada = await self.async_cache.aget_com_graca(query_hash, self.graca)
+                span.set(hit=bool(resposta), expirada=expirada)
+                semantico = False
+                if not resposta:
+                    similar = self._candidato_semantico(pergunta)
+                    if similar:
+                        resposta = await self.async_cache.aget(similar)
+                        self._confirma_semantico(similar, resposta)
+                        semantico = bool(resposta)
+        except Exception as e:
+            # Falha no pool assíncrono: o workflow consulta pelo caminho síncrono
+            print(f"⚠️ Cache assíncrono indisponível: {e}")
+            return None, False, False
+        expirada = bool(resposta) and expirada
+        if expirada:
+            self._revalida(pergunta, query_hash)
+        metrics.CACHE_CONSULTAS.inc(
+            resultado="hit_semantico" if semantico else "hit_expirado" if expirada else "hit" if resposta else "miss")
+        return resposta, True, expirada
+
+    def _transmissao(self, pergunta: str, cache_consultado: bool = False) -> Broadcast:
+        """Retorna a execução em andamento para a pergunta ou inicia uma nova"""
+        query_hash = self.cache_manager.get_query_cache(pergunta)
+        transmissao = self._transmissoes.get(query_hash)
+        if transmissao is not None:
+            self._coalescidas_async += 1
+            return transmissao
+
+        loop = asyncio.get_running_loop()
+
+        def on_event(evento: dict):
+            loop.call_soon_threadsafe(transmissao.publica, evento)
+
+        def ao_esvaziar():
+            # Todos os clientes desconectaram antes de a execução começar
+            if futuro.cancel() and self._transmissoes.get(query_hash) is transmissao:
+                del self._transmissoes[query_hash]
+
+        def _finaliza(futuro):
+            if self._transmissoes.get(query_hash) is transmissao:
+                del self._transmissoes[query_hash]
+            if futuro.cancelled():
+                transmissao.publica(asyncio.CancelledError())
+            elif futuro.exception() is not None:
+                transmissao.publica(futuro.exception())
+            else:
+                final_state = futuro.result()
+                transmissao.publica({
+                    "type": "final",
+                    "content": final_state["resposta"],
+                    "cache_hit": final_state["cache_hit"],
+                    "cache_expirado": final_state.get("cache_expirado", False)
+                })
+            transmissao.encerra()
+
+        transmissao = Broadcast(ao_esvaziar=ao_esvaziar)
+        self._transmissoes[query_hash] = transmissao
+        futuro = self._submit(self._invoke_coalescido, pergunta, on_event, cache_consultado)
+        futuro.add_done_callback(lambda f: loop.call_soon_threadsafe(_finaliza, f))
+        return transmissao
+
+    def _submit(self, fn, *args, contexto: contextvars.Context = None):
+        """Agenda fn no executor dedicado contabilizando fila e execuções"""
+        with self._fila_lock:
+            self._na_fila += 1
+
+        def _executa():
+            with self._fila_lock:
+                self._na_fila -= 1
+                self._em_execucao += 1
+            try:
+                return fn(*args)
+            finally:
+                with self._fila_lock:
+                    self._em_execucao -= 1
+
+        def _cancelado(futuro):
+            # Cancelado antes de começar: ainda estava contado na fila
+            if futuro.cancelled():
+                with self._fila_lock:
+                    self._na_fila -= 1
+
+        # Propaga o request_id (contextvars) para a thread do executor
+        if contexto is None:
+            contexto = contextvars.copy_context()
+        futuro = self._executor.submit(contexto.run, _executa)
+        futuro.add_done_callback(_cancelado)
+        return futuro
+
+    def queue_stats(self) -> dict:
+        """Retorna a ocupação do executor do agente"""
+        with self._fila_lock:
+            return {
+                'max_workers': self.max_workers,
+                'em_execucao': self._em_execucao,
+                'na_fila': self._na_fila,
+                'em_andamento': len(self._transmissoes),
+                'revalidando': len(self._revalidando),
+                'coalescidas': self._voos.coalescidas + self._coalescidas_async
+            }
+
+    def close(self):
+        """Libera as threads do executor e as conexões do cache"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.varredura.close()
+        self.dependencias.close()
+        if self.semantico is not None:
+            self.semantico.salva()
+        self.cache_manager.close()
+
 
 
 
@@ -4,6 +4,15 @@ import threading
 from collections import defaultdict, deque
 from typing import Dict, Optional
 
+import metrics
+
+class RateLimitExcedido(Exception):
+    """O limite não liberou vaga dentro do tempo máximo de espera"""
+    def __init__(self, wait_time: float):
+        super().__init__(f"rate limit atingido, nova vaga em {wait_time:.1f}s")
+        self.wait_time = wait_time
+
+
 class RateLimiter:
     """
     Rate limiter para controlar requisições por segundo/minuto
@@ -19,6 +28,31 @@ class RateLimiter:
         """
         Verifica se pode prosseguir com a requisição
         """
+        limite = self._tenta()
+        if limite is not None:
+            metrics.RATE_LIMIT_REJEICOES.inc(limite=limite)
+            return False
+        return True
+
+    def aguarda(self, timeout: float):
+        """
+        Espera a vaga (até `timeout` segundos) em vez de recusar na hora;
+        levanta RateLimitExcedido se o limite não liberar a tempo
+        """
+        limite_espera = time.monotonic() + timeout
+        while True:
+            limite = self._tenta()
+            if limite is None:
+                return
+            espera = self.wait_time()
+            restante = limite_espera - time.monotonic()
+            if espera > restante:
+                metrics.RATE_LIMIT_REJEICOES.inc(limite=limite)
+                raise RateLimitExcedido(espera)
+            time.sleep(max(espera, 0.01))
+
+    def _tenta(self) -> Optional[str]:
+        """Registra a requisição se couber; senão retorna o limite atingido ('segundo' ou 'minuto')"""
         with self.lock:
             current_time = time.time()
             
@@ -32,16 +66,16 @@ class RateLimiter:
             
             # Verificar limites
             if len(self.requests_per_second) >= self.max_requests_per_second:
-                return False
+                return "segundo"
                 
             if len(self.requests_per_minute) >= self.max_requests_per_minute:
-                return False
+                return "minuto"
                 
             # Registrar a requisição
             self.requests_per_second.append(current_time)
             self.requests_per_minute.append(current_time)
             
-            return True
+            return None
     
     def wait_time(self) -> float:
         """
@@ -74,6 +108,10 @@ class SmartCache:
         self.access_count = defaultdict(int)
         self.default_ttl = default_ttl
         self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        metrics.SMART_CACHE_ITENS.set_function(lambda: len(self.cache))
+        metrics.SMART_CACHE_HIT_RATIO.set_function(self.hit_ratio)
         
     def get(self, key: str, ttl: Optional[int] = None) -> Optional[str]:
         """
@@ -81,6 +119,7 @@ class SmartCache:
         """
         with self.lock:
             if key not in self.cache:
+                self._registra_consulta(False)
                 return None
                 
             # Verificar TTL
@@ -91,12 +130,28 @@ class SmartCache:
                 del self.timestamps[key]
                 if key in self.access_count:
                     del self.access_count[key]
+                self._registra_consulta(False)
                 return None
                 
             # Incrementar contador de acesso
             self.access_count[key] += 1
+            self._registra_consulta(True)
             return self.cache[key]
     
+    def _registra_consulta(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        metrics.SMART_CACHE_CONSULTAS.inc(resultado="hit" if hit else "miss")
+    
+    def hit_ratio(self) -> float:
+        """
+        Proporção de consultas atendidas pelo cache
+        """
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+    
     def set(self, key: str, value: str, ttl: Optional[int] = None):
         """
         Armazena item no cache
@@ -155,5 +210,6 @@ class SmartCache:
             return {
                 'total_items': len(self.cache),
                 'most_accessed': max(self.access_count.items(), key=lambda x: x[1]) if self.access_count else None,
-                'cache_size_mb': sum(len(str(v)) for v in self.cache.values()) / (1024 * 1024)
+                'cache_size_mb': sum(len(str(v)) for v in self.cache.values()) / (1024 * 1024),
+                'hit_ratio': self.hit_ratio()
             }
\ No newline at end of file
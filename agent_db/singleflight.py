@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+from typing import Any, Callable, Dict, Optional
+
+
+class _Voo:
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.erro: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Coalesce chamadas concorrentes com a mesma chave (threads): a primeira
+    executa a função e as demais aguardam e recebem o mesmo resultado
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._voos: Dict[str, _Voo] = {}
+        self.coalescidas = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            voo = self._voos.get(key)
+            lider = voo is None
+            if lider:
+                voo = self._voos[key] = _Voo()
+            else:
+                self.coalescidas += 1
+
+        if not lider:
+            voo.evento.wait()
+            if voo.erro is not None:
+                raise voo.erro
+            return voo.resultado
+
+        try:
+            voo.resultado = fn()
+            return voo.resultado
+        except BaseException as e:
+            voo.erro = e
+            raise
+        finally:
+            with self._lock:
+                del self._voos[key]
+            voo.evento.set()
+
+
+class Broadcast:
+    """
+    Eventos de uma execução em andamento, repassados a todos os assinantes.
+    Quem assina depois recebe primeiro os eventos já emitidos.
+    """
+    FIM = object()
+
+    def __init__(self, ao_esvaziar: Optional[Callable[[], Any]] = None):
+        self.eventos = []
+        self.assinantes = set()
+        self.encerrado = False
+        self.ao_esvaziar = ao_esvaziar
+
+    def publica(self, evento: Any):
+        self.eventos.append(evento)
+        for fila in self.assinantes:
+            fila.put_nowait(evento)
+
+    def encerra(self):
+        self.encerrado = True
+        for fila in self.assinantes:
+            fila.put_nowait(self.FIM)
+
+    def assina(self) -> asyncio.Queue:
+        fila = asyncio.Queue()
+        for evento in self.eventos:
+            fila.put_nowait(evento)
+        if self.encerrado:
+            fila.put_nowait(self.FIM)
+        else:
+            self.assinantes.add(fila)
+        return fila
+
+    def cancela(self, fila: asyncio.Queue):
+        self.assinantes.discard(fila)
+        if not self.assinantes and not self.encerrado and self.ao_esvaziar:
+            self.ao_esvaziar()
@@ -10,12 +10,19 @@ from langchain_community.utilities import SQLDatabase
 from langchain_community.agent_toolkits import create_sql_agent
 from langchain.chat_models import init_chat_model
 from langchain.tools import tool
+from langchain_core.callbacks import BaseCallbackHandler
+from typing import List, Optional, Tuple
 import time
 import re
-from .rate_limiter import RateLimiter, SmartCache
+from .callbacks import MetricsCallbackHandler
+from .rate_limiter import RateLimiter, RateLimitExcedido, SmartCache
+from config_db import config
+import metrics
+from cassettes import modelo_cassete
 
 class AgentTools:
-    def __init__(self, db_uri: str):
+    def __init__(self, db_uri: str, llm=None, schema: Optional[str] = 'public'):
+        """llm e schema podem ser injetados (ex.: modelo falso e SQLite nos benchmarks)"""
         # Inicializar rate limiter e cache inteligente
         self.rate_limiter = RateLimiter(max_requests_per_second=1, max_requests_per_minute=20)
         self.smart_cache = SmartCache(default_ttl=600)  # 10 minutos
@@ -33,7 +40,7 @@ class AgentTools:
             self.db = SQLDatabase.from_uri(
                 db_uri,
                 sample_rows_in_table_info=3,  # Mostrar 3 linhas de exemplo
-                schema='public',
+                schema=schema,
                 # Removendo include_tables para permitir acesso a todas as tabelas disponíveis
                 custom_table_info=None,
                 view_support=False,
@@ -42,7 +49,8 @@ class AgentTools:
             print("✅ Conexão com banco estabelecida")
             
             # Inicializar o modelo LLM
-            self.llm = init_chat_model("gemini-2.5-flash", model_provider="google_genai")
+            self.llm = llm or modelo_cassete(
+                "agente_db", lambda: init_chat_model("gemini-2.5-flash", model_provider="google_genai"))
             
             # Prompt de sistema melhorado com conhecimento específico
             system_prompt = f"""Você é um especialista em SQL e análise de dados com conhecimento específico do banco de dados PostgreSQL da empresa.
@@ -166,19 +174,30 @@ class AgentTools:
             print(f'❌ Detalhes: {str(e)}')
             raise
 
-    def query_database(self, question: str) -> str:
-        """Executa uma consulta SQL no banco de dados com rate limiting e cache inteligente."""
-        
+    def query_database(self, question: str, callbacks: Optional[List[BaseCallbackHandler]] = None) -> str:
+        """Executa uma consulta SQL no banco de dados com rate limiting e cache inteligente.
+
+        Os callbacks recebem os tokens do LLM e as chamadas de ferramentas do agente
+        SQL à medida que acontecem (modo streaming).
+        """
+        return self.consulta(question, callbacks)[0]
+
+    def consulta(self, question: str, callbacks: Optional[List[BaseCallbackHandler]] = None) -> Tuple[str, bool]:
+        """
+        Como query_database, mas retorna (resposta, erro): erro indica rate limit,
+        falha na consulta ou resposta de recuperação, que não devem ir para o cache
+        """
         # Verificar cache primeiro
         cache_key = f"query_{hash(question)}"
         cached_result = self.smart_cache.get(cache_key)
         if cached_result:
-            return f"📋 **[Cache]** {cached_result}"
+            return f"📋 **[Cache]** {cached_result}", False
         
-        # Verificar rate limiting
-        if not self.rate_limiter.can_proceed():
-            wait_time = self.rate_limiter.wait_time()
-            return f"⏳ **Rate limit atingido.** Aguarde {wait_time:.1f} segundos antes de fazer nova consulta.\n\n💡 **Dica:** Use consultas mais específicas para otimizar o cache."
+        # Espera a vaga do rate limiting (até RATE_LIMIT_MAX_WAIT) em vez de recusar na hora
+        try:
+            self.rate_limiter.aguarda(config.RATE_LIMIT_MAX_WAIT)
+        except RateLimitExcedido as e:
+            return f"⏳ **Rate limit atingido.** Aguarde {e.wait_time:.1f} segundos antes de fazer nova consulta.\n\n💡 **Dica:** Use consultas mais específicas para otimizar o cache.", True
         
         try:
             # Pré-processar pergunta para evitar erros comuns
@@ -212,20 +231,24 @@ class AgentTools:
             - Para erros de data, use formatos padrão (YYYY-MM-DD)
             """
             
-            result = self.sql_agent.invoke({"input": enhanced_question})
+            medidor = MetricsCallbackHandler()
+            run_config = {"callbacks": [medidor, *(callbacks or [])]}
+            result = self.sql_agent.invoke({"input": enhanced_question}, config=run_config)
+            metrics.SQL_AGENT_ITERACOES.observe(medidor.iteracoes)
             output = result.get("output", str(result))
             
             # Verificar se houve erro e tentar recuperação
-            if self._has_critical_error(output):
+            erro = self._has_critical_error(output)
+            if erro:
                 recovery_result = self._attempt_error_recovery(question, output)
                 if recovery_result:
                     output = recovery_result
             
             # Salvar no cache apenas se não houve erro
-            if not self._has_critical_error(output):
+            if not erro:
                 self.smart_cache.set(cache_key, output)
             
-            return output
+            return output, erro
             
         except Exception as e:
             error_msg = str(e)
@@ -243,7 +266,7 @@ class AgentTools:
 - Consulte o schema das tabelas primeiro
 - Evite consultas muito complexas
 - Use LIMIT para limitar resultados
-"""
+""", True
     
     def get_table_info(self, table_name: str) -> str:
         """Retorna as informações de uma tabela específica com tratamento robusto de erros de data."""
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+import contextvars
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from config_db import config
+
+from .callbacks import SQL_QUERY_TOOL
+
+# Id da requisição atual (definido pelo servidor ou pelo próprio AgentDB)
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_span_atual: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("span_atual", default=None)
+
+
+def novo_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+class Span:
+    """Intervalo de tempo medido dentro de uma requisição"""
+    __slots__ = ("nome", "trace_id", "span_id", "parent_id", "inicio_ns", "fim_ns",
+                 "_inicio_mono", "duracao_ms", "atributos", "status", "erro", "raiz_id")
+
+    def __init__(self, nome: str, trace_id: str, parent_id: Optional[str] = None, **atributos: Any):
+        self.nome = nome
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.raiz_id = self.span_id
+        self.inicio_ns = time.time_ns()
+        self._inicio_mono = time.perf_counter()
+        self.fim_ns: Optional[int] = None
+        self.duracao_ms: Optional[float] = None
+        self.atributos: Dict[str, Any] = {k: v for k, v in atributos.items() if v is not None}
+        self.status = "ok"
+        self.erro: Optional[str] = None
+
+    def set(self, **atributos: Any):
+        self.atributos.update({k: v for k, v in atributos.items() if v is not None})
+
+    def falha(self, erro: BaseException):
+        self.status = "error"
+        self.erro = f"{type(erro).__name__}: {erro}"
+
+    def encerra(self):
+        self.duracao_ms = (time.perf_counter() - self._inicio_mono) * 1000
+        self.fim_ns = self.inicio_ns + int(self.duracao_ms * 1_000_000)
+
+    def to_dict(self) -> dict:
+        return {
+            "request_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "nome": self.nome,
+            "inicio_ns": self.inicio_ns,
+            "duracao_ms": round(self.duracao_ms or 0.0, 3),
+            "status": self.status,
+            "erro": self.erro,
+            "atributos": self.atributos
+        }
+
+    def to_otel(self) -> dict:
+        """Registro no formato do modelo de dados OTLP/JSON do OpenTelemetry"""
+        atributos = [{"key": k, "value": _valor_otel(v)} for k, v in self.atributos.items()]
+        registro = {
+            "traceId": _trace_id_otel(self.trace_id),
+            "spanId": self.span_id,
+            "name": self.nome,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.inicio_ns),
+            "endTimeUnixNano": str(self.fim_ns or self.inicio_ns),
+            "attributes": atributos,
+            "status": {"code": 2, "message": self.erro} if self.status == "error" else {"code": 1}
+        }
+        if self.parent_id:
+            registro["parentSpanId"] = self.parent_id
+        return registro
+
+
+def _trace_id_otel(request_id: str) -> str:
+    """O OTLP exige 32 dígitos hexadecimais; ids externos são convertidos por hash"""
+    if len(request_id) == 32 and all(c in "0123456789abcdef" for c in request_id):
+        return request_id
+    return hashlib.md5(request_id.encode("utf-8")).hexdigest()
+
+
+def _valor_otel(valor: Any) -> dict:
+    if isinstance(valor, bool):
+        return {"boolValue": valor}
+    if isinstance(valor, int):
+        return {"intValue": str(valor)}
+    if isinstance(valor, float):
+        return {"doubleValue": valor}
+    return {"stringValue": str(valor)}
+
+
+class JSONLExporter:
+    """Grava um span por linha; formato 'jsonl' (próprio) ou 'otel' (OTLP/JSON)"""
+    def __init__(self, path: str, formato: str = "jsonl"):
+        self.path = path
+        self.formato = formato
+        self._lock = threading.Lock()
+
+    def exporta(self, spans: List[Span]):
+        linhas = [
+            json.dumps(s.to_otel() if self.formato == "otel" else s.to_dict(), ensure_ascii=False, default=str)
+            for s in spans
+        ]
+        with self._lock, open(self.path, "a", encoding="utf-8") as arquivo:
+            arquivo.write("\n".join(linhas) + "\n")
+
+
+class Tracer:
+    """
+    Spans por requisição com propagação via contextvars. Os spans de uma
+    requisição são exportados juntos quando o span raiz termina.
+    """
+    def __init__(self, exporter: Optional[JSONLExporter] = None, max_traces: int = 100, resumo: bool = True):
+        self.exporter = exporter
+        self.resumo = resumo
+        self._abertos: Dict[str, List[Span]] = {}
+        self._recentes = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> "Tracer":
+        path = config.TRACE_EXPORT_PATH
+        exporter = JSONLExporter(path, config.TRACE_EXPORT_FORMAT) if path else None
+        return cls(exporter=exporter, resumo=config.TRACE_SUMMARY)
+
+    def inicia(self, nome: str, parent: Optional[Span] = None, **atributos: Any) -> Span:
+        """Abre um span explicitamente (para callbacks com início e fim separados)"""
+        if parent is None:
+            parent = _span_atual.get()
+        trace_id = parent.trace_id if parent else (request_id_var.get() or novo_request_id())
+        span = Span(nome, trace_id, parent.span_id if parent else None, **atributos)
+        if parent:
+            span.raiz_id = parent.raiz_id
+        with self._lock:
+            self._abertos.setdefault(span.raiz_id, []).append(span)
+        return span
+
+    def finaliza(self, span: Span, erro: Optional[BaseException] = None):
+        if erro is not None:
+            span.falha(erro)
+        span.encerra()
+        if span.parent_id is None:
+            self._exporta(span)
+
+    @contextmanager
+    def span(self, nome: str, **atributos: Any) -> Iterator[Span]:
+        span = self.inicia(nome, **atributos)
+        token = _span_atual.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.falha(e)
+            raise
+        finally:
+            _span_atual.reset(token)
+            self.finaliza(span)
+
+    @staticmethod
+    def span_atual() -> Optional[Span]:
+        return _span_atual.get()
+
+    def recentes(self, limite: int = 20) -> List[dict]:
+        """Resumo das últimas requisições rastreadas"""
+        with self._lock:
+            return list(self._recentes)[-limite:]
+
+    def _exporta(self, raiz: Span):
+        with self._lock:
+            spans = self._abertos.pop(raiz.raiz_id, [])
+            resumo = {
+                "request_id": raiz.trace_id,
+                "nome": raiz.nome,
+                "duracao_ms": round(raiz.duracao_ms, 3),
+                "status": raiz.status,
+                "spans": [s.to_dict() for s in spans]
+            }
+            self._recentes.append(resumo)
+
+        if self.exporter:
+            try:
+                self.exporter.exporta(spans)
+            except OSError as e:
+                print(f"⚠️ Erro ao exportar spans: {e}")
+
+        if self.resumo:
+            filhos = [s for s in spans if s.parent_id == raiz.span_id]
+            partes = " | ".join(f"{s.nome} {s.duracao_ms:.0f}ms" for s in filhos)
+            print(f"⏱️ [{raiz.trace_id[:8]}] {raiz.nome} {raiz.duracao_ms:.0f}ms: {partes}")
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Abre spans para as chamadas internas do agente SQL: cada chamada ao LLM
+    e cada ferramenta (com o SQL executado), aninhadas pelo run_id do LangChain
+    """
+    def __init__(self, tracer: Tracer, parent: Optional[Span]):
+        self.tracer = tracer
+        self.parent = parent
+        self._spans: Dict[UUID, Span] = {}
+
+    def _inicia(self, run_id: UUID, parent_run_id: Optional[UUID], nome: str, **atributos: Any):
+        parent = self._spans.get(parent_run_id) if parent_run_id else None
+        self._spans[run_id] = self.tracer.inicia(nome, parent=parent or self.parent, **atributos)
+
+    def _finaliza(self, run_id: UUID, erro: Optional[BaseException] = None, **atributos: Any) -> Optional[Span]:
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            span.set(**atributos)
+            self.tracer.finaliza(span, erro)
+        return span
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs: Any) -> None:
+        params = kwargs.get("invocation_params") or {}
+        modelo = params.get("model") or params.get("model_name") or (serialized or {}).get("name")
+        self._inicia(run_id, parent_run_id, "llm", modelo=modelo, mensagens=len(messages[0]) if messages else 0)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs: Any) -> None:
+        params = kwargs.get("invocation_params") or {}
+        modelo = params.get("model") or params.get("model_name") or (serialized or {}).get("name")
+        self._inicia(run_id, parent_run_id, "llm", modelo=modelo)
+
+    def on_llm_end(self, response, *, run_id, **kwargs: Any) -> None:
+        uso = (response.llm_output or {}).get("token_usage") or {}
+        if not uso:
+            for geracoes in response.generations:
+                for geracao in geracoes:
+                    uso = getattr(getattr(geracao, "message", None), "usage_metadata", None) or uso
+        self._finaliza(run_id, tokens_entrada=uso.get("input_tokens"), tokens_saida=uso.get("output_tokens"))
+
+    def on_llm_error(self, error: BaseException, *, run_id, **kwargs: Any) -> None:
+        self._finaliza(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs: Any) -> None:
+        nome = (serialized or {}).get("name") or kwargs.get("name")
+        sql = (kwargs.get("inputs") or {}).get("query", input_str) if nome == SQL_QUERY_TOOL else None
+        self._inicia(run_id, parent_run_id, f"tool.{nome}", sql=sql)
+
+    def on_tool_end(self, output: Any, *, run_id, **kwargs: Any) -> None:
+        self._finaliza(run_id, tamanho_resultado=len(str(getattr(output, "content", output))))
+
+    def on_tool_error(self, error: BaseException, *, run_id, **kwargs: Any) -> None:
+        self._finaliza(run_id, error)
+
+
+tracer = Tracer.from_config()
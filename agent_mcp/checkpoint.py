@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import random
+import zlib
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from agent_db.cache.pool import ERROS_CONEXAO, ConnectionPool
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+# Prefixo do tipo serializado quando o payload foi comprimido
+ZLIB_PREFIX = "zlib:"
+
+
+class SQLCheckpointSaver(BaseCheckpointSaver):
+    """
+    Checkpointer do LangGraph persistido em banco relacional (PostgreSQL em
+    produção, SQLite para testes locais).
+
+    - Checkpoints serializados pelo serde (msgpack) e comprimidos com zlib
+      acima de `compress_min_bytes`
+    - As escritas pendentes (put_writes) são gravadas na hora, em uma transação
+      por chamada: sobrevivem a uma falha no meio do passo e aparecem em
+      pending_writes para a retomada
+    - Apenas os `keep_last` checkpoints mais recentes de cada thread são mantidos
+    - Conexões do ConnectionPool (o mesmo do cache): conexões ociosas são
+      conferidas antes do uso e uma conexão perdida é trocada por outra
+    """
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        dialect: str = "postgresql",
+        keep_last: Optional[int] = 10,
+        compress_min_bytes: int = 1024,
+        pool: Optional[ConnectionPool] = None,
+        **kwargs: Any,
+    ):
+        super().__init__(**kwargs)
+        self.connect = connect
+        self.dialect = dialect
+        self.keep_last = keep_last
+        self.compress_min_bytes = compress_min_bytes
+        self._param = "?" if dialect == "sqlite" else "%s"
+        self.pool = pool or ConnectionPool(connect, min_size=1, max_size=1, nome="Checkpointer")
+        self._init_db()
+
+    @classmethod
+    def from_config(cls, **kwargs: Any) -> "SQLCheckpointSaver":
+        """Cria o checkpointer no PostgreSQL configurado em config_db"""
+        import psycopg2
+        from config_db import config
+
+        def connect():
+            return psycopg2.connect(
+                host=config.POSTGRES_HOST,
+                port=config.POSTGRES_PORT,
+                user=config.POSTGRES_USER,
+                password=config.POSTGRES_PASSWORD,
+                database=config.POSTGRES_DB
+            )
+        pool = ConnectionPool(
+            connect,
+            min_size=1,
+            max_size=config.CHECKPOINT_POOL_MAX,
+            timeout=config.CACHE_POOL_TIMEOUT,
+            check_idle=config.CACHE_POOL_CHECK_IDLE,
+            nome="Checkpointer"
+        )
+        return cls(connect, dialect="postgresql", pool=pool, **kwargs)
+
+    def _init_db(self):
+        binario = "BLOB" if self.dialect == "sqlite" else "bytea"
+        self._executa_script([
+            f"""
+            CREATE TABLE IF NOT EXISTS checkpoint_agente (
+                chkp_thre text NOT NULL,
+                chkp_ns text NOT NULL DEFAULT '',
+                chkp_id text NOT NULL,
+                chkp_pare text,
+                chkp_tipo text NOT NULL,
+                chkp_dado {binario} NOT NULL,
+                chkp_meta_tipo text NOT NULL,
+                chkp_meta {binario} NOT NULL,
+                chkp_crea_at timestamp DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (chkp_thre, chkp_ns, chkp_id)
+            )
+            """,
+            f"""
+            CREATE TABLE IF NOT EXISTS checkpoint_escrita (
+                escr_thre text NOT NULL,
+                escr_ns text NOT NULL DEFAULT '',
+                escr_chkp text NOT NULL,
+                escr_task text NOT NULL,
+                escr_idx integer NOT NULL,
+                escr_cana text NOT NULL,
+                escr_tipo text NOT NULL,
+                escr_dado {binario} NOT NULL,
+                escr_path text NOT NULL DEFAULT '',
+                PRIMARY KEY (escr_thre, escr_ns, escr_chkp, escr_task, escr_idx)
+            )
+            """,
+        ])
+        print("✅ Checkpointer SQL inicializado")
+
+    def _sql(self, sql: str) -> str:
+        return sql.replace("%s", self._param)
+
+    def _executa(self, operacao):
+        """
+        Roda operacao(connection) em uma transação com uma conexão do pool; se a
+        conexão cair no meio, ela é descartada e a operação é repetida uma vez em outra
+        """
+        def _transacao(connection):
+            cursor = connection.cursor()
+            try:
+                resultado = operacao(cursor)
+                connection.commit()
+                return resultado
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                cursor.close()
+
+        try:
+            with self.pool.conexao() as connection:
+                return _transacao(connection)
+        except ERROS_CONEXAO as e:
+            print(f"🔌 Checkpointer: conexão perdida ({e.__class__.__name__}), tentando novamente")
+            with self.pool.conexao() as connection:
+                return _transacao(connection)
+
+    def _executa_script(self, comandos: List[str]):
+        def _script(cursor):
+            for comando in comandos:
+                cursor.execute(comando)
+        self._executa(_script)
+
+    def _consulta(self, sql: str, params: Sequence[Any]) -> list:
+        def _select(cursor):
+            cursor.execute(self._sql(sql), params)
+            return cursor.fetchall()
+        return self._executa(_select)
+
+    # --- serialização compacta ---
+
+    def _dumps(self, valor: Any) -> Tuple[str, bytes]:
+        tipo, dado = self.serde.dumps_typed(valor)
+        if len(dado) >= self.compress_min_bytes:
+            return ZLIB_PREFIX + tipo, zlib.compress(dado)
+        return tipo, dado
+
+    def _loads(self, tipo: str, dado: Any) -> Any:
+        dado = bytes(dado)
+        if tipo.startswith(ZLIB_PREFIX):
+            tipo, dado = tipo[len(ZLIB_PREFIX):], zlib.decompress(dado)
+        return self.serde.loads_typed((tipo, dado))
+
+    # --- escrita ---
+
+    def _grava_checkpoint(self, linha: tuple):
+        """Grava o checkpoint e poda os antigos da thread em uma transação"""
+        def _grava(cursor):
+            cursor.execute(self._sql("""
+                INSERT INTO checkpoint_agente
+                    (chkp_thre, chkp_ns, chkp_id, chkp_pare, chkp_tipo, chkp_dado, chkp_meta_tipo, chkp_meta)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (chkp_thre, chkp_ns, chkp_id) DO UPDATE SET
+                    chkp_tipo = excluded.chkp_tipo,
+                    chkp_dado = excluded.chkp_dado,
+                    chkp_meta_tipo = excluded.chkp_meta_tipo,
+                    chkp_meta = excluded.chkp_meta
+            """), linha)
+            if self.keep_last:
+                self._poda(cursor, linha[0], linha[1])
+        self._executa(_grava)
+
+    def _grava_escritas(self, linhas: List[tuple]):
+        """Grava as escritas de uma tarefa em uma transação"""
+        def _grava(cursor):
+            # Canais especiais (erro, interrupção...) sobrescrevem; os demais são gravados uma vez
+            sobrescreve = [linha for linha in linhas if linha[4] < 0]
+            insere = [linha for linha in linhas if linha[4] >= 0]
+            colunas = """
+                INSERT INTO checkpoint_escrita
+                    (escr_thre, escr_ns, escr_chkp, escr_task, escr_idx, escr_cana, escr_tipo, escr_dado, escr_path)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (escr_thre, escr_ns, escr_chkp, escr_task, escr_idx)
+            """
+            if insere:
+                cursor.executemany(self._sql(colunas + " DO NOTHING"), insere)
+            if sobrescreve:
+                cursor.executemany(self._sql(colunas + """
+                    DO UPDATE SET
+                        escr_cana = excluded.escr_cana,
+                        escr_tipo = excluded.escr_tipo,
+                        escr_dado = excluded.escr_dado
+                """), sobrescreve)
+        if linhas:
+            self._executa(_grava)
+
+    def _poda(self, cursor, thread_id: str, checkpoint_ns: str):
+        """Remove checkpoints (e suas escritas) além dos keep_last mais recentes"""
+        cursor.execute(self._sql("""
+            SELECT chkp_id FROM checkpoint_agente
+            WHERE chkp_thre = %s AND chkp_ns = %s
+            ORDER BY chkp_id DESC
+            LIMIT 1 OFFSET %s
+        """), (thread_id, checkpoint_ns, self.keep_last - 1))
+        limite = cursor.fetchone()
+        if not limite:
+            return
+        params = (thread_id, checkpoint_ns, limite[0])
+        cursor.execute(self._sql(
+            "DELETE FROM checkpoint_agente WHERE chkp_thre = %s AND chkp_ns = %s AND chkp_id < %s"
+        ), params)
+        cursor.execute(self._sql(
+            "DELETE FROM checkpoint_escrita WHERE escr_thre = %s AND escr_ns = %s AND escr_chkp < %s"
+        ), params)
+
+    # --- API do BaseCheckpointSaver ---
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        tipo, dado = self._dumps(checkpoint)
+        meta_tipo, meta = self._dumps(get_checkpoint_metadata(config, metadata))
+        linha = (
+            thread_id,
+            checkpoint_ns,
+            checkpoint["id"],
+            config["configurable"].get("checkpoint_id"),
+            tipo,
+            dado,
+            meta_tipo,
+            meta,
+        )
+        self._grava_checkpoint(linha)
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        linhas = []
+        for idx, (canal, valor) in enumerate(writes):
+            tipo, dado = self._dumps(valor)
+            linhas.append((
+                thread_id,
+                checkpoint_ns,
+                checkpoint_id,
+                task_id,
+                WRITES_IDX_MAP.get(canal, idx),
+                canal,
+                tipo,
+                dado,
+                task_path,
+            ))
+        self._grava_escritas(linhas)
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        sql = """
+            SELECT chkp_thre, chkp_ns, chkp_id, chkp_pare, chkp_tipo, chkp_dado, chkp_meta_tipo, chkp_meta
+            FROM checkpoint_agente
+            WHERE chkp_thre = %s AND chkp_ns = %s
+        """
+        params = [thread_id, checkpoint_ns]
+        if checkpoint_id:
+            sql += " AND chkp_id = %s"
+            params.append(checkpoint_id)
+        sql += " ORDER BY chkp_id DESC LIMIT 1"
+        linhas = self._consulta(sql, params)
+        return self._monta_tupla(linhas[0]) if linhas else None
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        sql = """
+            SELECT chkp_thre, chkp_ns, chkp_id, chkp_pare, chkp_tipo, chkp_dado, chkp_meta_tipo, chkp_meta
+            FROM checkpoint_agente WHERE 1 = 1
+        """
+        params = []
+        if config is not None:
+            sql += " AND chkp_thre = %s"
+            params.append(config["configurable"]["thread_id"])
+            checkpoint_ns = config["configurable"].get("checkpoint_ns")
+            if checkpoint_ns is not None:
+                sql += " AND chkp_ns = %s"
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                sql += " AND chkp_id = %s"
+                params.append(checkpoint_id)
+        if before is not None and (before_id := get_checkpoint_id(before)):
+            sql += " AND chkp_id < %s"
+            params.append(before_id)
+        sql += " ORDER BY chkp_id DESC"
+        # Com filtro de metadata o limite só pode ser aplicado após decodificar
+        if limit is not None and not filter:
+            sql += f" LIMIT {int(limit)}"
+
+        restantes = limit
+        for linha in self._consulta(sql, params):
+            metadata = self._loads(linha[6], linha[7])
+            if filter and not all(metadata.get(k) == v for k, v in filter.items()):
+                continue
+            if restantes is not None:
+                if restantes <= 0:
+                    break
+                restantes -= 1
+            yield self._monta_tupla(linha, metadata)
+
+    def _monta_tupla(self, linha: tuple, metadata: Optional[dict] = None) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id, parent_id, tipo, dado, meta_tipo, meta = linha
+        escritas = self._consulta("""
+            SELECT escr_task, escr_cana, escr_tipo, escr_dado
+            FROM checkpoint_escrita
+            WHERE escr_thre = %s AND escr_ns = %s AND escr_chkp = %s
+            ORDER BY escr_task, escr_idx
+        """, (thread_id, checkpoint_ns, checkpoint_id))
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint=self._loads(tipo, dado),
+            metadata=metadata if metadata is not None else self._loads(meta_tipo, meta),
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_id,
+                    }
+                }
+                if parent_id
+                else None
+            ),
+            pending_writes=[
+                (task_id, canal, self._loads(escr_tipo, escr_dado))
+                for task_id, canal, escr_tipo, escr_dado in escritas
+            ],
+        )
+
+    def delete_thread(self, thread_id: str) -> None:
+        def _apaga(cursor):
+            cursor.execute(self._sql("DELETE FROM checkpoint_agente WHERE chkp_thre = %s"), (thread_id,))
+            cursor.execute(self._sql("DELETE FROM checkpoint_escrita WHERE escr_thre = %s"), (thread_id,))
+        self._executa(_apaga)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    # --- variantes assíncronas: o driver é bloqueante, então roda em thread ---
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        tuplas = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for tupla in tuplas:
+            yield tupla
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def close(self):
+        self.pool.close()
+
+
+def create_checkpointer() -> BaseCheckpointSaver:
+    """Cria o checkpointer configurado em CHECKPOINTER ('memory' ou 'postgres')"""
+    from config_db import config
+    from .memory import BoundedMemorySaver
+
+    if config.CHECKPOINTER == "postgres":
+        return SQLCheckpointSaver.from_config(keep_last=config.CHECKPOINT_KEEP_LAST)
+    return BoundedMemorySaver(
+        max_threads=config.SESSION_MAX_THREADS,
+        ttl_seconds=config.SESSION_TTL_SECONDS
+    )
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    RemoveMessage,
+    ToolMessage,
+)
+from langchain_core.messages.utils import count_tokens_approximately, trim_messages
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langgraph.constants import TAG_NOSTREAM
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+
+RESUMO_PREFIXO = "[Resumo da conversa anterior]"
+
+PROMPT_RESUMO = (
+    "Resuma a conversa abaixo em português, em no máximo {max_palavras} palavras. "
+    "Preserve fatos, números, fontes citadas e decisões já tomadas; "
+    "descarte resultados brutos de ferramentas.\n\n{conversa}"
+)
+
+
+class HistoryPolicy:
+    """
+    Política de histórico aplicada antes de cada chamada ao modelo (pre_model_hook).
+
+    1. Se o histórico cabe no orçamento de tokens, nada muda.
+    2. Resultados antigos de ferramentas (Exa, context7...) são compactados primeiro,
+       do mais antigo para o mais recente.
+    3. Se ainda exceder, as mensagens mais antigas são descartadas — ou, com
+       resumo habilitado, substituídas por um resumo acumulado no estado.
+    """
+    # O resumo não deve vazar para o stream de tokens da resposta
+    _config_resumo = {"tags": [TAG_NOSTREAM], "run_name": "resumo_historico"}
+
+    def __init__(
+        self,
+        max_tokens: int = 12000,
+        tool_output_tokens: int = 200,
+        summary_model: Optional[BaseChatModel] = None,
+        summary_max_words: int = 300,
+        token_counter: Callable[[Iterable[BaseMessage]], int] = count_tokens_approximately,
+        max_relatorios: int = 1000,
+    ):
+        self.max_tokens = max_tokens
+        self.tool_output_tokens = tool_output_tokens
+        self.summary_model = summary_model
+        self.summary_max_words = summary_max_words
+        self.token_counter = token_counter
+        self.max_relatorios = max_relatorios
+        self._relatorios = OrderedDict()  # thread_id -> relatório da última chamada
+        self._lock = threading.Lock()
+
+    def as_hook(self) -> RunnableLambda:
+        """Runnable para o parâmetro pre_model_hook do create_react_agent"""
+        return RunnableLambda(self.compact, afunc=self.acompact, name="historico")
+
+    def compact(self, state: dict, config: RunnableConfig) -> dict:
+        mensagens, antigas, relatorio = self._compacta(state["messages"])
+        resumo = None
+        if antigas and self.summary_model is not None:
+            resposta = self.summary_model.invoke(self._prompt_resumo(antigas), config=self._config_resumo)
+            resumo = self._mensagem_resumo(resposta)
+        return self._resultado(mensagens, resumo, relatorio, config)
+
+    async def acompact(self, state: dict, config: RunnableConfig) -> dict:
+        mensagens, antigas, relatorio = self._compacta(state["messages"])
+        resumo = None
+        if antigas and self.summary_model is not None:
+            resposta = await self.summary_model.ainvoke(self._prompt_resumo(antigas), config=self._config_resumo)
+            resumo = self._mensagem_resumo(resposta)
+        return self._resultado(mensagens, resumo, relatorio, config)
+
+    def last_report(self, thread_id: str) -> Optional[dict]:
+        """Relatório da última chamada ao modelo na thread"""
+        with self._lock:
+            return self._relatorios.get(thread_id)
+
+    def _compacta(self, mensagens: List[BaseMessage]):
+        """Retorna (mensagens para o LLM, mensagens descartadas, relatório)"""
+        tokens = [self.token_counter([m]) for m in mensagens]
+        total_antes = sum(tokens)
+        relatorio = {
+            'tokens_antes': total_antes,
+            'ferramentas_compactadas': 0,
+            'mensagens_descartadas': 0,
+            'resumo': False
+        }
+        if total_antes <= self.max_tokens:
+            relatorio['tokens_depois'] = total_antes
+            relatorio['tokens_economizados'] = 0
+            return mensagens, [], relatorio
+
+        # Fase 1: compactar resultados de ferramentas já vistos pelo modelo
+        resultado = list(mensagens)
+        total = total_antes
+        for i in self._indices_ferramentas_antigas(resultado):
+            if total <= self.max_tokens:
+                break
+            compacta = self._compacta_ferramenta(resultado[i])
+            if compacta is None:
+                continue
+            novo = self.token_counter([compacta])
+            total -= tokens[i] - novo
+            tokens[i] = novo
+            resultado[i] = compacta
+            relatorio['ferramentas_compactadas'] += 1
+
+        # Fase 2: descartar as mensagens mais antigas (sempre iniciando em mensagem humana)
+        antigas = []
+        if total > self.max_tokens:
+            mantidas = trim_messages(
+                resultado,
+                max_tokens=self.max_tokens,
+                token_counter=self.token_counter,
+                strategy="last",
+                start_on="human",
+                allow_partial=False,
+            )
+            if not mantidas:
+                # O turno atual sozinho excede o orçamento: nunca descartá-lo
+                mantidas = resultado[self._indice_ultima_humana(resultado):]
+            antigas = resultado[:len(resultado) - len(mantidas)]
+            resultado = mantidas
+            total = self.token_counter(resultado)
+            relatorio['mensagens_descartadas'] = len(antigas)
+
+        relatorio['tokens_depois'] = total
+        relatorio['tokens_economizados'] = total_antes - total
+        return resultado, antigas, relatorio
+
+    def _indices_ferramentas_antigas(self, mensagens: List[BaseMessage]) -> List[int]:
+        # Resultados após a última resposta do modelo ainda não foram lidos por ele
+        ultima_ai = max((i for i, m in enumerate(mensagens) if isinstance(m, AIMessage)), default=-1)
+        return [i for i, m in enumerate(mensagens[:ultima_ai]) if isinstance(m, ToolMessage)]
+
+    def _compacta_ferramenta(self, mensagem: ToolMessage) -> Optional[ToolMessage]:
+        conteudo = mensagem.content if isinstance(mensagem.content, str) else str(mensagem.content)
+        limite = self.tool_output_tokens * 4  # ~4 caracteres por token
+        if len(conteudo) <= limite:
+            return None
+        resumido = f"{conteudo[:limite]}\n[... resultado de {mensagem.name or 'ferramenta'} compactado: {len(conteudo)} caracteres]"
+        return mensagem.model_copy(update={"content": resumido})
+
+    @staticmethod
+    def _indice_ultima_humana(mensagens: List[BaseMessage]) -> int:
+        return max((i for i, m in enumerate(mensagens) if isinstance(m, HumanMessage)), default=0)
+
+    def _prompt_resumo(self, antigas: List[BaseMessage]) -> str:
+        linhas = []
+        for m in antigas:
+            if isinstance(m, ToolMessage):
+                continue
+            texto = m.text() if hasattr(m, "text") else str(m.content)
+            if texto.strip():
+                linhas.append(f"{m.type}: {texto}")
+        return PROMPT_RESUMO.format(max_palavras=self.summary_max_words, conversa="\n".join(linhas))
+
+    @staticmethod
+    def _mensagem_resumo(resposta: Any) -> HumanMessage:
+        texto = resposta.text() if hasattr(resposta, "text") else str(resposta)
+        return HumanMessage(content=f"{RESUMO_PREFIXO}\n{texto}")
+
+    def _resultado(self, mensagens, resumo, relatorio, config) -> dict:
+        atualizacao = {"llm_input_messages": mensagens}
+        if resumo is not None:
+            # Resumo acumulado substitui o histórico antigo no próprio estado
+            mensagens = [resumo, *mensagens]
+            relatorio['resumo'] = True
+            relatorio['tokens_depois'] = self.token_counter(mensagens)
+            relatorio['tokens_economizados'] = relatorio['tokens_antes'] - relatorio['tokens_depois']
+            atualizacao = {
+                "messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES), *mensagens],
+                "llm_input_messages": mensagens
+            }
+
+        thread_id = (config.get("configurable") or {}).get("thread_id")
+        if thread_id is not None:
+            with self._lock:
+                self._relatorios[thread_id] = relatorio
+                self._relatorios.move_to_end(thread_id)
+                while len(self._relatorios) > self.max_relatorios:
+                    self._relatorios.popitem(last=False)
+        if relatorio['tokens_economizados']:
+            print(f"✂️ Histórico: {relatorio['tokens_antes']} → {relatorio['tokens_depois']} tokens "
+                  f"({relatorio['tokens_economizados']} economizados)")
+        return atualizacao
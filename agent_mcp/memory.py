@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.memory import MemorySaver
+
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    MemorySaver com limite de threads (sessões) e expiração por inatividade.
+    Threads ociosas são removidas em ordem LRU.
+    """
+    def __init__(self, max_threads: int = 200, ttl_seconds: int = 3600, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.max_threads = max_threads
+        self.ttl_seconds = ttl_seconds
+        self._acessos = OrderedDict()  # thread_id -> último acesso
+        self._lock = threading.Lock()
+
+    def _toca(self, config: Optional[RunnableConfig]):
+        """Registra o acesso à thread do config e remove as threads excedentes"""
+        thread_id = ((config or {}).get("configurable") or {}).get("thread_id")
+        if thread_id is None:
+            return
+
+        agora = time.monotonic()
+        with self._lock:
+            self._acessos[thread_id] = agora
+            self._acessos.move_to_end(thread_id)
+            removidas = self._seleciona_expiradas(agora)
+
+        for antiga in removidas:
+            super().delete_thread(antiga)
+        if removidas:
+            print(f"🧹 Memória: {len(removidas)} sessões ociosas removidas")
+
+    def _seleciona_expiradas(self, agora: float) -> list:
+        removidas = []
+        # Mais antigas primeiro: expiradas por TTL ou acima do limite
+        while self._acessos:
+            thread_id, ultimo_acesso = next(iter(self._acessos.items()))
+            expirada = agora - ultimo_acesso > self.ttl_seconds
+            if not expirada and len(self._acessos) <= self.max_threads:
+                break
+            self._acessos.popitem(last=False)
+            removidas.append(thread_id)
+        return removidas
+
+    def get_tuple(self, config: RunnableConfig):
+        self._toca(config)
+        return super().get_tuple(config)
+
+    def put(self, config: RunnableConfig, checkpoint, metadata, new_versions) -> RunnableConfig:
+        self._toca(config)
+        return super().put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple], task_id: str, task_path: str = "") -> None:
+        self._toca(config)
+        return super().put_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._acessos.pop(thread_id, None)
+        super().delete_thread(thread_id)
+
+    def stats(self) -> dict:
+        """Retorna a ocupação da memória de sessões"""
+        with self._lock:
+            return {
+                'threads': len(self._acessos),
+                'max_threads': self.max_threads,
+                'ttl_seconds': self.ttl_seconds
+            }
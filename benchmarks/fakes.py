@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import re
+import time
+import unicodedata
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Palavra-chave da pergunta -> SQL executado pelo agente falso
+CONSULTAS = [
+    (("estoque", "saldo"), "SELECT p.prod_nome, s.sapr_sald FROM saldosprodutos s "
+                           "JOIN produtos p ON p.prod_codi = s.sapr_prod ORDER BY s.sapr_sald DESC LIMIT 10"),
+    (("pagar",), "SELECT COUNT(*) AS titulos, SUM(titu_valo) AS total FROM titulospagar"),
+    (("receber",), "SELECT COUNT(*) AS titulos, SUM(titu_valo) AS total FROM titulosreceber"),
+    (("cliente", "fornecedor", "entidade"), "SELECT enti_tipo_enti, COUNT(*) FROM entidades "
+                                            "GROUP BY enti_tipo_enti ORDER BY 2 DESC LIMIT 10"),
+    (("produto",), "SELECT COUNT(*) AS total FROM produtos"),
+]
+CONSULTA_PADRAO = "SELECT COUNT(*) AS total FROM produtos"
+
+
+def _sem_acento(texto: str) -> str:
+    return unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode().lower()
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Modelo determinístico para benchmarks: na primeira chamada pede a execução
+    de um SQL escolhido pela pergunta; na segunda responde com o resultado,
+    emitindo a resposta token a token. A latência simula o provedor real.
+    """
+    latency: float = 0.05
+    token_latency: float = 0.0
+    nome_modelo: str = "fake-gemini"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model": self.nome_modelo}
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "FakeChatModel":
+        return self
+
+    def _decide(self, messages: List[BaseMessage]) -> AIMessage:
+        resultados = [m for m in messages if isinstance(m, ToolMessage)]
+        if not resultados:
+            pergunta = _sem_acento(str(messages[-1].content))
+            sql = next((q for chaves, q in CONSULTAS if any(c in pergunta for c in chaves)), CONSULTA_PADRAO)
+            return AIMessage(content="", tool_calls=[{
+                "name": "sql_db_query",
+                "args": {"query": sql},
+                "id": f"call_{len(messages)}"
+            }])
+        return AIMessage(content=(
+            f"Consultei o banco e o resultado foi **{resultados[-1].content}**. "
+            "Os números indicam a situação atual do cadastro. "
+            "Sugestões: quais produtos estão sem estoque? Qual o total a receber no mês?"
+        ))
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._decide(messages))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        mensagem = self._decide(messages)
+        if mensagem.tool_calls:
+            chamada = mensagem.tool_calls[0]
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[{
+                "name": chamada["name"],
+                "args": json.dumps(chamada["args"]),
+                "id": chamada["id"],
+                "index": 0
+            }]))
+            return
+        for token in re.findall(r"\S+\s*", mensagem.content):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            yield chunk
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._decide(messages))])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        mensagem = self._decide(messages)
+        if mensagem.tool_calls:
+            chamada = mensagem.tool_calls[0]
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[{
+                "name": chamada["name"],
+                "args": json.dumps(chamada["args"]),
+                "id": chamada["id"],
+                "index": 0
+            }]))
+            return
+        for token in re.findall(r"\S+\s*", mensagem.content):
+            if self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            yield chunk
+
+
+class FakeResearchModel(FakeChatModel):
+    """
+    Modelo falso para o agente MCP (create_react_agent): chama a primeira
+    ferramenta disponível com a pergunta e depois responde com o resultado
+    """
+    ferramenta: Optional[str] = None
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "FakeResearchModel":
+        nomes = [getattr(t, "name", None) or (t.get("name") if isinstance(t, dict) else None) for t in tools]
+        return self.model_copy(update={"ferramenta": next((n for n in nomes if n), None)})
+
+    def _decide(self, messages: List[BaseMessage]) -> AIMessage:
+        ultima = messages[-1]
+        if self.ferramenta and ultima.type == "human":
+            return AIMessage(content="", tool_calls=[{
+                "name": self.ferramenta,
+                "args": {"query": str(ultima.content)},
+                "id": f"call_{len(messages)}"
+            }])
+        return AIMessage(content=(
+            f"Pesquisei o tema e encontrei: {str(ultima.content)[:200]}. "
+            "Em resumo, as fontes concordam nos pontos principais. Fontes: exemplo.com"
+        ))
+
+
+def cria_ferramenta_mcp(latencia: float = 0.1, tamanho: int = 2000):
+    """Ferramenta assíncrona no lugar das ferramentas MCP (busca Exa, context7...)"""
+    from langchain_core.tools import StructuredTool
+
+    async def web_search_exa(query: str) -> str:
+        await asyncio.sleep(latencia)
+        return (f"Resultado para '{query}': " + "conteúdo da página " * tamanho)[:tamanho]
+
+    def web_search_exa_sync(query: str) -> str:
+        time.sleep(latencia)
+        return (f"Resultado para '{query}': " + "conteúdo da página " * tamanho)[:tamanho]
+
+    return StructuredTool.from_function(
+        func=web_search_exa_sync,
+        coroutine=web_search_exa,
+        name="web_search_exa",
+        description="Busca na web (falsa, para benchmarks)"
+    )
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+import atexit
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+from typing import Optional, Tuple
+
+# Sem o adaptador padrão (obsoleto no 3.12) para gravar datetime no SQLite
+sqlite3.register_adapter(datetime, lambda valor: valor.isoformat(" "))
+sqlite3.register_adapter(date, lambda valor: valor.isoformat())
+
+TABELAS_ERP = """
+CREATE TABLE entidades (
+    enti_clie INTEGER PRIMARY KEY,
+    enti_nome VARCHAR(100),
+    enti_tipo_enti VARCHAR(2),
+    enti_ende VARCHAR(200),
+    enti_esta VARCHAR(2),
+    enti_tele VARCHAR(20),
+    enti_celu VARCHAR(20)
+);
+CREATE TABLE produtos (
+    prod_codi INTEGER PRIMARY KEY,
+    prod_nome VARCHAR(200)
+);
+CREATE TABLE saldosprodutos (
+    sapr_prod INTEGER,
+    sapr_sald DECIMAL(15,2)
+);
+CREATE TABLE titulospagar (
+    titu_id INTEGER PRIMARY KEY,
+    titu_forn INTEGER,
+    titu_valo DECIMAL(15,2),
+    titu_venc DATE
+);
+CREATE TABLE titulosreceber (
+    titu_id INTEGER PRIMARY KEY,
+    titu_clie INTEGER,
+    titu_valo DECIMAL(15,2),
+    titu_venc DATE
+);
+"""
+
+TABELA_CACHE = """
+CREATE TABLE cache_agente (
+    cach_hash VARCHAR(64) PRIMARY KEY,
+    cach_text TEXT,
+    cach_resp TEXT,
+    cach_expi_at TIMESTAMP,
+    cach_crea_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    cach_upda_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+# Nomes de banco que indicam um banco de testes (os fixtures apagam e recriam tabelas)
+BANCO_DESCARTAVEL = re.compile(r"bench|test|scratch|tmp", re.IGNORECASE)
+
+_pasta: Optional[tempfile.TemporaryDirectory] = None
+_pasta_lock = threading.Lock()
+
+TIPOS_ENTIDADE = ["CL", "CL", "CL", "FO", "FO", "VE", "TR", "OU", "AM"]
+ESTADOS = ["PR", "SP", "SC", "RS", "MG", "RJ"]
+
+
+def _linhas(n_entidades: int, n_produtos: int, n_titulos: int, seed: int):
+    aleatorio = random.Random(seed)
+    hoje = date.today()
+    entidades = [
+        (i, f"Entidade {i}", aleatorio.choice(TIPOS_ENTIDADE), f"Rua {i}, {aleatorio.randint(1, 999)}",
+         aleatorio.choice(ESTADOS), f"(44) 3{i:07d}"[:14], f"(44) 9{i:08d}"[:15])
+        for i in range(1, n_entidades + 1)
+    ]
+    produtos = [(i, f"Produto {i}") for i in range(1, n_produtos + 1)]
+    saldos = [(i, round(aleatorio.uniform(-5, 500), 2)) for i in range(1, n_produtos + 1)]
+
+    def titulos():
+        return [
+            (i, aleatorio.randint(1, n_entidades), round(aleatorio.uniform(10, 5000), 2),
+             hoje + timedelta(days=aleatorio.randint(-60, 120)))
+            for i in range(1, n_titulos + 1)
+        ]
+
+    return entidades, produtos, saldos, titulos(), titulos()
+
+
+def pasta_temporaria() -> str:
+    """Pasta dos bancos SQLite temporários deste processo, removida na saída"""
+    global _pasta
+    with _pasta_lock:
+        if _pasta is None:
+            _pasta = tempfile.TemporaryDirectory(prefix="bench_")
+            atexit.register(limpa_temporarios)
+        return _pasta.name
+
+
+def limpa_temporarios():
+    """Remove os bancos SQLite temporários (os runners chamam ao terminar; também roda no atexit)"""
+    global _pasta
+    with _pasta_lock:
+        pasta, _pasta = _pasta, None
+    if pasta is not None:
+        pasta.cleanup()
+
+
+def cria_erp_sqlite(path: Optional[str] = None, n_entidades: int = 500, n_produtos: int = 2000,
+                    n_titulos: int = 3000, seed: int = 42) -> str:
+    """Cria o banco SQLite com as tabelas do ERP e retorna a URI do SQLAlchemy"""
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix="erp_", dir=pasta_temporaria()), "erp.db")
+    if os.path.exists(path):
+        os.remove(path)
+
+    entidades, produtos, saldos, pagar, receber = _linhas(n_entidades, n_produtos, n_titulos, seed)
+    conexao = sqlite3.connect(path)
+    conexao.executescript(TABELAS_ERP)
+    conexao.executemany("INSERT INTO entidades VALUES (?, ?, ?, ?, ?, ?, ?)", entidades)
+    conexao.executemany("INSERT INTO produtos VALUES (?, ?)", produtos)
+    conexao.executemany("INSERT INTO saldosprodutos VALUES (?, ?)", saldos)
+    conexao.executemany("INSERT INTO titulospagar VALUES (?, ?, ?, ?)", pagar)
+    conexao.executemany("INSERT INTO titulosreceber VALUES (?, ?, ?, ?)", receber)
+    conexao.commit()
+    conexao.close()
+    return f"sqlite:///{path}"
+
+
+class BancoNaoDescartavel(RuntimeError):
+    """O banco apontado não parece ser de testes: os fixtures não apagam as tabelas dele"""
+
+
+def confere_banco_descartavel(connection, confirmado: bool = False) -> str:
+    """
+    Recusa bancos que não têm bench/test/scratch/tmp no nome, ou que são o
+    POSTGRES_DB da aplicação, a menos que `confirmado` (--banco-descartavel)
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT current_database()")
+        nome = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+    if confirmado:
+        return nome
+    from config_db import config
+
+    if nome == config.POSTGRES_DB or not BANCO_DESCARTAVEL.search(nome):
+        raise BancoNaoDescartavel(
+            f"O benchmark apaga e recria as tabelas do ERP e do cache, e '{nome}' não parece um banco "
+            f"de testes. Use um banco com bench/test no nome ou passe --banco-descartavel."
+        )
+    return nome
+
+
+def cria_erp_postgres(connection, n_entidades: int = 500, n_produtos: int = 2000,
+                      n_titulos: int = 3000, seed: int = 42, descartavel: bool = False):
+    """
+    Recria as tabelas do ERP e a cache_agente em um Postgres local (psycopg2),
+    só em banco de testes (ver confere_banco_descartavel)
+    """
+    confere_banco_descartavel(connection, descartavel)
+    entidades, produtos, saldos, pagar, receber = _linhas(n_entidades, n_produtos, n_titulos, seed)
+    cursor = connection.cursor()
+    # As migrações gerenciadas precisam ser reaplicadas na cache_agente recriada
+    cursor.execute("DROP TABLE IF EXISTS cache_esquema, cache_estatistica, cache_expiracao_hora, "
+                   "cache_dependencia, cache_tabela_versao, cache_volatilidade")
+    cursor.execute("DROP TABLE IF EXISTS entidades, produtos, saldosprodutos, titulospagar, "
+                   "titulosreceber, cache_agente")
+    cursor.execute(TABELAS_ERP)
+    cursor.execute(TABELA_CACHE)
+    cursor.executemany("INSERT INTO entidades VALUES (%s, %s, %s, %s, %s, %s, %s)", entidades)
+    cursor.executemany("INSERT INTO produtos VALUES (%s, %s)", produtos)
+    cursor.executemany("INSERT INTO saldosprodutos VALUES (%s, %s)", saldos)
+    cursor.executemany("INSERT INTO titulospagar VALUES (%s, %s, %s, %s)", pagar)
+    cursor.executemany("INSERT INTO titulosreceber VALUES (%s, %s, %s, %s)", receber)
+    connection.commit()
+    cursor.close()
+
+
+class _CompatCursor:
+    """Traduz o SQL do CacheManager (dialeto PostgreSQL) para o SQLite"""
+    _TRADUCOES = [
+        (re.compile(r"%s"), "?"),
+        (re.compile(r"NOW\(\)\s*-\s*\?\s*\*\s*INTERVAL\s*'1 second'", re.IGNORECASE),
+         "datetime('now', 'localtime', '-' || ? || ' seconds')"),
+        (re.compile(r"NOW\(\)", re.IGNORECASE), "datetime('now', 'localtime')"),
+        (re.compile(r"\bCONCURRENTLY\s+", re.IGNORECASE), ""),
+        (re.compile(r"\bADD COLUMN IF NOT EXISTS\b", re.IGNORECASE), "ADD COLUMN"),
+        (re.compile(r"\bFOR UPDATE\b", re.IGNORECASE), ""),
+    ]
+    _INFORMATION_SCHEMA = re.compile(
+        r"SELECT\s+EXISTS\s*\(\s*SELECT\s+FROM\s+information_schema\.tables\s+WHERE\s+table_name\s*=\s*'(\w+)'\s*\)",
+        re.IGNORECASE | re.DOTALL
+    )
+
+    def __init__(self, cursor: sqlite3.Cursor, lock: threading.Lock):
+        self._cursor = cursor
+        self._lock = lock
+
+    @classmethod
+    def traduz(cls, sql: str) -> str:
+        sql = cls._INFORMATION_SCHEMA.sub(
+            r"SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = '\1')", sql)
+        for padrao, substituto in cls._TRADUCOES:
+            sql = padrao.sub(substituto, sql)
+        return sql
+
+    def execute(self, sql: str, params: Tuple = ()):
+        with self._lock:
+            self._cursor.execute(self.traduz(sql), params)
+        return self
+
+    def executemany(self, sql: str, params):
+        with self._lock:
+            self._cursor.executemany(self.traduz(sql), params)
+        return self
+
+    def __getattr__(self, nome):
+        return getattr(self._cursor, nome)
+
+
+# cach_expi_at volta como datetime, como no psycopg2
+sqlite3.register_converter("TIMESTAMP", lambda valor: datetime.fromisoformat(valor.decode()))
+
+
+class SQLiteCompatConnection:
+    """
+    Conexão SQLite com a interface usada pelo CacheManager (cursor/commit/close),
+    para medir o caminho do cache sem um PostgreSQL. Como no psycopg2, os
+    comandos na mesma conexão são serializados.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(path, check_same_thread=False, isolation_level=None,
+                                        detect_types=sqlite3.PARSE_DECLTYPES)
+        # NOTIFY de invalidação do L1 não tem para quem ir em um processo só
+        self._conexao.create_function("pg_notify", 2, lambda canal, payload: None)
+        # Um processo só: os locks consultivos da migração de chaves sempre são obtidos
+        self._conexao.create_function("pg_try_advisory_xact_lock", 1, lambda chave: 1)
+        self._conexao.create_function("pg_try_advisory_lock", 1, lambda chave: 1)
+        self._conexao.create_function("pg_advisory_unlock", 1, lambda chave: 1)
+        # octet_length só existe a partir do SQLite 3.43
+        self._conexao.create_function(
+            "octet_length", 1,
+            lambda valor: len(valor.encode()) if isinstance(valor, str) else None if valor is None else len(valor))
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.execute("PRAGMA busy_timeout=5000")
+
+    def cursor(self) -> _CompatCursor:
+        return _CompatCursor(self._conexao.cursor(), self._lock)
+
+    def commit(self):
+        pass  # autocommit
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self._conexao.close()
+
+
+def cria_cache_sqlite(path: Optional[str] = None) -> SQLiteCompatConnection:
+    """Cria a tabela cache_agente em um SQLite e retorna a conexão compatível"""
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix="cache_", dir=pasta_temporaria()), "cache.db")
+    if os.path.exists(path):
+        os.remove(path)
+    conexao = sqlite3.connect(path)
+    conexao.executescript(TABELA_CACHE)
+    conexao.close()
+    return SQLiteCompatConnection(path)
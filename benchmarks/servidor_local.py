@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import socket
+import threading
+import time
+from typing import List, Optional
+
+from benchmarks.fakes import FakeResearchModel, cria_ferramenta_mcp
+
+
+async def prepara_servidor(agente_db=None, latencia_llm: float = 0.05, latencia_token: float = 0.0,
+                           latencia_ferramenta: float = 0.1):
+    """
+    Injeta os agentes locais no módulo servidor no lugar da inicialização real
+    (Gemini + Smithery + ERP), registrando a prontidão como no lifespan
+    """
+    import servidor
+    from agent_mcp.checkpoint import create_checkpointer
+    from agent_mcp.history import HistoryPolicy
+    from config_db import config
+    from langgraph.prebuilt import create_react_agent
+    from prompts import AGENT_SYSTEM_PROMPT
+
+    async def _agente_mcp():
+        modelo = FakeResearchModel(latency=latencia_llm, token_latency=latencia_token)
+        servidor.memoria = create_checkpointer()
+        servidor.historico = HistoryPolicy(
+            max_tokens=config.HISTORY_MAX_TOKENS,
+            tool_output_tokens=config.HISTORY_TOOL_OUTPUT_TOKENS
+        )
+        servidor.agent_executor = create_react_agent(
+            model=modelo,
+            tools=[cria_ferramenta_mcp(latencia_ferramenta)],
+            prompt=AGENT_SYSTEM_PROMPT,
+            checkpointer=servidor.memoria,
+            pre_model_hook=servidor.historico.as_hook(),
+        )
+
+    async def _agente_db():
+        servidor.agent_db = agente_db
+
+    await servidor.prontidao.inicializa("agente_mcp", _agente_mcp)
+    if agente_db is not None:
+        await servidor.prontidao.inicializa("agente_db", _agente_db)
+    return servidor
+
+
+class ServidorLocal:
+    """
+    Sobe o app FastAPI em um uvicorn real (thread própria, porta livre) para
+    medir TTFB e intervalos do SSE pela rede, e mede o atraso do event loop
+    do servidor enquanto a carga roda
+    """
+    def __init__(self, app, intervalo_lag: float = 0.01):
+        import uvicorn
+
+        self.porta = self._porta_livre()
+        self.url = f"http://127.0.0.1:{self.porta}"
+        self.intervalo_lag = intervalo_lag
+        self.lags: List[float] = []
+        self._server = uvicorn.Server(uvicorn.Config(
+            app, host="127.0.0.1", port=self.porta, lifespan="off", log_level="warning"
+        ))
+        self._loop = asyncio.new_event_loop()
+        self._thread: Optional[threading.Thread] = None
+        self._monitor = None
+
+    @staticmethod
+    def _porta_livre() -> int:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            return s.getsockname()[1]
+
+    def _roda(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._server.serve())
+
+    async def _mede_lag(self):
+        while True:
+            inicio = time.perf_counter()
+            await asyncio.sleep(self.intervalo_lag)
+            self.lags.append(max(0.0, time.perf_counter() - inicio - self.intervalo_lag))
+
+    def coleta_lags(self) -> List[float]:
+        """Retorna e zera os atrasos medidos desde a última coleta"""
+        lags, self.lags = self.lags, []
+        return lags
+
+    def __enter__(self) -> "ServidorLocal":
+        self._thread = threading.Thread(target=self._roda, name="servidor_local", daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            if not self._thread.is_alive():
+                raise RuntimeError("Servidor local não iniciou")
+            time.sleep(0.05)
+        self._monitor = asyncio.run_coroutine_threadsafe(self._mede_lag(), self._loop)
+        return self
+
+    def __exit__(self, *exc):
+        if self._monitor:
+            self._loop.call_soon_threadsafe(self._monitor.cancel)
+        self._server.should_exit = True
+        self._thread.join(timeout=10)
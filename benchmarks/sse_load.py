@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Gerador de carga SSE para /pergunta e /pergunta_db: abre muitas conexões
+simultâneas, interpreta os dois formatos de evento e mede, por nível de
+concorrência, o tempo até o primeiro byte (TTFB), o intervalo entre eventos,
+o tempo total do stream e as falhas.
+
+    # contra um servidor já rodando
+    python -m benchmarks.sse_load --url http://localhost:8000 --endpoint /pergunta_db --niveis 1,8,32
+
+    # servidor local (uvicorn em thread) com modelo falso, ferramenta MCP falsa e SQLite
+    python -m benchmarks.sse_load --local --endpoint ambos --niveis 1,4,16,64 --json sse.json
+
+No modo --local também é medido o atraso do event loop do servidor durante a carga.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.run import PERGUNTAS, percentil
+
+PERGUNTAS_PESQUISA = [
+    "Quais as novidades do Python 3.13?",
+    "Como funciona o streaming no FastAPI?",
+    "Resuma as melhores práticas de cache em APIs",
+]
+
+
+class ResultadoStream:
+    def __init__(self):
+        self.ttfb: Optional[float] = None
+        self.primeiro_token: Optional[float] = None
+        self.total: Optional[float] = None
+        self.intervalos: List[float] = []
+        self.eventos = 0
+        self.bytes = 0
+        self.falha: Optional[str] = None
+
+
+def interpreta_evento(payload: str):
+    """
+    Retorna (tipo, fim, erro) para o conteúdo de uma linha 'data:'. Aceita os
+    eventos JSON ({type, is_complete}), o marcador [DONE] e texto puro.
+    """
+    if payload.strip() == "[DONE]":
+        return "done", True, False
+    try:
+        evento = json.loads(payload)
+    except ValueError:
+        return "texto", False, False
+    if not isinstance(evento, dict):
+        return "texto", False, False
+    tipo = evento.get("type", "texto")
+    return tipo, evento.get("is_complete") is True, tipo == "error"
+
+
+async def consome_stream(cliente, endpoint: str, pergunta: str) -> ResultadoStream:
+    resultado = ResultadoStream()
+    inicio = time.perf_counter()
+    ultimo = None
+    fim = False
+    # Sessão própria por stream para o histórico do agente MCP não crescer entre requisições
+    headers = {"X-Session-Id": uuid.uuid4().hex}
+    try:
+        async with cliente.stream("POST", endpoint, json={"pergunta": pergunta}, headers=headers) as resposta:
+            if resposta.status_code != 200:
+                resultado.falha = f"http_{resposta.status_code}"
+                return resultado
+            async for linha in resposta.aiter_lines():
+                agora = time.perf_counter()
+                resultado.bytes += len(linha.encode("utf-8")) + 1
+                if resultado.ttfb is None:
+                    resultado.ttfb = agora - inicio
+                if not linha.startswith("data:"):
+                    continue
+                tipo, fim_evento, erro = interpreta_evento(linha[5:].strip())
+                resultado.eventos += 1
+                if ultimo is not None:
+                    resultado.intervalos.append(agora - ultimo)
+                ultimo = agora
+                if tipo in ("token", "texto") and resultado.primeiro_token is None:
+                    resultado.primeiro_token = agora - inicio
+                if erro:
+                    resultado.falha = "evento_erro"
+                fim = fim or fim_evento
+    except Exception as e:
+        resultado.falha = type(e).__name__
+        return resultado
+
+    resultado.total = time.perf_counter() - inicio
+    if resultado.falha is None and not fim:
+        resultado.falha = "incompleto"
+    return resultado
+
+
+def _ms(valores: List[float], p: float) -> float:
+    return round(percentil(sorted(valores), p) * 1000, 2)
+
+
+def resume_nivel(endpoint: str, nivel: int, resultados: List[ResultadoStream], duracao: float,
+                 lags: Optional[List[float]] = None) -> dict:
+    ok = [r for r in resultados if r.falha is None]
+    ttfb = [r.ttfb for r in ok]
+    primeiro_token = [r.primeiro_token for r in ok if r.primeiro_token is not None]
+    totais = [r.total for r in ok]
+    intervalos = [i for r in ok for i in r.intervalos]
+    resumo = {
+        "endpoint": endpoint,
+        "concorrencia": nivel,
+        "streams": len(resultados),
+        "falhas": len(resultados) - len(ok),
+        "falhas_por_tipo": dict(Counter(r.falha for r in resultados if r.falha)),
+        "ttfb_p50_ms": _ms(ttfb, 50),
+        "ttfb_p95_ms": _ms(ttfb, 95),
+        "ttfb_p99_ms": _ms(ttfb, 99),
+        "primeiro_token_p50_ms": _ms(primeiro_token, 50),
+        "intervalo_p50_ms": _ms(intervalos, 50),
+        "intervalo_p99_ms": _ms(intervalos, 99),
+        "intervalo_max_ms": round(max(intervalos) * 1000, 2) if intervalos else 0.0,
+        "total_p50_ms": _ms(totais, 50),
+        "total_p95_ms": _ms(totais, 95),
+        "eventos_por_stream": round(sum(r.eventos for r in ok) / len(ok), 1) if ok else 0.0,
+        "streams_por_s": round(len(ok) / duracao, 2) if duracao else 0.0,
+    }
+    if lags is not None:
+        resumo["lag_loop_p99_ms"] = _ms(lags, 99)
+        resumo["lag_loop_max_ms"] = round(max(lags) * 1000, 2) if lags else 0.0
+    return resumo
+
+
+async def executa_nivel(url: str, endpoint: str, nivel: int, rodadas: int, cache_hit: bool,
+                        timeout: float) -> tuple:
+    import httpx
+
+    perguntas = PERGUNTAS if endpoint == "/pergunta_db" else PERGUNTAS_PESQUISA
+    limites = httpx.Limits(max_connections=nivel, max_keepalive_connections=nivel)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limites) as cliente:
+        async def trabalhador(w: int) -> List[ResultadoStream]:
+            resultados = []
+            for r in range(rodadas):
+                pergunta = perguntas[(w + r) % len(perguntas)]
+                if not cache_hit:
+                    pergunta = f"{pergunta} ({uuid.uuid4().hex[:8]})"
+                resultados.append(await consome_stream(cliente, endpoint, pergunta))
+            return resultados
+
+        inicio = time.perf_counter()
+        por_trabalhador = await asyncio.gather(*(trabalhador(w) for w in range(nivel)))
+        duracao = time.perf_counter() - inicio
+    return [r for lista in por_trabalhador for r in lista], duracao
+
+
+COLUNAS = ["endpoint", "concorrencia", "streams", "falhas", "ttfb_p50_ms", "ttfb_p99_ms",
+           "intervalo_p50_ms", "intervalo_p99_ms", "total_p50_ms", "total_p95_ms", "streams_por_s"]
+
+
+def imprime(resumos: List[Dict]):
+    colunas = COLUNAS + (["lag_loop_p99_ms", "lag_loop_max_ms"] if "lag_loop_p99_ms" in resumos[0] else [])
+    larguras = {c: max(len(c), *(len(str(r[c])) for r in resumos)) for c in colunas}
+    print(" | ".join(c.ljust(larguras[c]) for c in colunas))
+    print("-+-".join("-" * larguras[c] for c in colunas))
+    for r in resumos:
+        print(" | ".join(str(r[c]).ljust(larguras[c]) for c in colunas))
+    for r in resumos:
+        if r["falhas_por_tipo"]:
+            print(f"⚠️ {r['endpoint']} c={r['concorrencia']}: {r['falhas_por_tipo']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Carga SSE em /pergunta e /pergunta_db")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--local", action="store_true",
+                        help="Sobe o servidor localmente com modelo falso e banco SQLite")
+    parser.add_argument("--endpoint", default="/pergunta_db", choices=["/pergunta", "/pergunta_db", "ambos"])
+    parser.add_argument("--niveis", default="1,4,16", help="Níveis de concorrência separados por vírgula")
+    parser.add_argument("--rodadas", type=int, default=3, help="Streams sequenciais por conexão em cada nível")
+    parser.add_argument("--cache-hit", action="store_true", help="Repete as perguntas (padrão: perguntas inéditas)")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--latencia-llm", type=float, default=0.05)
+    parser.add_argument("--latencia-token", type=float, default=0.005)
+    parser.add_argument("--latencia-ferramenta", type=float, default=0.1)
+    parser.add_argument("--postgres", default=os.getenv("BENCH_POSTGRES_URL"))
+    parser.add_argument("--banco-descartavel", action="store_true",
+                        help="Confirma que o --postgres é descartável mesmo sem bench/test no nome do banco")
+    parser.add_argument("--json", help="Grava os resultados neste arquivo")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    endpoints = ["/pergunta", "/pergunta_db"] if args.endpoint == "ambos" else [args.endpoint]
+    niveis = [int(n) for n in args.niveis.split(",") if n.strip()]
+
+    servidor_local = None
+    if args.local:
+        from agent_db.tracing import tracer
+        from benchmarks.run import cria_agente
+        from benchmarks.servidor_local import ServidorLocal, prepara_servidor
+
+        tracer.resumo = False
+        silencio = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with silencio:
+            agente = cria_agente(args)
+            servidor = asyncio.run(prepara_servidor(
+                agente, args.latencia_llm, args.latencia_token, args.latencia_ferramenta))
+        servidor_local = ServidorLocal(servidor.app).__enter__()
+        args.url = servidor_local.url
+
+    resumos = []
+    try:
+        for endpoint in endpoints:
+            for nivel in niveis:
+                print(f"▶️ {endpoint}: concorrência {nivel}, {nivel * args.rodadas} streams", flush=True)
+                silencio = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+                with silencio:
+                    if servidor_local:
+                        servidor_local.coleta_lags()
+                    resultados, duracao = asyncio.run(executa_nivel(
+                        args.url, endpoint, nivel, args.rodadas, args.cache_hit, args.timeout))
+                    lags = servidor_local.coleta_lags() if servidor_local else None
+                resumos.append(resume_nivel(endpoint, nivel, resultados, duracao, lags))
+    finally:
+        if servidor_local:
+            servidor_local.__exit__(None, None, None)
+            agente.close()
+            from benchmarks.fixtures import limpa_temporarios
+
+            limpa_temporarios()
+
+    print()
+    imprime(resumos)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as arquivo:
+            json.dump({
+                "parametros": {k: v for k, v in vars(args).items() if k not in ("json", "postgres", "banco_descartavel")},
+                "resultados": resumos
+            }, arquivo, ensure_ascii=False, indent=2)
+        print(f"\n💾 Resultados salvos em {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.tools import BaseTool, StructuredTool
+from pydantic import ConfigDict
+
+from config_db import config
+
+OFF = "off"
+RECORD = "record"
+REPLAY = "replay"
+
+
+class CassetteMiss(KeyError):
+    """Chamada sem gravação correspondente no cassete (modo replay)"""
+
+
+def _hash(dado: Any) -> str:
+    texto = json.dumps(dado, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()[:32]
+
+
+def _conteudo(mensagem: BaseMessage) -> Any:
+    return mensagem.content if isinstance(mensagem.content, str) else json.loads(json.dumps(mensagem.content, default=str))
+
+
+def _canonica(mensagem: BaseMessage, com_resultados: bool = True) -> dict:
+    """Mensagem sem ids e metadados voláteis, para compor a chave da chamada"""
+    canonica = {"t": mensagem.type, "c": _conteudo(mensagem)}
+    if isinstance(mensagem, AIMessage) and mensagem.tool_calls:
+        canonica["tc"] = [[c["name"], c["args"]] for c in mensagem.tool_calls]
+    if isinstance(mensagem, ToolMessage):
+        canonica["n"] = mensagem.name
+        if not com_resultados:
+            # Chave tolerante: resultados de ferramentas/SQL podem variar entre bancos
+            canonica["c"] = None
+    return canonica
+
+
+class Cassette:
+    """
+    Gravações de chamadas externas (LLM e ferramentas MCP) em JSONL compactado
+    com gzip. Cada linha guarda a chave da chamada, a resposta e a latência
+    medida; no replay, chamadas com a mesma chave são servidas na ordem gravada.
+    """
+    def __init__(self, path: str, modo: str, reproduz_latencia: bool = False):
+        self.path = path
+        self.modo = modo
+        self.reproduz_latencia = reproduz_latencia
+        self._lock = threading.Lock()
+        self._gravacoes: Dict[str, List[dict]] = defaultdict(list)
+        self._posicoes: Dict[str, int] = defaultdict(int)
+        self._ferramentas: List[dict] = []
+        self._arquivo = None
+        self.stats = {"gravadas": 0, "reproduzidas": 0, "faltantes": 0}
+
+        if modo == REPLAY:
+            self._carrega()
+        elif modo == RECORD:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._arquivo = gzip.open(path, "wt", encoding="utf-8")
+
+    def _carrega(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"Cassete não encontrado: {self.path} (grave com CASSETTE_MODE=record)")
+        with gzip.open(self.path, "rt", encoding="utf-8") as arquivo:
+            for linha in arquivo:
+                registro = json.loads(linha)
+                if registro["t"] == "ferramentas":
+                    self._ferramentas = registro["r"]
+                    continue
+                for chave in registro["k"]:
+                    self._gravacoes[chave].append(registro)
+        total = sum(1 for _ in self._registros_unicos())
+        print(f"📼 Cassete {self.path}: {total} chamadas gravadas")
+
+    def _registros_unicos(self):
+        vistos = set()
+        for registros in self._gravacoes.values():
+            for registro in registros:
+                if id(registro) not in vistos:
+                    vistos.add(id(registro))
+                    yield registro
+
+    def grava(self, tipo: str, chaves: List[str], resposta: Any, latencia: Dict[str, float]):
+        registro = {"t": tipo, "k": chaves, "r": resposta, "l": {k: round(v, 4) for k, v in latencia.items()}}
+        linha = json.dumps(registro, ensure_ascii=False, separators=(",", ":"), default=str)
+        with self._lock:
+            self._arquivo.write(linha + "\n")
+            self.stats["gravadas"] += 1
+
+    def grava_ferramentas(self, especificacoes: List[dict]):
+        linha = json.dumps({"t": "ferramentas", "k": [], "r": especificacoes}, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._arquivo.write(linha + "\n")
+
+    def ferramentas(self) -> List[dict]:
+        return self._ferramentas
+
+    def reproduz(self, chaves: List[str]) -> dict:
+        """Próxima gravação para a primeira chave encontrada (a última se repete)"""
+        with self._lock:
+            for chave in chaves:
+                registros = self._gravacoes.get(chave)
+                if registros:
+                    posicao = self._posicoes[chave]
+                    self._posicoes[chave] = posicao + 1
+                    self.stats["reproduzidas"] += 1
+                    return registros[min(posicao, len(registros) - 1)]
+            self.stats["faltantes"] += 1
+        raise CassetteMiss(f"Chamada não gravada no cassete {self.path} (chave {chaves[0]})")
+
+    def espera(self, segundos: float) -> float:
+        return segundos if self.reproduz_latencia else 0.0
+
+    def close(self):
+        with self._lock:
+            if self._arquivo is not None:
+                self._arquivo.close()
+                self._arquivo = None
+                print(f"📼 Cassete {self.path}: {self.stats['gravadas']} chamadas gravadas")
+
+
+_cassetes: Dict[str, Cassette] = {}
+_cassetes_lock = threading.Lock()
+
+
+def abre_cassete(nome: str) -> Optional[Cassette]:
+    """Cassete do componente conforme CASSETTE_MODE (None quando desligado)"""
+    if config.CASSETTE_MODE not in (RECORD, REPLAY):
+        return None
+    with _cassetes_lock:
+        if nome not in _cassetes:
+            path = os.path.join(config.CASSETTE_PATH, f"{nome}.jsonl.gz")
+            _cassetes[nome] = Cassette(path, config.CASSETTE_MODE, config.CASSETTE_REPLAY_LATENCY)
+        return _cassetes[nome]
+
+
+def fecha_cassetes():
+    with _cassetes_lock:
+        for cassete in _cassetes.values():
+            cassete.close()
+
+
+atexit.register(fecha_cassetes)
+
+# O modelo real roda sem os callbacks herdados: tokens e métricas saem só do envelope
+_SEM_CALLBACKS = {"callbacks": []}
+
+
+class CassetteChatModel(BaseChatModel):
+    """
+    Envolve o modelo de chat: em record repassa as chamadas ao modelo real e
+    grava request/response; em replay responde a partir do cassete, sem rede
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    cassete: Any
+    inner: Any = None
+    ferramentas: List[str] = []
+    tool_kwargs: Dict[str, Any] = {}
+    nome_modelo: str = "cassete"
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model": self.nome_modelo}
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "CassetteChatModel":
+        nomes = sorted(getattr(t, "name", None) or (t.get("name") if isinstance(t, dict) else str(t)) for t in tools)
+        atualizacao = {"ferramentas": nomes, "tool_kwargs": kwargs}
+        if self.inner is not None:
+            atualizacao["inner"] = self.inner.bind_tools(tools, **kwargs)
+        return self.model_copy(update=atualizacao)
+
+    def _chaves(self, messages: List[BaseMessage]) -> List[str]:
+        exata = _hash({"m": [_canonica(m) for m in messages], "f": self.ferramentas})
+        tolerante = _hash({"m": [_canonica(m, com_resultados=False) for m in messages], "f": self.ferramentas})
+        return [exata, tolerante]
+
+    def _grava(self, messages: List[BaseMessage], mensagem: BaseMessage, pedacos: Optional[List[str]],
+               inicio: float, primeiro: Optional[float]):
+        total = time.perf_counter() - inicio
+        latencia = {"total": total}
+        if primeiro is not None:
+            latencia["primeiro"] = primeiro - inicio
+        resposta = {"m": message_to_dict(AIMessage(
+            content=mensagem.content,
+            tool_calls=getattr(mensagem, "tool_calls", []),
+            usage_metadata=getattr(mensagem, "usage_metadata", None),
+            response_metadata=getattr(mensagem, "response_metadata", {}),
+        ))}
+        if pedacos:
+            resposta["p"] = pedacos
+        self.cassete.grava("llm", self._chaves(messages), resposta, latencia)
+
+    @staticmethod
+    def _mensagem(registro: dict) -> AIMessage:
+        return messages_from_dict([registro["r"]["m"]])[0]
+
+    @staticmethod
+    def _pedacos(registro: dict, mensagem: AIMessage) -> List[str]:
+        if "p" in registro["r"]:
+            return registro["r"]["p"]
+        texto = mensagem.content if isinstance(mensagem.content, str) else ""
+        return re.findall(r"\S+\s*", texto)
+
+    @staticmethod
+    def _chunk_ferramentas(mensagem: AIMessage) -> Optional[ChatGenerationChunk]:
+        if not mensagem.tool_calls:
+            return None
+        return ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+            {"name": c["name"], "args": json.dumps(c["args"], ensure_ascii=False), "id": c["id"], "index": i}
+            for i, c in enumerate(mensagem.tool_calls)
+        ]))
+
+    def _tempos(self, registro: dict, n_pedacos: int):
+        """(espera antes do primeiro pedaço, espera entre pedaços)"""
+        latencia = registro.get("l") or {}
+        total = self.cassete.espera(latencia.get("total", 0.0))
+        primeiro = self.cassete.espera(latencia.get("primeiro", total))
+        return primeiro, (max(0.0, total - primeiro) / n_pedacos if n_pedacos else 0.0)
+
+    # Síncrono (agente SQL)
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.cassete.modo == RECORD:
+            inicio = time.perf_counter()
+            mensagem = self.inner.invoke(messages, _SEM_CALLBACKS, stop=stop, **kwargs)
+            self._grava(messages, mensagem, None, inicio, None)
+            return ChatResult(generations=[ChatGeneration(message=mensagem)])
+
+        registro = self.cassete.reproduz(self._chaves(messages))
+        time.sleep(self._tempos(registro, 0)[0])
+        return ChatResult(generations=[ChatGeneration(message=self._mensagem(registro))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        if self.cassete.modo == RECORD:
+            inicio, primeiro = time.perf_counter(), None
+            acumulado, pedacos = None, []
+            for chunk in self.inner.stream(messages, _SEM_CALLBACKS, stop=stop, **kwargs):
+                primeiro = primeiro or time.perf_counter()
+                acumulado = chunk if acumulado is None else acumulado + chunk
+                texto = chunk.text()
+                if texto:
+                    pedacos.append(texto)
+                yield ChatGenerationChunk(message=chunk)
+            if acumulado is not None:
+                self._grava(messages, acumulado, pedacos, inicio, primeiro)
+            return
+
+        registro = self.cassete.reproduz(self._chaves(messages))
+        mensagem = self._mensagem(registro)
+        pedacos = self._pedacos(registro, mensagem)
+        espera_inicial, espera_pedaco = self._tempos(registro, len(pedacos))
+        time.sleep(espera_inicial)
+        chunk_ferramentas = self._chunk_ferramentas(mensagem)
+        if chunk_ferramentas:
+            yield chunk_ferramentas
+        for texto in pedacos:
+            if espera_pedaco:
+                time.sleep(espera_pedaco)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=texto))
+            yield chunk
+
+    # Assíncrono (agente MCP)
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.cassete.modo == RECORD:
+            inicio = time.perf_counter()
+            mensagem = await self.inner.ainvoke(messages, _SEM_CALLBACKS, stop=stop, **kwargs)
+            self._grava(messages, mensagem, None, inicio, None)
+            return ChatResult(generations=[ChatGeneration(message=mensagem)])
+
+        registro = self.cassete.reproduz(self._chaves(messages))
+        await asyncio.sleep(self._tempos(registro, 0)[0])
+        return ChatResult(generations=[ChatGeneration(message=self._mensagem(registro))])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        if self.cassete.modo == RECORD:
+            inicio, primeiro = time.perf_counter(), None
+            acumulado, pedacos = None, []
+            async for chunk in self.inner.astream(messages, _SEM_CALLBACKS, stop=stop, **kwargs):
+                primeiro = primeiro or time.perf_counter()
+                acumulado = chunk if acumulado is None else acumulado + chunk
+                texto = chunk.text()
+                if texto:
+                    pedacos.append(texto)
+                yield ChatGenerationChunk(message=chunk)
+            if acumulado is not None:
+                self._grava(messages, acumulado, pedacos, inicio, primeiro)
+            return
+
+        registro = self.cassete.reproduz(self._chaves(messages))
+        mensagem = self._mensagem(registro)
+        pedacos = self._pedacos(registro, mensagem)
+        espera_inicial, espera_pedaco = self._tempos(registro, len(pedacos))
+        await asyncio.sleep(espera_inicial)
+        chunk_ferramentas = self._chunk_ferramentas(mensagem)
+        if chunk_ferramentas:
+            yield chunk_ferramentas
+        for texto in pedacos:
+            if espera_pedaco:
+                await asyncio.sleep(espera_pedaco)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=texto))
+            yield chunk
+
+
+def modelo_cassete(nome: str, fabrica: Callable[[], BaseChatModel], nome_modelo: str = "gemini-2.5-flash") -> BaseChatModel:
+    """
+    Modelo do componente conforme CASSETTE_MODE: o modelo real (off), o real
+    com gravação (record) ou somente o cassete, sem criar o modelo real (replay)
+    """
+    cassete = abre_cassete(nome)
+    if cassete is None:
+        return fabrica()
+    inner = fabrica() if cassete.modo == RECORD else None
+    print(f"📼 {nome}: modelo em modo {cassete.modo}")
+    return CassetteChatModel(cassete=cassete, inner=inner, nome_modelo=nome_modelo)
+
+
+def _esquema(ferramenta: BaseTool) -> dict:
+    esquema = ferramenta.args_schema
+    if esquema is None:
+        return {"type": "object", "properties": {}}
+    return esquema if isinstance(esquema, dict) else esquema.model_json_schema()
+
+
+def _serializavel(valor: Any) -> Any:
+    if hasattr(valor, "model_dump"):
+        return valor.model_dump(mode="json")
+    if isinstance(valor, (list, tuple)):
+        return [_serializavel(v) for v in valor]
+    return valor
+
+
+def ferramenta_cassete(cassete: Cassette, especificacao: dict, inner: Optional[BaseTool] = None) -> BaseTool:
+    """Ferramenta com o mesmo nome e schema da original, gravando ou reproduzindo os resultados"""
+    nome = especificacao["name"]
+
+    def _chaves(argumentos: dict) -> List[str]:
+        return [_hash({"ferramenta": nome, "args": argumentos})]
+
+    async def _chama(**argumentos: Any):
+        if cassete.modo == RECORD:
+            inicio = time.perf_counter()
+            if inner.response_format == "content_and_artifact" and getattr(inner, "coroutine", None):
+                conteudo, artefato = await inner.coroutine(**argumentos)
+            else:
+                conteudo, artefato = await inner.ainvoke(argumentos), None
+            cassete.grava("ferramenta", _chaves(argumentos),
+                          {"c": _serializavel(conteudo), "a": _serializavel(artefato)},
+                          {"total": time.perf_counter() - inicio})
+            return conteudo, artefato
+
+        registro = cassete.reproduz(_chaves(argumentos))
+        await asyncio.sleep(cassete.espera(registro.get("l", {}).get("total", 0.0)))
+        return registro["r"]["c"], None
+
+    return StructuredTool(
+        name=nome,
+        description=especificacao.get("description", ""),
+        args_schema=especificacao.get("args_schema"),
+        coroutine=_chama,
+        response_format="content_and_artifact",
+        metadata=especificacao.get("metadata"),
+    )
+
+
+async def ferramentas_cassete(nome: str, obtem: Callable[[], Awaitable[List[BaseTool]]]) -> List[BaseTool]:
+    """
+    Ferramentas MCP do componente conforme CASSETTE_MODE. Em replay, a lista
+    (nomes, descrições e schemas) também vem do cassete: nenhuma conexão é aberta.
+    """
+    cassete = abre_cassete(nome)
+    if cassete is None:
+        return await obtem()
+    if cassete.modo == REPLAY:
+        return [ferramenta_cassete(cassete, e) for e in cassete.ferramentas()]
+
+    ferramentas = await obtem()
+    especificacoes = [
+        {"name": f.name, "description": f.description, "args_schema": _esquema(f), "metadata": f.metadata}
+        for f in ferramentas
+    ]
+    cassete.grava_ferramentas(especificacoes)
+    return [ferramenta_cassete(cassete, e, f) for e, f in zip(especificacoes, ferramentas)]
@@ -15,6 +15,96 @@ class config:
     POSTGRES_DB = os.getenv('POSTGRES_DB')
     
     CACHE_TTL_DAYS = int(os.getenv('CACHE_TTL_DAYS', '7'))
+
+    # cache: TTL adaptativo; a classe de volatilidade das tabelas/colunas do SQL define o TTL base (CACHE_TTL_DAYS é a padrão), ajustado pela taxa de mudança da resposta nos refreshes ('false' usa só CACHE_TTL_DAYS)
+    CACHE_TTL_ADAPTIVE = os.getenv('CACHE_TTL_ADAPTIVE', 'true').lower() in ('1', 'true', 'sim')
+    CACHE_TTL_VOLATILE_HOURS = float(os.getenv('CACHE_TTL_VOLATILE_HOURS', '1'))
+    CACHE_TTL_STABLE_DAYS = float(os.getenv('CACHE_TTL_STABLE_DAYS', '30'))
+    CACHE_TTL_MIN_SECONDS = float(os.getenv('CACHE_TTL_MIN_SECONDS', '300'))
+    CACHE_TTL_MAX_DAYS = float(os.getenv('CACHE_TTL_MAX_DAYS', '90'))
+
+    # cache: pool de conexões do CacheManager (checkout por chamada, SELECT 1 em conexões ociosas)
+    CACHE_POOL_MIN = int(os.getenv('CACHE_POOL_MIN', '1'))
+    CACHE_POOL_MAX = int(os.getenv('CACHE_POOL_MAX', '10'))
+    CACHE_POOL_TIMEOUT = float(os.getenv('CACHE_POOL_TIMEOUT', '10'))
+    CACHE_POOL_CHECK_IDLE = float(os.getenv('CACHE_POOL_CHECK_IDLE', '30'))
+
+    # cache: L1 em memória na frente da cache_agente (0 entradas desliga); invalidação entre workers por LISTEN/NOTIFY ('notify' ou 'off')
+    CACHE_L1_MAX_ENTRIES = int(os.getenv('CACHE_L1_MAX_ENTRIES', '1000'))
+    CACHE_L1_MAX_BYTES = int(os.getenv('CACHE_L1_MAX_BYTES', str(32 * 1024 * 1024)))
+    CACHE_L1_MAX_AGE = float(os.getenv('CACHE_L1_MAX_AGE', '300'))
+    CACHE_L1_INVALIDATION = os.getenv('CACHE_L1_INVALIDATION', 'notify').lower()
+
+    # cache: normalização da pergunta antes do hash; sinônimos 'padrao' ou caminho de um JSON; migração das chaves 'auto' ou 'off'
+    CACHE_KEY_STOPWORDS = os.getenv('CACHE_KEY_STOPWORDS', 'false').lower() in ('1', 'true', 'sim')
+    CACHE_KEY_SYNONYMS = os.getenv('CACHE_KEY_SYNONYMS', '')
+    CACHE_KEY_MIGRATE = os.getenv('CACHE_KEY_MIGRATE', 'auto').lower()
+
+    # cache: varredura de expirados em segundo plano (0 desliga), em lotes com pausa entre eles
+    CACHE_SWEEP_INTERVAL = float(os.getenv('CACHE_SWEEP_INTERVAL', '300'))
+    CACHE_SWEEP_BATCH = int(os.getenv('CACHE_SWEEP_BATCH', '500'))
+    CACHE_SWEEP_PAUSE = float(os.getenv('CACHE_SWEEP_PAUSE', '0.1'))
+
+    # cache: stale-while-revalidate; até CACHE_STALE_GRACE segundos após expirar a resposta ainda é servida (marcada como expirada) enquanto é refeita em segundo plano (0 desliga)
+    CACHE_STALE_GRACE = float(os.getenv('CACHE_STALE_GRACE', '0'))
+
+    # cache: intervalo (s) da verificação de alterações nas tabelas lidas pelas respostas (pg_stat_user_tables); 0 desliga
+    CACHE_DEPENDENCY_INTERVAL = float(os.getenv('CACHE_DEPENDENCY_INTERVAL', '30'))
+
+    # cache: intervalo (s) para somar hits/misses/sets e o histograma de expiração nas tabelas de estatística
+    CACHE_STATS_FLUSH = float(os.getenv('CACHE_STATS_FLUSH', '10'))
+
+    # cache: compressão das respostas longas em cach_resp_comp ('off', 'zlib' ou 'zstd' se o pacote zstandard estiver instalado)
+    CACHE_COMPRESSION = os.getenv('CACHE_COMPRESSION', 'off').lower()
+    CACHE_COMPRESSION_LEVEL = int(os.getenv('CACHE_COMPRESSION_LEVEL')) if os.getenv('CACHE_COMPRESSION_LEVEL') else None
+    CACHE_COMPRESSION_MIN_BYTES = int(os.getenv('CACHE_COMPRESSION_MIN_BYTES', '512'))
+
+    # cache: camada semântica para paráfrases ('hashing' local ou um modelo sentence-transformers); memmap opcional em CACHE_SEMANTIC_PATH
+    CACHE_SEMANTIC = os.getenv('CACHE_SEMANTIC', 'false').lower() in ('1', 'true', 'sim')
+    CACHE_SEMANTIC_MODEL = os.getenv('CACHE_SEMANTIC_MODEL', 'hashing')
+    CACHE_SEMANTIC_DIM = int(os.getenv('CACHE_SEMANTIC_DIM', '1024'))
+    CACHE_SEMANTIC_THRESHOLD = float(os.getenv('CACHE_SEMANTIC_THRESHOLD', '0.9'))
+    CACHE_SEMANTIC_PATH = os.getenv('CACHE_SEMANTIC_PATH')
+
+    # servidor: inicializar os agentes em segundo plano após abrir a porta (/readyz indica quando estão prontos)
+    LAZY_STARTUP = os.getenv('LAZY_STARTUP', 'false').lower() in ('1', 'true', 'sim')
+
+    # agente de banco: threads dedicadas para rodar o workflow fora do event loop
+    AGENT_DB_MAX_WORKERS = int(os.getenv('AGENT_DB_MAX_WORKERS', '4'))
+
+    # agente de banco: espera máxima (s) pela vaga do rate limiter do LLM antes de desistir (a resposta de erro não vai para o cache)
+    RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', '15'))
+
+    # agente de banco: spans por nó/LLM/SQL exportados em JSONL ('jsonl') ou OTLP/JSON ('otel')
+    TRACE_EXPORT_PATH = os.getenv('TRACE_EXPORT_PATH')
+    TRACE_EXPORT_FORMAT = os.getenv('TRACE_EXPORT_FORMAT', 'jsonl').lower()
+    TRACE_SUMMARY = os.getenv('TRACE_SUMMARY', 'true').lower() in ('1', 'true', 'sim')
+
+    # cassetes de LLM e ferramentas MCP: 'off', 'record' (grava) ou 'replay' (reproduz sem rede)
+    CASSETTE_MODE = os.getenv('CASSETTE_MODE', 'off').lower()
+    CASSETTE_PATH = os.getenv('CASSETTE_PATH', 'cassettes')
+    CASSETTE_REPLAY_LATENCY = os.getenv('CASSETTE_REPLAY_LATENCY', 'false').lower() in ('1', 'true', 'sim')
+
+    # agente MCP: memória por sessão (threads do checkpointer)
+    SESSION_MAX_THREADS = int(os.getenv('SESSION_MAX_THREADS', '200'))
+    SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', '3600'))
+
+    # checkpointer do agente MCP: 'memory' (por processo) ou 'postgres' (durável, com pool de conexões)
+    CHECKPOINTER = os.getenv('CHECKPOINTER', 'memory').lower()
+    CHECKPOINT_KEEP_LAST = int(os.getenv('CHECKPOINT_KEEP_LAST', '10'))
+    CHECKPOINT_POOL_MAX = int(os.getenv('CHECKPOINT_POOL_MAX', '4'))
+
+    # controle de admissão por endpoint (excedentes recebem HTTP 429)
+    ADMISSION_PERGUNTA_MAX_CONCURRENT = int(os.getenv('ADMISSION_PERGUNTA_MAX_CONCURRENT', '4'))
+    ADMISSION_PERGUNTA_MAX_QUEUE = int(os.getenv('ADMISSION_PERGUNTA_MAX_QUEUE', '16'))
+    ADMISSION_PERGUNTA_DB_MAX_CONCURRENT = int(os.getenv('ADMISSION_PERGUNTA_DB_MAX_CONCURRENT', '8'))
+    ADMISSION_PERGUNTA_DB_MAX_QUEUE = int(os.getenv('ADMISSION_PERGUNTA_DB_MAX_QUEUE', '32'))
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '15'))
+
+    # agente MCP: orçamento de tokens do histórico enviado ao modelo
+    HISTORY_MAX_TOKENS = int(os.getenv('HISTORY_MAX_TOKENS', '12000'))
+    HISTORY_TOOL_OUTPUT_TOKENS = int(os.getenv('HISTORY_TOOL_OUTPUT_TOKENS', '200'))
+    HISTORY_SUMMARY = os.getenv('HISTORY_SUMMARY', 'false').lower() in ('1', 'true', 'sim')
     
     @classmethod
     def get_database_url(cls):
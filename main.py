@@ -1,32 +1,43 @@
 import asyncio
+import uuid
 from langchain_mcp_adapters.client import MultiServerMCPClient
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.prebuilt import create_react_agent
 from prompts import AGENT_SYSTEM_PROMPT
 from mcp_serves import MCP_SERVERS_CONFIG
 from langchain.chat_models import init_chat_model
+from agent_mcp.history import HistoryPolicy
+from agent_mcp.checkpoint import create_checkpointer
+from config_db import config as app_config
 
 async def main():
     
-    memoria = MemorySaver()
+    memoria = create_checkpointer()
     print('Memória criada:', memoria)
     model = init_chat_model("gemini-2.5-flash", model_provider="google_genai")
     mcp_client = MultiServerMCPClient(MCP_SERVERS_CONFIG)
     tools = await mcp_client.get_tools()
     
+    historico = HistoryPolicy(
+        max_tokens=app_config.HISTORY_MAX_TOKENS,
+        tool_output_tokens=app_config.HISTORY_TOOL_OUTPUT_TOKENS,
+        summary_model=model if app_config.HISTORY_SUMMARY else None
+    )
+
     agent_executor = create_react_agent(
         model=model,
         tools=tools,
-        system_prompt=AGENT_SYSTEM_PROMPT,
-        memory=memoria,
+        prompt=AGENT_SYSTEM_PROMPT,
+        checkpointer=memoria,
+        pre_model_hook=historico.as_hook(),
     )
     print('Agent executor:', agent_executor)
     print('Tools:', [tool.name for tool in tools])
     
-    config = {'configurable': {'thread_id': '1'}}
+    # Uma thread por execução do CLI; 'limpar' inicia uma conversa nova
+    config = {'configurable': {'thread_id': uuid.uuid4().hex}}
     
     print("\n=== Agente de Pesquisa Iniciado ===")
-    print("Digite 'sair' para encerrar")
+    print("Digite 'sair' para encerrar ou 'limpar' para nova conversa")
     print("=" * 40)
 
     while True:
@@ -40,6 +51,12 @@ async def main():
             if not user_input:
                 print("Por favor, digite uma pergunta.")
                 continue
+
+            if user_input.lower() == 'limpar':
+                memoria.delete_thread(config['configurable']['thread_id'])
+                config = {'configurable': {'thread_id': uuid.uuid4().hex}}
+                print("Conversa reiniciada.")
+                continue
             
             input_message = {
                 'role': 'user',
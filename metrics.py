@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+BUCKETS_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BUCKETS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def _escapa(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _formata_labels(nomes: Sequence[str], valores: Tuple, extra: str = "") -> str:
+    partes = [f'{n}="{_escapa(v)}"' for n, v in zip(nomes, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _formata_valor(valor: float) -> str:
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) and not valor.is_integer() else str(int(valor))
+
+
+class _Metrica:
+    """
+    Base das métricas: cada thread atualiza o seu próprio shard (sem lock no
+    caminho quente); a coleta soma os shards de todas as threads.
+    """
+    tipo = ""
+
+    def __init__(self, nome: str, ajuda: str, labels: Sequence[str] = ()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.labels = tuple(labels)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._lock = threading.Lock()  # só para registrar o shard de uma thread nova
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def _chave(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def _cabecalho(self) -> List[str]:
+        return [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+
+
+class Counter(_Metrica):
+    tipo = "counter"
+
+    def inc(self, valor: float = 1, **labels: str):
+        shard = self._shard()
+        chave = self._chave(labels)
+        shard[chave] = shard.get(chave, 0) + valor
+
+    def valor(self, **labels: str) -> float:
+        chave = self._chave(labels)
+        with self._lock:
+            shards = list(self._shards)
+        return sum(s.get(chave, 0) for s in shards)
+
+    def coleta(self) -> Dict[Tuple, float]:
+        with self._lock:
+            shards = list(self._shards)
+        total: Dict[Tuple, float] = {}
+        for shard in shards:
+            for chave, valor in list(shard.items()):
+                total[chave] = total.get(chave, 0) + valor
+        return total
+
+    def render(self) -> List[str]:
+        linhas = self._cabecalho()
+        for chave, valor in sorted(self.coleta().items()):
+            linhas.append(f"{self.nome}{_formata_labels(self.labels, chave)} {_formata_valor(valor)}")
+        return linhas
+
+
+class Gauge(_Metrica):
+    """Valor instantâneo; pode ser definido diretamente ou calculado na coleta"""
+    tipo = "gauge"
+
+    def __init__(self, nome: str, ajuda: str, labels: Sequence[str] = ()):
+        super().__init__(nome, ajuda, labels)
+        self._valores: Dict[Tuple, float] = {}
+        self._funcoes: Dict[Tuple, Callable[[], float]] = {}
+
+    def set(self, valor: float, **labels: str):
+        self._valores[self._chave(labels)] = valor
+
+    def set_function(self, funcao: Callable[[], float], **labels: str):
+        self._funcoes[self._chave(labels)] = funcao
+
+    def render(self) -> List[str]:
+        linhas = self._cabecalho()
+        valores = dict(self._valores)
+        for chave, funcao in list(self._funcoes.items()):
+            try:
+                valores[chave] = funcao()
+            except Exception:
+                continue
+        for chave, valor in sorted(valores.items()):
+            linhas.append(f"{self.nome}{_formata_labels(self.labels, chave)} {_formata_valor(valor)}")
+        return linhas
+
+
+class Histogram(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nome: str, ajuda: str, labels: Sequence[str] = (), buckets: Iterable[float] = BUCKETS_PADRAO):
+        super().__init__(nome, ajuda, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, valor: float, **labels: str):
+        shard = self._shard()
+        chave = self._chave(labels)
+        contagens = shard.get(chave)
+        if contagens is None:
+            # [contagem por bucket..., +Inf, soma]
+            contagens = shard[chave] = [0] * (len(self.buckets) + 2)
+        contagens[bisect.bisect_left(self.buckets, valor)] += 1
+        contagens[-1] += valor
+
+    @contextmanager
+    def time(self, **labels: str):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - inicio, **labels)
+
+    def coleta(self) -> Dict[Tuple, List[float]]:
+        with self._lock:
+            shards = list(self._shards)
+        total: Dict[Tuple, List[float]] = {}
+        for shard in shards:
+            for chave, contagens in list(shard.items()):
+                acumulado = total.setdefault(chave, [0] * len(contagens))
+                for i, valor in enumerate(list(contagens)):
+                    acumulado[i] += valor
+        return total
+
+    def render(self) -> List[str]:
+        linhas = self._cabecalho()
+        for chave, contagens in sorted(self.coleta().items()):
+            acumulado = 0
+            for limite, contagem in zip((*self.buckets, float("inf")), contagens[:-1]):
+                acumulado += contagem
+                le = 'le="' + _formata_valor(limite) + '"'
+                linhas.append(f"{self.nome}_bucket{_formata_labels(self.labels, chave, le)} {acumulado}")
+            labels = _formata_labels(self.labels, chave)
+            linhas.append(f"{self.nome}_sum{labels} {_formata_valor(contagens[-1])}")
+            linhas.append(f"{self.nome}_count{labels} {acumulado}")
+        return linhas
+
+
+class Registry:
+    """Registro das métricas do processo, exportadas no formato texto do Prometheus"""
+    def __init__(self):
+        self._metricas: Dict[str, _Metrica] = {}
+        self._lock = threading.Lock()
+
+    def _registra(self, metrica: _Metrica) -> _Metrica:
+        with self._lock:
+            return self._metricas.setdefault(metrica.nome, metrica)
+
+    def counter(self, nome: str, ajuda: str, labels: Sequence[str] = ()) -> Counter:
+        return self._registra(Counter(nome, ajuda, labels))
+
+    def gauge(self, nome: str, ajuda: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._registra(Gauge(nome, ajuda, labels))
+
+    def histogram(self, nome: str, ajuda: str, labels: Sequence[str] = (),
+                  buckets: Iterable[float] = BUCKETS_PADRAO) -> Histogram:
+        return self._registra(Histogram(nome, ajuda, labels, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metricas = list(self._metricas.values())
+        linhas = []
+        for metrica in metricas:
+            linhas.extend(metrica.render())
+        return "\n".join(linhas) + "\n"
+
+
+registry = Registry()
+
+# Cache persistente do agente de banco (tabela cache_agente)
+CACHE_CONSULTAS = registry.counter(
+    "agent_db_cache_requests_total", "Consultas ao cache persistente por resultado", ["resultado"])
+CACHE_LATENCIA = registry.histogram(
+    "agent_db_cache_operation_seconds", "Latência das operações no cache persistente", ["operacao"])
+CACHE_POOL_CONEXOES = registry.gauge(
+    "agent_db_cache_pool_connections", "Conexões do pool do CacheManager", ["estado"])
+CACHE_REVALIDACOES = registry.counter(
+    "agent_db_cache_revalidations_total", "Respostas expiradas refeitas em segundo plano", ["resultado"])
+CACHE_EXPIRADAS_REMOVIDAS = registry.counter(
+    "agent_db_cache_expired_deleted_total", "Entradas expiradas removidas pela varredura")
+CACHE_L1_CONSULTAS = registry.counter(
+    "agent_db_cache_l1_requests_total", "Consultas ao L1 em memória por resultado", ["resultado"])
+CACHE_L1_ITENS = registry.gauge("agent_db_cache_l1_items", "Entradas no L1 em memória")
+CACHE_L1_BYTES = registry.gauge("agent_db_cache_l1_bytes", "Bytes de respostas no L1 em memória")
+CACHE_ENTRADAS = registry.gauge(
+    "agent_db_cache_entries", "Entradas na cache_agente por estado (estatística incremental)", ["estado"])
+CACHE_BYTES = registry.gauge("agent_db_cache_bytes", "Bytes de respostas gravados na cache_agente")
+CACHE_TTL = registry.histogram(
+    "agent_db_cache_ttl_seconds", "TTL escolhido para as respostas gravadas por classe de volatilidade", ["classe"],
+    buckets=(300, 900, 3600, 4 * 3600, 86400, 7 * 86400, 30 * 86400, 90 * 86400))
+
+# Cache em memória e rate limiter do AgentTools
+SMART_CACHE_CONSULTAS = registry.counter(
+    "smart_cache_requests_total", "Consultas ao SmartCache por resultado", ["resultado"])
+SMART_CACHE_ITENS = registry.gauge("smart_cache_items", "Itens no SmartCache")
+SMART_CACHE_HIT_RATIO = registry.gauge("smart_cache_hit_ratio", "Proporção de acertos do SmartCache")
+RATE_LIMIT_REJEICOES = registry.counter(
+    "rate_limiter_rejections_total", "Requisições recusadas pelo RateLimiter", ["limite"])
+
+# Agente SQL
+SQL_AGENT_ITERACOES = registry.histogram(
+    "sql_agent_iterations", "Passos (ações) do agente SQL por pergunta", buckets=(1, 2, 3, 5, 8, 13, 21))
+LLM_CHAMADAS = registry.counter("llm_calls_total", "Chamadas ao LLM", ["modelo", "status"])
+LLM_LATENCIA = registry.histogram("llm_call_seconds", "Latência das chamadas ao LLM", ["modelo"])
+SQL_EXECUCAO = registry.histogram("sql_execution_seconds", "Tempo de execução das consultas SQL", ["status"])
+
+# Streams SSE dos endpoints
+SSE_DURACAO = registry.histogram("sse_stream_seconds", "Duração dos streams SSE", ["endpoint"])
+SSE_BYTES = registry.histogram(
+    "sse_stream_bytes", "Bytes enviados por stream SSE", ["endpoint"], buckets=BUCKETS_BYTES)
+SSE_ATIVOS = registry.gauge("sse_streams_active", "Streams SSE em andamento", ["endpoint"])
+
+
+_sse_ativos: Dict[str, int] = {}
+
+
+def instrumenta_sse(endpoint: str, generator):
+    """Envolve o gerador do StreamingResponse medindo duração, bytes e streams ativos"""
+    async def _medido():
+        inicio = time.perf_counter()
+        enviados = 0
+        _sse_ativos[endpoint] = _sse_ativos.get(endpoint, 0) + 1
+        SSE_ATIVOS.set(_sse_ativos[endpoint], endpoint=endpoint)
+        try:
+            async for chunk in generator:
+                enviados += len(chunk.encode("utf-8")) if isinstance(chunk, str) else len(chunk)
+                yield chunk
+        finally:
+            _sse_ativos[endpoint] -= 1
+            SSE_ATIVOS.set(_sse_ativos[endpoint], endpoint=endpoint)
+            SSE_DURACAO.observe(time.perf_counter() - inicio, endpoint=endpoint)
+            SSE_BYTES.observe(enviados, endpoint=endpoint)
+
+    return _medido()
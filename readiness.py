@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+PENDENTE = "pendente"
+INICIALIZANDO = "inicializando"
+PRONTO = "pronto"
+ERRO = "erro"
+
+
+class ComponentStatus:
+    """Estado de inicialização de um componente do servidor"""
+    def __init__(self, nome: str):
+        self.nome = nome
+        self.estado = PENDENTE
+        self.duracao_s: Optional[float] = None
+        self.erro: Optional[str] = None
+        self._inicio: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        duracao = self.duracao_s
+        if self.estado == INICIALIZANDO and self._inicio is not None:
+            duracao = time.monotonic() - self._inicio
+        return {
+            'estado': self.estado,
+            'duracao_s': round(duracao, 3) if duracao is not None else None,
+            'erro': self.erro
+        }
+
+
+class Readiness:
+    """
+    Registro de prontidão dos componentes (agentes) do servidor.
+    Cada componente é inicializado de forma independente e registra
+    estado, duração e erro para os endpoints /healthz e /readyz.
+    """
+    def __init__(self, *componentes: str):
+        self.componentes: Dict[str, ComponentStatus] = {nome: ComponentStatus(nome) for nome in componentes}
+
+    async def inicializa(self, nome: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Executa a inicialização do componente; em caso de erro retorna None"""
+        status = self.componentes[nome]
+        status.estado = INICIALIZANDO
+        status._inicio = time.monotonic()
+        try:
+            resultado = await fn()
+        except asyncio.CancelledError:
+            status.estado = ERRO
+            status.erro = "inicialização cancelada"
+            raise
+        except Exception as e:
+            status.estado = ERRO
+            status.erro = f"{type(e).__name__}: {e}"
+            print(f"❌ {nome}: erro na inicialização ({status.erro})")
+            return None
+        finally:
+            status.duracao_s = time.monotonic() - status._inicio
+        status.estado = PRONTO
+        print(f"✅ {nome} pronto em {status.duracao_s:.2f}s")
+        return resultado
+
+    def estado(self, nome: str) -> str:
+        return self.componentes[nome].estado
+
+    def inicializando(self, nome: str) -> bool:
+        return self.componentes[nome].estado in (PENDENTE, INICIALIZANDO)
+
+    def pronto(self) -> bool:
+        return all(c.estado == PRONTO for c in self.componentes.values())
+
+    def stats(self) -> dict:
+        if self.pronto():
+            geral = PRONTO
+        elif any(c.estado in (PENDENTE, INICIALIZANDO) for c in self.componentes.values()):
+            geral = INICIALIZANDO
+        else:
+            geral = "degradado"
+        return {
+            'status': geral,
+            'componentes': {nome: c.to_dict() for nome, c in self.componentes.items()}
+        }
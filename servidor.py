@@ -1,19 +1,31 @@
 import asyncio
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi import FastAPI, Request
 from contextlib import asynccontextmanager
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 from langchain_mcp_adapters.client import MultiServerMCPClient
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.prebuilt import create_react_agent
 from prompts import AGENT_SYSTEM_PROMPT
 from mcp_serves import MCP_SERVERS_CONFIG
 from langchain.chat_models import init_chat_model
+from langchain_core.messages import AIMessageChunk, ToolMessage
 from agent_db.core import AgentDB
+from agent_db.callbacks import MetricsCallbackHandler
+from agent_db.cache.async_manager import AsyncCacheManager
+from agent_db.tracing import novo_request_id, request_id_var, tracer
+from admission import AdmissionController, AdmissionRejected
+from readiness import Readiness
+from metrics import instrumenta_sse, registry
+from cassettes import fecha_cassetes, ferramentas_cassete, modelo_cassete
+from agent_mcp.history import HistoryPolicy
+from agent_mcp.checkpoint import create_checkpointer
+from config_db import config as app_config
 import json
 import os
-import asyncio
+import re
+import time
+import uuid
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -30,57 +42,152 @@ templates = Jinja2Templates(directory="templates")
 
 agent_executor = None
 agent_db = None
-config = {'configurable': {'thread_id': '1'}}
+memoria = None
+historico = None
+
+# Cada navegador/cliente tem sua própria thread de conversa
+SESSION_COOKIE = "sessao_id"
+SESSION_HEADER = "X-Session-Id"
+SESSION_ID_RE = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+REQUEST_ID_HEADER = "X-Request-Id"
+
+# Admissão por endpoint: limite de execuções, fila limitada e timeout de espera
+admissao = {
+    "/pergunta": AdmissionController(
+        "/pergunta",
+        max_concurrent=app_config.ADMISSION_PERGUNTA_MAX_CONCURRENT,
+        max_queue=app_config.ADMISSION_PERGUNTA_MAX_QUEUE,
+        queue_timeout=app_config.ADMISSION_QUEUE_TIMEOUT
+    ),
+    "/pergunta_db": AdmissionController(
+        "/pergunta_db",
+        max_concurrent=app_config.ADMISSION_PERGUNTA_DB_MAX_CONCURRENT,
+        max_queue=app_config.ADMISSION_PERGUNTA_DB_MAX_QUEUE,
+        queue_timeout=app_config.ADMISSION_QUEUE_TIMEOUT
+    ),
+}
+
+# Estado de inicialização de cada agente (/healthz e /readyz)
+prontidao = Readiness("agente_mcp", "agente_db")
 
 class perguntaInput(BaseModel):
     pergunta: str
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    global agent_executor, agent_db
-    print("🚀 Inicializando agentes...")
-    
-    # Inicializar agente MCP
+async def _reune(*etapas):
+    """
+    Roda as etapas de inicialização em paralelo; se alguma falhar, libera o
+    que as outras já abriram (pool, conexões) antes de propagar o erro
+    """
+    resultados = await asyncio.gather(*etapas, return_exceptions=True)
+    falhas = [r for r in resultados if isinstance(r, BaseException)]
+    if falhas:
+        for recurso in resultados:
+            if not isinstance(recurso, BaseException):
+                await _fecha(recurso)
+        raise falhas[0]
+    return resultados
+
+async def _fecha(recurso):
     try:
-        print("🔄 Inicializando agente MCP...")
-        memoria = MemorySaver()
-        model = init_chat_model("gemini-2.5-flash", model_provider="google_genai")
-        print("✅ Modelo LLM inicializado")
-        
+        if hasattr(recurso, "aclose"):
+            await recurso.aclose()
+        elif hasattr(recurso, "close"):
+            await asyncio.to_thread(recurso.close)
+    except Exception as e:
+        print(f"⚠️ Erro ao liberar recurso da inicialização: {e}")
+
+async def _init_agente_mcp():
+    global agent_executor, memoria, historico
+    print("🔄 Inicializando agente MCP...")
+    # Com CASSETTE_MODE=replay, modelo e tools vêm do cassete (sem Gemini/Smithery)
+    model = modelo_cassete("agente_mcp", lambda: init_chat_model("gemini-2.5-flash", model_provider="google_genai"))
+    print("✅ Modelo LLM inicializado")
+    
+    async def obter_tools():
         mcp_client = MultiServerMCPClient(MCP_SERVERS_CONFIG)
         print("✅ MCP Client criado")
-        
-        tools = await mcp_client.get_tools()
-        print(f"✅ Tools obtidas: {len(tools)} ferramentas")
-        
-        agent_executor = create_react_agent(
-            model=model,
-            tools=tools,
-            system_prompt=AGENT_SYSTEM_PROMPT,
-            memory=memoria,
-        )
-        print("✅ Agente MCP pronto com tools:", [t.name for t in tools])
-        
-    except Exception as mcp_error:
-        print(f"❌ Erro ao inicializar agente MCP: {mcp_error}")
-        print(f"❌ Tipo do erro MCP: {type(mcp_error).__name__}")
-        print("⚠️ Continuando sem o agente MCP...")
-        agent_executor = None
+        return await mcp_client.get_tools()
     
-    # Inicializar agente de banco de dados
+    # Checkpointer (pode conectar ao Postgres) e tools (rede) em paralelo
+    memoria, tools = await _reune(
+        asyncio.to_thread(create_checkpointer),
+        ferramentas_cassete("agente_mcp", obter_tools)
+    )
+    print(f"✅ Tools obtidas: {len(tools)} ferramentas")
+    
+    historico = HistoryPolicy(
+        max_tokens=app_config.HISTORY_MAX_TOKENS,
+        tool_output_tokens=app_config.HISTORY_TOOL_OUTPUT_TOKENS,
+        summary_model=model if app_config.HISTORY_SUMMARY else None
+    )
+
+    agent_executor = create_react_agent(
+        model=model,
+        tools=tools,
+        prompt=AGENT_SYSTEM_PROMPT,
+        checkpointer=memoria,
+        pre_model_hook=historico.as_hook(),
+    )
+    print("✅ Agente MCP pronto com tools:", [t.name for t in tools])
+
+async def _init_agente_db():
+    global agent_db
+    print("🔄 Inicializando agente de banco de dados...")
+    # Pool assíncrono do cache (hits direto no event loop) em paralelo com a
+    # conexão, limpeza do cache e reflexão do schema, que são bloqueantes
+    cache_async, agente = await _reune(
+        abrir_cache_async(),
+        asyncio.to_thread(AgentDB)
+    )
+    if cache_async:
+        cache_async.compartilha(agente.cache_manager)
+    agente.async_cache = cache_async
+    agent_db = agente
+
+async def abrir_cache_async():
+    """Sem o pool assíncrono o agente continua consultando o cache pelo executor"""
     try:
-        print("🔄 Inicializando agente de banco de dados...")
-        agent_db = AgentDB()
-        print("✅ Agente de Banco de Dados inicializado")
-    except Exception as db_error:
-        print(f"❌ Erro ao inicializar agente de banco: {db_error}")
-        print(f"❌ Tipo do erro DB: {type(db_error).__name__}")
-        print("⚠️ Continuando sem o agente de banco de dados...")
-        agent_db = None
+        return await AsyncCacheManager().abre()
+    except Exception as e:
+        print(f"⚠️ Cache assíncrono indisponível, usando o caminho síncrono: {e}")
+        return None
+
+async def inicializar_agentes():
+    """Inicializa os dois agentes em paralelo; a falha de um não impede o outro"""
+    inicio = time.monotonic()
+    await asyncio.gather(
+        prontidao.inicializa("agente_mcp", _init_agente_mcp),
+        prontidao.inicializa("agente_db", _init_agente_db),
+    )
+    print(f"🚀 Inicialização concluída em {time.monotonic() - inicio:.2f}s: {prontidao.stats()['status']}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    print("🚀 Inicializando agentes...")
+    
+    tarefa_inicializacao = None
+    if app_config.LAZY_STARTUP:
+        # Porta aberta imediatamente; /readyz indica quando os agentes estão prontos
+        tarefa_inicializacao = asyncio.create_task(inicializar_agentes())
+    else:
+        await inicializar_agentes()
 
     yield  
 
     print("🛑 Finalizando aplicação")
+    if tarefa_inicializacao and not tarefa_inicializacao.done():
+        tarefa_inicializacao.cancel()
+        try:
+            await tarefa_inicializacao
+        except asyncio.CancelledError:
+            pass
+    if agent_db:
+        agent_db.close()
+        if agent_db.async_cache:
+            await agent_db.async_cache.aclose()
+    if memoria and hasattr(memoria, 'close'):
+        memoria.close()
+    fecha_cassetes()
 
 # Criar o app com lifespan
 app = FastAPI(lifespan=lifespan)
@@ -105,63 +212,193 @@ async def read_agente_db(request: Request):
     print("Template agente_db renderizado com Sucesso")
     return templates.TemplateResponse("agente_db.html", {"request": request})
 
+def eventos_delta(mensagem, max_preview: int = 500):
+    """Converte um chunk do stream_mode='messages' em eventos tipados para o SSE"""
+    eventos = []
+    if isinstance(mensagem, AIMessageChunk):
+        for tool_call in mensagem.tool_call_chunks:
+            # O nome da ferramenta chega apenas no primeiro chunk da chamada
+            if tool_call.get("name"):
+                eventos.append({"type": "tool_call", "name": tool_call["name"]})
+        texto = mensagem.text()
+        if texto:
+            eventos.append({"type": "token", "content": texto})
+    elif isinstance(mensagem, ToolMessage):
+        conteudo = str(mensagem.content)
+        eventos.append({
+            "type": "tool_result",
+            "name": mensagem.name,
+            "content": conteudo[:max_preview],
+            "tamanho": len(conteudo)
+        })
+    return eventos
+
+def obter_sessao(request: Request):
+    """Retorna (sessao_id, nova) a partir do header ou cookie, emitindo um id novo se preciso"""
+    sessao_id = request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE)
+    if sessao_id and SESSION_ID_RE.match(sessao_id):
+        return sessao_id, False
+    return uuid.uuid4().hex, True
+
+def anexar_sessao(response, sessao_id: str, nova: bool):
+    response.headers[SESSION_HEADER] = sessao_id
+    if nova:
+        response.set_cookie(SESSION_COOKIE, sessao_id, httponly=True, samesite="lax")
+    return response
+
+def resposta_sobrecarga(endpoint: str, erro: AdmissionRejected) -> JSONResponse:
+    print(f"⛔ {endpoint}: requisição recusada ({erro.motivo})")
+    return JSONResponse(
+        {"erro": f"Servidor ocupado: {erro.motivo}. Tente novamente em {erro.retry_after}s.",
+         "retry_after": erro.retry_after},
+        status_code=429,
+        headers={"Retry-After": str(erro.retry_after)}
+    )
+
+def resposta_inicializando(componente: str) -> JSONResponse:
+    """Agente ainda em inicialização (startup preguiçoso): o cliente deve tentar de novo"""
+    return JSONResponse(
+        {"erro": f"{componente} ainda está inicializando. Tente novamente em instantes.",
+         "prontidao": prontidao.stats()},
+        status_code=503,
+        headers={"Retry-After": "5"}
+    )
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: o processo está de pé e respondendo"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: estado, duração e erro da inicialização de cada agente"""
+    status = prontidao.stats()
+    return JSONResponse(status, status_code=200 if prontidao.pronto() else 503)
+
+@app.get("/metrics")
+async def metricas():
+    """Métricas do processo no formato texto do Prometheus"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/admissao")
+async def status_admissao():
+    return {endpoint: controle.stats() for endpoint, controle in admissao.items()}
+
+@app.post("/clear")
+async def limpar_sessao(request: Request):
+    sessao_id, nova = obter_sessao(request)
+    if memoria and not nova:
+        await memoria.adelete_thread(sessao_id)
+        print(f"🧹 Sessão {sessao_id} limpa")
+    return anexar_sessao(JSONResponse({"status": "ok"}), sessao_id, nova)
+
 @app.post("/pergunta")
-async def fazer_pergunta(pergunta: perguntaInput):
+async def fazer_pergunta(pergunta: perguntaInput, request: Request):
     global agent_executor
     
+    if prontidao.inicializando("agente_mcp"):
+        return resposta_inicializando("agente_mcp")
+    
     if agent_executor is None:
         async def error_generator():
-            yield "data: Erro: Agente não foi inicializado corretamente\n\n"
+            erro = {'type': 'error', 'content': 'Erro: Agente não foi inicializado corretamente'}
+            yield f"data: {json.dumps(erro, ensure_ascii=False)}\n\n"
             yield "data: [DONE]\n\n"
         return StreamingResponse(error_generator(), media_type="text/event-stream")
     
+    try:
+        vaga = await admissao["/pergunta"].acquire()
+    except AdmissionRejected as erro:
+        return resposta_sobrecarga("/pergunta", erro)
+    
     pergunta_texto = pergunta.pergunta
-    print(f"📝 Pergunta recebida: {pergunta_texto}")
+    sessao_id, nova = obter_sessao(request)
+    # Chamadas e latência do modelo nas mesmas métricas llm_* do agente SQL
+    config = {'configurable': {'thread_id': sessao_id}, 'callbacks': [MetricsCallbackHandler()]}
+    print(f"📝 Pergunta recebida ({sessao_id}): {pergunta_texto}")
     
     async def response_generator():
         try:
-            async for step in agent_executor.astream(
+            # Modo delta: cada evento carrega apenas o conteúdo novo
+            async for mensagem, _metadata in agent_executor.astream(
                 {'messages': [{'role': 'user', 'content': pergunta_texto}]},
                 config,
-                stream_mode='values'
+                stream_mode='messages'
             ):
-                if 'messages' in step and step['messages']:
-                    msg = step['messages'][-1]
-                    resposta_final = getattr(msg, "content", str(msg))
-                    
-                    if resposta_final and resposta_final.strip():
-                        print(f'📤 Enviando: {resposta_final[:100]}...')
-                        
-                        # Limpar e formatar a resposta
-                        resposta_limpa = str(resposta_final).strip()
-                        yield f"data: {resposta_limpa}\n\n"
-                        
-                        await asyncio.sleep(0.1)
+                for evento in eventos_delta(mensagem):
+                    yield f"data: {json.dumps(evento, ensure_ascii=False)}\n\n"
             
-            # Sinalizar fim da resposta
+            # Sinalizar fim da resposta com a economia de tokens do histórico
+            final = {'type': 'final', 'historico': historico.last_report(sessao_id) if historico else None}
+            yield f"data: {json.dumps(final)}\n\n"
             yield "data: [DONE]\n\n"
             print("✅ Resposta completa enviada")
             
         except Exception as e:
             print(f"❌ Erro durante processamento: {e}")
-            yield f"data: Erro: {str(e)}\n\n"
+            yield f"data: {json.dumps({'type': 'error', 'content': f'Erro: {str(e)}'}, ensure_ascii=False)}\n\n"
             yield "data: [DONE]\n\n"
     
-    return StreamingResponse(
-        response_generator(), 
+    response = StreamingResponse(
+        vaga.bind(instrumenta_sse("/pergunta", response_generator())), 
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
             "Access-Control-Allow-Origin": "*",
+            "X-Queue-Wait": f"{vaga.espera:.3f}",
         }
     )
+    return anexar_sessao(response, sessao_id, nova)
+
+@app.get("/agente_db/fila")
+async def fila_agente_db():
+    if not agent_db:
+        return {"disponivel": False}
+    return {"disponivel": True, **agent_db.queue_stats()}
+
+@app.get("/agente_db/cache")
+async def cache_agente_db():
+    """Estatísticas do cache persistente sem bloquear o event loop"""
+    if not agent_db:
+        return {"disponivel": False}
+    semantico = agent_db.semantico.stats() if agent_db.semantico else None
+    varredura = agent_db.varredura.stats()
+    dependencias = agent_db.dependencias.stats()
+    if agent_db.async_cache:
+        return {"disponivel": True, **await agent_db.async_cache.astats(),
+                "pool": agent_db.async_cache.pool_stats(), "l1": agent_db.cache_manager.l1_stats(),
+                "semantico": semantico, "varredura": varredura,
+                "dependencias": dependencias}
+    stats = await asyncio.to_thread(agent_db.cache_manager.get_stats)
+    return {"disponivel": True, **stats, "pool": agent_db.cache_manager.pool_stats(),
+            "l1": agent_db.cache_manager.l1_stats(), "semantico": semantico, "varredura": varredura,
+            "dependencias": dependencias}
+
+@app.get("/agente_db/traces")
+async def traces_agente_db(limite: int = 20):
+    """Spans das últimas requisições do agente de banco (cache, LLM, SQL)"""
+    return tracer.recentes(limite)
 
 @app.post("/pergunta_db")
-async def fazer_pergunta_db(pergunta: perguntaInput):
+async def fazer_pergunta_db(pergunta: perguntaInput, request: Request):
     global agent_db
     
+    if prontidao.inicializando("agente_db"):
+        return resposta_inicializando("agente_db")
+    
+    try:
+        vaga = await admissao["/pergunta_db"].acquire()
+    except AdmissionRejected as erro:
+        return resposta_sobrecarga("/pergunta_db", erro)
+    
+    request_id = request.headers.get(REQUEST_ID_HEADER, "")
+    if not SESSION_ID_RE.match(request_id):
+        request_id = novo_request_id()
+    
     async def generate():
+        # Spans do workflow ficam associados a esta requisição
+        request_id_var.set(request_id)
         try:
             if not agent_db:
                 error_chunk = {
@@ -171,61 +408,20 @@ async def fazer_pergunta_db(pergunta: perguntaInput):
                 yield f"data: {json.dumps(error_chunk)}\n\n"
                 return
             
-            # Executar o workflow do agente de banco de dados
-            result = agent_db.run(pergunta.pergunta)
-            
-            # Função para criar streaming mais natural
-            def create_natural_chunks(text):
-                """Divide o texto em chunks naturais para streaming"""
-                import re
-                
-                # Dividir por sentenças, mantendo pontuação
-                sentences = re.split(r'(?<=[.!?])\s+', text)
-                chunks = []
-                
-                for sentence in sentences:
-                    if len(sentence) > 100:
-                        # Para sentenças muito longas, dividir por vírgulas ou outros delimitadores
-                        sub_parts = re.split(r'(?<=[,;:])\s+', sentence)
-                        for part in sub_parts:
-                            if len(part) > 50:
-                                # Para partes ainda muito longas, dividir por palavras
-                                words = part.split(' ')
-                                current_chunk = ""
-                                for word in words:
-                                    if len(current_chunk + word) < 30:
-                                        current_chunk += word + " "
-                                    else:
-                                        if current_chunk.strip():
-                                            chunks.append(current_chunk.strip())
-                                        current_chunk = word + " "
-                                if current_chunk.strip():
-                                    chunks.append(current_chunk.strip())
-                            else:
-                                chunks.append(part)
-                    else:
-                        chunks.append(sentence)
-                
-                return [chunk.strip() for chunk in chunks if chunk.strip()]
-            
-            # Criar chunks naturais
-            chunks = create_natural_chunks(result)
-            
-            # Enviar chunks com timing variável para simular escrita humana
-            for i, chunk in enumerate(chunks):
-                # Calcular delay baseado no tamanho do chunk
-                delay = min(0.05 + len(chunk) * 0.01, 0.3)
-                
-                chunk_data = {
-                    "type": "content",
-                    "content": chunk,
-                    "is_complete": False
-                }
-                yield f"data: {json.dumps(chunk_data)}\n\n"
-                await asyncio.sleep(delay)
-            
-            # Enviar sinal de fim
-            yield f"data: {json.dumps({'type': 'end', 'is_complete': True})}\n\n"
+            # Encaminhar tokens e passos do agente assim que são produzidos
+            async for evento in agent_db.astream(pergunta.pergunta):
+                if evento["type"] == "final":
+                    # Sinal de fim com a resposta completa (única mensagem em cache hit)
+                    end_chunk = {
+                        "type": "end",
+                        "content": evento["content"],
+                        "cache_hit": evento["cache_hit"],
+                        "cache_expirado": evento.get("cache_expirado", False),
+                        "is_complete": True
+                    }
+                    yield f"data: {json.dumps(end_chunk)}\n\n"
+                else:
+                    yield f"data: {json.dumps({**evento, 'is_complete': False})}\n\n"
             
         except Exception as e:
             error_chunk = {
@@ -235,12 +431,14 @@ async def fazer_pergunta_db(pergunta: perguntaInput):
             yield f"data: {json.dumps(error_chunk)}\n\n"
     
     return StreamingResponse(
-        generate(),
+        vaga.bind(instrumenta_sse("/pergunta_db", generate())),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
             "Access-Control-Allow-Origin": "*",
+            "X-Queue-Wait": f"{vaga.espera:.3f}",
+            REQUEST_ID_HEADER: request_id,
         }
     )
 